@@ -1,58 +1,128 @@
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-import models
-from database import get_db
-
-SECRET_KEY = "your-secret-key-here-change-in-production"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def get_user(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
-
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.password_hash):
-        return False
-    return user
-
-def create_access_token(data: dict, expires_delta: timedelta = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = get_user(db, username)
-    if user is None:
-        raise credentials_exception
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from jose import JWTError, jwt
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+from database import User, run_db
+from passwords import verify_password, get_password_hash, verify_password_async, get_password_hash_async
+from room_directory import CLUSTERED
+
+SECRET_KEY = "your-secret-key-here-change-in-production"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Decoded tokens and user snapshots are cached so authenticated requests and
+# WebSocket connects usually skip both the JWT decode and the DB lookup.
+# Profiles are dropped whenever the user's row changes (skins, stats flushes).
+# In a cluster other nodes change rows without telling this one, so the
+# profile cache is off there; a token always names the same user, so the
+# token cache stays on.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = 60
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+class TTLCache:
+    # Bounded LRU whose entries also expire
+    def __init__(self, max_size: int, ttl: float, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled  # when off, every get misses and nothing is stored
+        self.items: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self.items[key]
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        if not self.enabled:
+            return
+        self.items[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+    
+    def pop(self, key):
+        self.items.pop(key, None)
+
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)  # token -> username
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, enabled=not CLUSTERED)  # username -> detached User
+
+def get_user(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+async def authenticate_user(username: str, password: str):
+    user = await run_db(get_user, username)
+    if not user or not await verify_password_async(password, user.password_hash):
+        return False
+    return user
+
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def username_for_token(token: str) -> Optional[str]:
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    # Never keep a token past its own expiry
+    ttl = min(TOKEN_CACHE_TTL, payload.get("exp", 0) - time.time())
+    if ttl > 0:
+        token_cache.set(token, username, ttl)
+    return username
+
+async def user_for_token(token: str) -> Optional[User]:
+    # The returned User is a shared snapshot; treat it as read-only
+    username = username_for_token(token)
+    if username is None:
+        return None
+    
+    user = profile_cache.get(username)
+    if user is None:
+        user = await run_db(get_user, username)
+        if user is None:
+            return None
+        profile_cache.set(username, user)
+    return user
+
+def invalidate_user(username: str):
+    profile_cache.pop(username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = await user_for_token(token)
+    if user is None:
+        raise credentials_exception
     return user
\ No newline at end of file
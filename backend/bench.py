@@ -0,0 +1,191 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from game_logic import Direction, GRID_WIDTH, GRID_HEIGHT, create_room
+from encoders import get_encoder
+from protocol import RoomCodec
+
+# Headless simulation benchmark: builds a room, drives it with seeded random
+# inputs and times GameRoom.update, get_state and get_leaderboard per tick,
+# plus encoding a keyframe and a delta with --encoder. No sockets involved.
+# Save results with --output and compare a later run against them with
+# --compare to catch regressions.
+#
+#   python bench.py --players 50 --length 30 --ticks 2000 --output before.json
+#   python bench.py --players 50 --length 30 --ticks 2000 --compare before.json
+
+DIRECTIONS = list(Direction)
+
+def build_room(config: Dict):
+    room = create_room("bench", max_players=config["players"], engine=config["engine"],
+                       width=config["width"], height=config["height"], food_count=config["foods"],
+                       seed=config["seed"])
+    for i in range(config["players"]):
+        room.add_player(f"bot{i}", f"bot{i}", "default", "#00FF00")
+        room.players[f"bot{i}"].grow_pending = config["length"] - 1
+    return room
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def steer(room, inputs: random.Random, turn_rate: float):
+    for snake in room.players.values():
+        if inputs.random() < turn_rate:
+            snake.update_direction(DIRECTIONS[inputs.randrange(4)])
+
+def run_benchmark(config: Dict) -> Dict:
+    room = build_room(config)
+    if config["encoder"] == "binary":
+        encoder = RoomCodec(room.width, room.height)
+    else:
+        encoder = get_encoder(config["encoder"])
+    inputs = random.Random(config["seed"] + 1)
+    
+    # Let snakes grow to the requested length before measuring
+    for _ in range(config["warmup"]):
+        steer(room, inputs, config["turn_rate"])
+        room.update()
+    room.get_keyframe()
+    
+    update_times, state_times, leaderboard_times, encode_times = [], [], [], []
+    keyframe_bytes, delta_bytes = [], []
+    started = time.perf_counter()
+    for _ in range(config["ticks"]):
+        steer(room, inputs, config["turn_rate"])
+        
+        t0 = time.perf_counter()
+        room.update()
+        t1 = time.perf_counter()
+        state = room.get_state()
+        t2 = time.perf_counter()
+        leaderboard = room.get_leaderboard()
+        t3 = time.perf_counter()
+        
+        update_times.append(t1 - t0)
+        state_times.append(t2 - t1)
+        leaderboard_times.append(t3 - t2)
+        delta = room.get_delta()
+        delta.update(type="game_delta", timestamp=state["timestamp"])
+        
+        t4 = time.perf_counter()
+        keyframe_bytes.append(len(encoder.encode({"type": "game_state", "state": state, "leaderboard": leaderboard})))
+        delta_bytes.append(len(encoder.encode(delta)))
+        encode_times.append(time.perf_counter() - t4)
+    elapsed = time.perf_counter() - started
+    
+    # Separate pass under tracemalloc, which slows everything down
+    tracemalloc.start()
+    alloc_bytes, alloc_blocks = [], []
+    for _ in range(min(config["ticks"], config["alloc_ticks"])):
+        steer(room, inputs, config["turn_rate"])
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        blocks = sys.getallocatedblocks()
+        room.update()
+        room.get_state()
+        room.get_leaderboard()
+        _, peak = tracemalloc.get_traced_memory()
+        alloc_bytes.append(peak - before)
+        alloc_blocks.append(sys.getallocatedblocks() - blocks)
+    tracemalloc.stop()
+    
+    def summary(samples: List[float]) -> Dict:
+        return {
+            "mean_ms": sum(samples) / len(samples) * 1000,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+    
+    total = [a + b + c for a, b, c in zip(update_times, state_times, leaderboard_times)]
+    return {
+        "config": config,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "ticks_per_second": config["ticks"] / elapsed,
+        "tick": summary(total),
+        "update": summary(update_times),
+        "get_state": summary(state_times),
+        "get_leaderboard": summary(leaderboard_times),
+        "encode": summary(encode_times),
+        "alloc_peak_bytes_per_tick": sum(alloc_bytes) / len(alloc_bytes),
+        "net_blocks_per_tick": sum(alloc_blocks) / len(alloc_blocks),
+        "keyframe_bytes_per_tick": sum(keyframe_bytes) / len(keyframe_bytes),
+        "delta_bytes_per_tick": sum(delta_bytes) / len(delta_bytes),
+        "alive_at_end": sum(1 for snake in room.players.values() if snake.alive),
+    }
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> bool:
+    # Lower is better for latencies, higher for throughput
+    ok = True
+    checks = [
+        ("ticks_per_second", result["ticks_per_second"], baseline["ticks_per_second"], True),
+        ("tick p50", result["tick"]["p50_ms"], baseline["tick"]["p50_ms"], False),
+        ("tick p99", result["tick"]["p99_ms"], baseline["tick"]["p99_ms"], False),
+        ("keyframe bytes", result["keyframe_bytes_per_tick"], baseline["keyframe_bytes_per_tick"], False),
+        ("delta bytes", result["delta_bytes_per_tick"], baseline["delta_bytes_per_tick"], False),
+    ]
+    for name, current, previous, higher_is_better in checks:
+        change = (current - previous) / previous if previous else 0.0
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        ok = ok and not regressed
+        print(f"{name:18} {previous:12.3f} -> {current:12.3f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless GameRoom benchmark")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--length", type=int, default=10, help="snake length to grow to during warmup")
+    parser.add_argument("--foods", type=int, default=20)
+    parser.add_argument("--width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--height", type=int, default=GRID_HEIGHT)
+    parser.add_argument("--engine", default="python", choices=["python", "numpy"])
+    parser.add_argument("--encoder", default="json", choices=["json", "orjson", "msgpack", "binary"])
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=None, help="defaults to enough ticks to reach --length")
+    parser.add_argument("--alloc-ticks", type=int, default=200)
+    parser.add_argument("--turn-rate", type=float, default=0.1, help="chance per tick that a snake turns")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the result JSON here")
+    parser.add_argument("--compare", help="baseline result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20)
+    args = parser.parse_args()
+    
+    config = {
+        "players": args.players,
+        "length": args.length,
+        "foods": args.foods,
+        "width": args.width,
+        "height": args.height,
+        "engine": args.engine,
+        "encoder": args.encoder,
+        "ticks": args.ticks,
+        "warmup": args.warmup if args.warmup is not None else args.length * 2,
+        "alloc_ticks": args.alloc_ticks,
+        "turn_rate": args.turn_rate,
+        "seed": args.seed,
+    }
+    result = run_benchmark(config)
+    print(json.dumps(result, indent=2))
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("warning: baseline was run with a different config")
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,194 @@
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from game_logic import GameRoom, Direction, Snake, OPPOSITE
+from metrics import SimulationMetrics
+
+# Server-hosted bot snakes that fill quiet public rooms. A bot is an ordinary
+# player in the room (GameRoom.add_player with bot=True) steered through
+# Snake.update_direction like anyone else; it just has no connection.
+#
+# Bots don't search on their own. Every few ticks, one breadth-first search
+# per room from every food at once gives each cell its distance to the
+# nearest food around snake bodies (the hazard map), and every bot in the
+# room follows that field downhill, away from cells next to other heads.
+#
+# All bots of a simulation share BOT_BUDGET_MS of each tick. Within it they
+# work from a field rebuilt every few ticks; past it, bots keep a stale field
+# a little longer, and once the budget is spent the rest of this tick's bots
+# only dodge what is directly ahead of them. A room whose field costs a big
+# share of the budget rebuilds it less often.
+
+# Public rooms are topped up with bots to this many players while someone is
+# playing in them; 0 turns bots off
+ROOM_BOTS = int(os.environ.get("ROOM_BOTS", "0"))
+BOT_BUDGET_MS = float(os.environ.get("BOT_BUDGET_MS", "2"))
+BOT_FIELD_TICKS = 2  # fastest a room's field is rebuilt
+BOT_FIELD_MAX_TICKS = 32
+BOT_COLORS = ("#E91E63", "#9C27B0", "#3F51B5", "#03A9F4", "#009688", "#8BC34A", "#FFC107", "#FF5722")
+
+DIRECTIONS = list(Direction)
+UNREACHED = 1 << 30
+RISK_PENALTY = 1 << 20  # next to another head: only when nothing else is safe
+
+class DistanceField:
+    def __init__(self, width: int, height: int, neighbours: List[Tuple[int, ...]]):
+        self.width = width
+        self.height = height
+        self.neighbours = neighbours
+        self.distance: List[int] = []
+        self.heads: Set[int] = set()
+        self.seq = -1  # room seq it was built at
+    
+    def build(self, room: GameRoom):
+        neighbours = self.neighbours
+        hazard = bytearray(self.width * self.height)
+        self.heads = set()
+        for snake in room.players.values():
+            for cell in snake.body:
+                hazard[cell] = 1
+            if snake.alive:
+                self.heads.add(snake.body[0])
+        
+        distance = [UNREACHED] * len(hazard)
+        queue = deque()
+        for cell in room.food_cells:
+            if not hazard[cell]:
+                distance[cell] = 0
+                queue.append(cell)
+        while queue:
+            cell = queue.popleft()
+            step = distance[cell] + 1
+            for neighbour in neighbours[cell]:
+                if step < distance[neighbour] and not hazard[neighbour]:
+                    distance[neighbour] = step
+                    queue.append(neighbour)
+        self.distance = distance
+        self.seq = room.seq
+
+class RoomBots:
+    def __init__(self, field: DistanceField):
+        self.field = field
+        self.last_heads: Dict[str, int] = {}  # bot player_id -> head it last steered from
+        self.refresh_ticks = BOT_FIELD_TICKS
+
+class BotController:
+    def __init__(self, metrics: SimulationMetrics, budget_ms: float = BOT_BUDGET_MS):
+        self.metrics = metrics
+        self.budget = budget_ms / 1000
+        self.rooms: Dict[str, RoomBots] = {}
+        self.neighbours: Dict[Tuple[int, int], List[Tuple[int, ...]]] = {}  # (width, height) -> per cell
+        self.rng = random.Random()
+        self.next_bot = 0
+        self.deadline = 0.0
+    
+    def neighbour_table(self, width: int, height: int) -> List[Tuple[int, ...]]:
+        # Cells one step away in DIRECTIONS order, wrapping like Snake.move
+        table = self.neighbours.get((width, height))
+        if table is None:
+            table = []
+            for cell in range(width * height):
+                y, x = divmod(cell, width)
+                table.append(tuple(((y + dy) % height) * width + (x + dx) % width
+                                   for dx, dy in (direction.value for direction in DIRECTIONS)))
+            self.neighbours[(width, height)] = table
+        return table
+    
+    def bots(self, room_id: str) -> Dict[str, int]:
+        room_bots = self.rooms.get(room_id)
+        return room_bots.last_heads if room_bots is not None else {}
+    
+    def new_bot(self, room_id: str, room: GameRoom) -> Tuple[str, str, str]:
+        # (player_id, username, color). Client ids come from a URL path
+        # segment, so they never contain the "/" in a bot's id.
+        room_bots = self.rooms.get(room_id)
+        if room_bots is None:
+            field = DistanceField(room.width, room.height, self.neighbour_table(room.width, room.height))
+            room_bots = self.rooms[room_id] = RoomBots(field)
+        self.next_bot += 1
+        player_id = f"bot/{self.next_bot}"
+        room_bots.last_heads[player_id] = -1
+        return player_id, f"Bot {self.next_bot}", BOT_COLORS[self.next_bot % len(BOT_COLORS)]
+    
+    def remove_bot(self, room_id: str, player_id: str):
+        room_bots = self.rooms[room_id]
+        del room_bots.last_heads[player_id]
+        if not room_bots.last_heads:
+            del self.rooms[room_id]
+    
+    def start_tick(self):
+        self.deadline = time.perf_counter() + self.budget
+    
+    def steer(self, room: GameRoom, room_id: str) -> List[Tuple[str, Direction]]:
+        # Turns for the room's bots that moved to a new cell since they last
+        # steered; the caller applies them like player input
+        room_bots = self.rooms[room_id]
+        field = room_bots.field
+        now = time.perf_counter()
+        if now < self.deadline and room.seq - field.seq >= room_bots.refresh_ticks:
+            field.build(room)
+            cost = time.perf_counter() - now
+            if cost > self.budget / 2:
+                room_bots.refresh_ticks = min(room_bots.refresh_ticks * 2, BOT_FIELD_MAX_TICKS)
+            elif cost < self.budget / 8:
+                room_bots.refresh_ticks = max(room_bots.refresh_ticks // 2, BOT_FIELD_TICKS)
+        
+        turns = []
+        steps = self.metrics.bot_steps
+        last_heads = room_bots.last_heads
+        for player_id, last_head in last_heads.items():
+            snake = room.players[player_id]
+            if not snake.alive or snake.body[0] == last_head:
+                continue
+            last_heads[player_id] = snake.body[0]
+            if field.seq >= 0 and time.perf_counter() < self.deadline:
+                direction = self.smart_direction(room, snake, field)
+                steps["field"] += 1
+            else:
+                direction = self.reflex_direction(room, snake)
+                steps["reflex"] += 1
+            if direction is not None and direction is not snake.next_direction:
+                turns.append((player_id, direction))
+        return turns
+    
+    def smart_direction(self, room: GameRoom, snake: Snake, field: DistanceField) -> Optional[Direction]:
+        # Down the distance field, never into a body on the live grid
+        head = snake.body[0]
+        options = field.neighbours[head]
+        distance = field.distance
+        heads = field.heads
+        best = None
+        best_score = None
+        for i, direction in enumerate(DIRECTIONS):
+            if direction is OPPOSITE[snake.direction]:
+                continue
+            cell = options[i]
+            if room.grid.occupied(cell):
+                continue
+            score = distance[cell] * 2
+            if direction is not snake.direction:
+                score += 1  # straight on wins ties
+            for neighbour in field.neighbours[cell]:
+                if neighbour != head and neighbour in heads:
+                    score += RISK_PENALTY
+                    break
+            if best_score is None or score < best_score:
+                best = direction
+                best_score = score
+        return best
+    
+    def reflex_direction(self, room: GameRoom, snake: Snake) -> Optional[Direction]:
+        # Straight on if the next cell is clear, else any clear side
+        width, height = room.width, room.height
+        y, x = divmod(snake.body[0], width)
+        choices = [snake.direction] + self.rng.sample(
+            [direction for direction in DIRECTIONS
+             if direction is not snake.direction and direction is not OPPOSITE[snake.direction]], 2)
+        for direction in choices:
+            dx, dy = direction.value
+            if not room.grid.occupied(((y + dy) % height) * width + (x + dx) % width):
+                return direction
+        return None
\ No newline at end of file
@@ -0,0 +1,484 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import socket
+import struct
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import websockets
+from fastapi import WebSocket, WebSocketDisconnect
+
+from protocol import JSON_PROTOCOL
+
+logger = logging.getLogger(__name__)
+
+# Several server processes (nodes) sharing the rooms. Every room runs on the
+# one node that owns it in the room directory (room_directory.py); players
+# connect to any node. A node that gets a join for a room owned elsewhere
+# forwards the player's commands to the owner over a node-to-node WebSocket
+# link, and the owner sends the room's frames back the same way, once per
+# node rather than once per player. Commands and frames are the tuples the
+# shard workers use (room_shards.py).
+#
+# Each node is its own uvicorn process with its own NODE_URL, since peers
+# have to reach the node that owns a room, not just any process behind a port.
+#
+# Only room traffic crosses the links. The in-process global leaderboard
+# (rankings.py) and the profile cache (auth.py) would go stale as other nodes
+# flush stats and sell skins, so both are switched off whenever ROOM_DIRECTORY
+# is set (room_directory.CLUSTERED): /leaderboard is served from the database
+# and profiles aren't cached. The token cache stays: a token always names the
+# same user.
+
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Base URL other nodes open links to, e.g. ws://10.0.0.5:8000
+NODE_URL = os.environ.get("NODE_URL", "ws://127.0.0.1:8000")
+# Shared by all nodes; links presenting anything else are refused
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+# Room leases and node registrations last this long without a heartbeat
+LEASE_SECONDS = 10.0
+HEARTBEAT_SECONDS = 3.0
+# Close code for players whose room was on a node this one lost contact with;
+# the client reconnects and its next join claims the room again
+ROOM_LOST_CLOSE_CODE = 1012
+
+# Position of the Frames dict in the items that carry one
+FRAME_ITEMS = {"room": 2, "user": 2, "users": 3}
+
+def pack_batch(batch: List[tuple]) -> bytes:
+    # A JSON header with the items, then the frames as raw blobs, so binary
+    # frames don't go through base64 and JSON frames aren't escaped again
+    blobs = []
+    items = []
+    for item in batch:
+        position = FRAME_ITEMS.get(item[0])
+        if position is not None:
+            frames = {}
+            for protocol, frame in item[position].items():
+                text = isinstance(frame, str)
+                blobs.append(frame.encode("utf-8") if text else frame)
+                frames[protocol] = [len(blobs) - 1, text]
+            item = item[:position] + (frames,) + item[position + 1:]
+        items.append(item)
+    header = json.dumps([items, [len(blob) for blob in blobs]], separators=(",", ":")).encode("utf-8")
+    return struct.pack("<I", len(header)) + header + b"".join(blobs)
+
+def unpack_batch(data: bytes) -> List[tuple]:
+    (length,) = struct.unpack_from("<I", data)
+    items, sizes = json.loads(data[4:4 + length])
+    blobs = []
+    offset = 4 + length
+    for size in sizes:
+        blobs.append(data[offset:offset + size])
+        offset += size
+    
+    batch = []
+    for item in items:
+        position = FRAME_ITEMS.get(item[0])
+        if position is not None:
+            item[position] = {
+                protocol: blobs[index].decode("utf-8") if text else blobs[index]
+                for protocol, (index, text) in item[position].items()
+            }
+        batch.append(tuple(item))
+    return batch
+
+class PeerLink:
+    # Batches for one peer node, written in order by one task
+    def __init__(self, node_id: str, send: Callable):
+        self.node_id = node_id
+        self.send = send
+        self.queue: Deque[bytes] = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.writer_task = asyncio.create_task(self.run_writer())
+    
+    def enqueue(self, data: bytes):
+        if not self.closed:
+            self.queue.append(data)
+            self.wakeup.set()
+    
+    def stop(self):
+        self.closed = True
+        self.writer_task.cancel()
+    
+    async def run_writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                await self.send(self.queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+
+class ClusterSimulation:
+    # Same interface as RoomSimulation; rooms owned here go to the local
+    # simulation, the rest to their owners. Also the local simulation's sink,
+    # passing frames for players on other nodes on to those nodes.
+    def __init__(self, directory, sink):
+        self.directory = directory
+        self.sink = sink
+        self.local = None  # RoomSimulation or ShardedSimulation, set by the owner of this object
+        self.owners: Dict[str, str] = {}  # room_id -> node_id, for rooms in use on this node
+        self.owned: Set[str] = set()
+        self.pending_joins: Dict[str, str] = {}  # user_id -> room_id being claimed
+        # Players on other nodes in rooms owned here
+        self.joining: Dict[str, str] = {}  # user_id -> node_id, until the room confirms
+        self.remote_users: Dict[str, Tuple[str, str]] = {}  # user_id -> (node_id, room_id)
+        self.room_nodes: Dict[str, Dict[str, int]] = {}  # room_id -> node_id -> players and spectators
+        self.links: Dict[str, PeerLink] = {}
+        self.connecting: Set[str] = set()
+        self.outboxes: Dict[str, List[tuple]] = {}
+        self.flush_scheduled = False
+        self.heartbeat_task: Optional[asyncio.Task] = None
+    
+    async def call(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    
+    # Simulation interface, called by the ConnectionManager
+    def join_room(self, room_id: str, user_id: str, username: str, skin: str, color: str,
+                  protocol: str = JSON_PROTOCOL):
+        self.join_command(room_id, user_id, ("join", room_id, user_id, username, skin, color, protocol))
+    
+    def spectate(self, room_id: str, user_id: str, protocol: str = JSON_PROTOCOL, follow: Optional[str] = None):
+        self.join_command(room_id, user_id, ("spectate", room_id, user_id, protocol, follow))
+    
+    def join_command(self, room_id: str, user_id: str, command: tuple):
+        # Joins and spectates claim the room if no node has it yet
+        if room_id in self.owners:
+            self.route(room_id, command)
+        else:
+            self.pending_joins[user_id] = room_id
+            asyncio.create_task(self.claim_and_join(room_id, user_id, command))
+    
+    async def claim_and_join(self, room_id: str, user_id: str, command: tuple):
+        try:
+            owner = await self.call(self.directory.claim, room_id, NODE_ID, LEASE_SECONDS)
+        except Exception:
+            logger.exception("Could not claim room %s", room_id)
+            self.pending_joins.pop(user_id, None)
+            return
+        if owner == NODE_ID:
+            self.owned.add(room_id)
+        self.owners.setdefault(room_id, owner)
+        # Unless it left or joined another room while the claim was in flight
+        if self.pending_joins.get(user_id) == room_id:
+            del self.pending_joins[user_id]
+            self.route(room_id, command)
+    
+    def leave_room(self, room_id: str, user_id: str):
+        if self.pending_joins.get(user_id) == room_id:
+            del self.pending_joins[user_id]
+            return
+        self.route(room_id, ("leave", room_id, user_id))
+    
+    def set_direction(self, room_id: str, user_id: str, direction: str):
+        self.route(room_id, ("move", room_id, user_id, direction))
+    
+    def request_keyframe(self, room_id: str, user_id: str):
+        self.route(room_id, ("keyframe", room_id, user_id))
+    
+    def route(self, room_id: str, command: tuple):
+        owner = self.owners.get(room_id)
+        if owner == NODE_ID:
+            self.run_command(command)
+        elif owner is not None:
+            self.send(owner, command)
+    
+    def run_command(self, command: tuple):
+        getattr(self.local, {
+            "join": "join_room",
+            "spectate": "spectate",
+            "leave": "leave_room",
+            "move": "set_direction",
+            "keyframe": "request_keyframe",
+        }[command[0]])(*command[1:])
+    
+    def room_stats(self) -> dict:
+        # Rooms owned by this node
+        return self.local.room_stats()
+    
+    def metrics_snapshot(self) -> dict:
+        return self.local.metrics_snapshot()
+    
+    def start_profile(self, mode: str, ticks: int) -> List[str]:
+        return self.local.start_profile(mode, ticks)
+    
+    async def run(self, on_tick: Optional[Callable[[], None]] = None):
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        await self.local.run(on_tick)
+    
+    async def heartbeat(self):
+        while True:
+            try:
+                await self.call(self.directory.register_node, NODE_ID, NODE_URL, LEASE_SECONDS)
+                lost = await self.call(self.directory.renew, NODE_ID, list(self.owned), LEASE_SECONDS)
+                for room_id in lost:
+                    # Another node decided this one was gone and took the room.
+                    # Only the new owner may run it and bank its stats, so it
+                    # stops here and its players reconnect to that node.
+                    logger.warning("Room %s is now owned by another node", room_id)
+                    self.owned.discard(room_id)
+                    if self.owners.get(room_id) == NODE_ID:
+                        del self.owners[room_id]
+                    self.local.drop_room(room_id)
+                    self.room_lost(room_id)
+            except Exception:
+                logger.exception("Room directory heartbeat failed")
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+    
+    def close(self):
+        self.local.close()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        self.flush()
+        try:
+            for room_id in self.owned:
+                self.directory.release(room_id, NODE_ID)
+            self.directory.unregister_node(NODE_ID)
+        except Exception:
+            logger.exception("Could not release rooms")
+    
+    # Sink interface for the local simulation, see simulation.py
+    def joined(self, room_id: str, user_id: str):
+        node_id = self.joining.pop(user_id, None)
+        if node_id is None:
+            self.sink.joined(room_id, user_id)
+            return
+        self.remote_users[user_id] = (node_id, room_id)
+        nodes = self.room_nodes.setdefault(room_id, {})
+        nodes[node_id] = nodes.get(node_id, 0) + 1
+        self.send(node_id, ("joined", room_id, user_id))
+    
+    def user_frame(self, user_id: str, frames, kind: Optional[str]):
+        remote = self.remote_users.get(user_id)
+        if remote is not None:
+            self.send(remote[0], ("user", user_id, frames, kind))
+            return
+        # A peer's player whose join failed hears why from the room
+        node_id = self.joining.pop(user_id, None)
+        if node_id is not None:
+            self.send(node_id, ("user", user_id, frames, kind))
+        else:
+            self.sink.user_frame(user_id, frames, kind)
+    
+    def room_frame(self, room_id: str, frames, kind: Optional[str], exclude_user: Optional[str]):
+        self.sink.room_frame(room_id, frames, kind, exclude_user)
+        for node_id in self.room_nodes.get(room_id, ()):
+            self.send(node_id, ("room", room_id, frames, kind, exclude_user))
+    
+    def users_frame(self, room_id: str, user_ids: List[str], frames, kind: Optional[str]):
+        if room_id not in self.room_nodes:
+            self.sink.users_frame(room_id, user_ids, frames, kind)
+            return
+        local = []
+        remote: Dict[str, List[str]] = {}
+        for user_id in user_ids:
+            node = self.remote_users.get(user_id)
+            if node is None:
+                local.append(user_id)
+            else:
+                remote.setdefault(node[0], []).append(user_id)
+        if local:
+            self.sink.users_frame(room_id, local, frames, kind)
+        for node_id, node_users in remote.items():
+            self.send(node_id, ("users", room_id, node_users, frames, kind))
+    
+    def room_events(self, room_id: str, events: List[tuple]):
+        self.sink.room_events(room_id, events)
+    
+    def room_closed(self, room_id: str):
+        # Reaped: the next join anywhere claims it afresh. Spectators on
+        # other nodes are all that can be left watching it.
+        self.drop_room(room_id, "closed")
+        self.sink.room_closed(room_id)
+    
+    def room_lost(self, room_id: str):
+        # The shard worker running it died, or another node took it over;
+        # its players everywhere reconnect
+        self.drop_room(room_id, "lost")
+        self.sink.room_lost(room_id)
+    
+    def drop_room(self, room_id: str, notice: str):
+        if room_id in self.owned:
+            self.owned.discard(room_id)
+            self.owners.pop(room_id, None)
+            asyncio.create_task(self.release(room_id))
+        nodes = self.room_nodes.pop(room_id, None)
+        if nodes:
+            for user_id, (_, user_room) in list(self.remote_users.items()):
+                if user_room == room_id:
+                    del self.remote_users[user_id]
+            for node_id in nodes:
+                self.send(node_id, (notice, room_id))
+    
+    async def release(self, room_id: str):
+        try:
+            await self.call(self.directory.release, room_id, NODE_ID)
+        except Exception:
+            logger.exception("Could not release room %s", room_id)
+    
+    async def claim_for_peer(self, node_id: str, command: tuple):
+        # A peer's join for a room this node doesn't hold: claimed for it by
+        # the peer, or reaped here while the peer still had this node cached
+        room_id = command[1]
+        try:
+            owner = await self.call(self.directory.claim, room_id, NODE_ID, LEASE_SECONDS)
+        except Exception:
+            logger.exception("Could not claim room %s", room_id)
+            return
+        if owner != NODE_ID:
+            # Someone else has it now; the peer retries the join there
+            self.send(node_id, ("moved", command))
+            return
+        self.owned.add(room_id)
+        self.owners[room_id] = NODE_ID
+        self.run_peer_join(node_id, command)
+    
+    def run_peer_join(self, node_id: str, command: tuple):
+        user_id = command[2]
+        if user_id in self.remote_users:
+            self.forget_remote_user(user_id)
+        self.joining[user_id] = node_id
+        self.run_command(command)
+    
+    def forget_remote_user(self, user_id: str):
+        node_id, room_id = self.remote_users.pop(user_id)
+        nodes = self.room_nodes[room_id]
+        nodes[node_id] -= 1
+        if not nodes[node_id]:
+            del nodes[node_id]
+            if not nodes:
+                del self.room_nodes[room_id]
+    
+    # Node-to-node links
+    def send(self, node_id: str, item: tuple):
+        self.outboxes.setdefault(node_id, []).append(item)
+        if not self.flush_scheduled:
+            # One batch per peer per loop iteration, like the shard pipes
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+    
+    def flush(self):
+        self.flush_scheduled = False
+        for node_id in list(self.outboxes):
+            link = self.links.get(node_id)
+            if link is not None:
+                link.enqueue(pack_batch(self.outboxes.pop(node_id)))
+            elif node_id not in self.connecting:
+                # Keeps the outbox until the link is up
+                self.connecting.add(node_id)
+                asyncio.create_task(self.open_link(node_id))
+    
+    async def open_link(self, node_id: str):
+        try:
+            url = await self.call(self.directory.node_url, node_id)
+            if url is None:
+                raise ConnectionError(f"Node {node_id} is not registered")
+            peer = await websockets.connect(f"{url}/internal/link/{NODE_ID}", max_size=None,
+                                            extra_headers={"x-cluster-secret": CLUSTER_SECRET})
+        except Exception:
+            logger.exception("Could not open a link to node %s", node_id)
+            self.connecting.discard(node_id)
+            self.link_lost(node_id)
+            return
+        self.connecting.discard(node_id)
+        link = self.add_link(node_id, peer.send)
+        try:
+            async for data in peer:
+                self.receive(node_id, unpack_batch(data))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.remove_link(node_id, link)
+    
+    async def serve_link(self, websocket: WebSocket, node_id: str):
+        # The /internal/link endpoint: a peer opening its link to this node
+        secret = websocket.headers.get("x-cluster-secret", "")
+        if not CLUSTER_SECRET or not hmac.compare_digest(secret, CLUSTER_SECRET):
+            await websocket.close(code=1008)
+            return
+        await websocket.accept()
+        link = self.add_link(node_id, websocket.send_bytes)
+        try:
+            while True:
+                self.receive(node_id, unpack_batch(await websocket.receive_bytes()))
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self.remove_link(node_id, link)
+    
+    def add_link(self, node_id: str, send: Callable) -> PeerLink:
+        link = PeerLink(node_id, send)
+        previous = self.links.get(node_id)
+        if previous is not None:
+            previous.stop()
+        self.links[node_id] = link
+        self.flush()
+        return link
+    
+    def remove_link(self, node_id: str, link: PeerLink):
+        link.stop()
+        if self.links.get(node_id) is link:
+            del self.links[node_id]
+            self.link_lost(node_id)
+    
+    def link_lost(self, node_id: str):
+        self.outboxes.pop(node_id, None)
+        # Its players are gone from the rooms owned here...
+        for user_id, (user_node, room_id) in list(self.remote_users.items()):
+            if user_node == node_id:
+                self.forget_remote_user(user_id)
+                self.local.leave_room(room_id, user_id)
+        for user_id, user_node in list(self.joining.items()):
+            if user_node == node_id:
+                del self.joining[user_id]
+        # ...and the players here can't reach the rooms it owns
+        for room_id, owner in list(self.owners.items()):
+            if owner == node_id:
+                del self.owners[room_id]
+                self.sink.room_lost(room_id)
+    
+    def receive(self, node_id: str, batch: List[tuple]):
+        for item in batch:
+            kind = item[0]
+            # Commands from players on the peer, for rooms owned here
+            if kind in ("join", "spectate"):
+                if item[1] in self.owned:
+                    self.run_peer_join(node_id, item)
+                else:
+                    asyncio.create_task(self.claim_for_peer(node_id, item))
+            elif kind == "leave":
+                if item[2] in self.remote_users:
+                    self.forget_remote_user(item[2])
+                self.joining.pop(item[2], None)
+                self.local.leave_room(*item[1:])
+            elif kind in ("move", "keyframe"):
+                self.run_command(item)
+            # Frames from rooms the peer owns, for players here
+            elif kind == "room":
+                self.sink.room_frame(*item[1:])
+            elif kind == "user":
+                self.sink.user_frame(*item[1:])
+            elif kind == "users":
+                self.sink.users_frame(*item[1:])
+            elif kind == "joined":
+                self.sink.joined(*item[1:])
+            elif kind == "closed":
+                self.sink.room_closed(*item[1:])
+            elif kind == "lost":
+                if self.owners.get(item[1]) == node_id:
+                    del self.owners[item[1]]
+                self.sink.room_lost(item[1])
+            elif kind == "moved":
+                command = tuple(item[1])
+                if self.owners.get(command[1]) == node_id:
+                    del self.owners[command[1]]
+                self.join_command(command[1], command[2], command)
\ No newline at end of file
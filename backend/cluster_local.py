@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+
+import websockets
+
+from protocol import BINARY_PROTOCOL, BinaryDecoder, encode_input
+
+# Runs a cluster of nodes on this machine and checks that rooms work across
+# them: N uvicorn processes on consecutive ports, sharing a SQLite room
+# directory and the same database, then clients connected to different nodes
+# join the same rooms. Every client has to see all the players of its room
+# and its own turns come back in the room's frames, whichever node owns it.
+#
+#   python cluster_local.py --nodes 3 --rooms 4          (from backend/)
+#   python cluster_local.py --nodes 2 --serve            keep the nodes up
+#
+# Exits non-zero when a check fails, keeping the work directory with the
+# node logs.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "frontend")
+
+def start_nodes(args, workdir: str) -> List[subprocess.Popen]:
+    # Same cwd for all nodes, so they share ./snake.db and ./static
+    os.symlink(FRONTEND_DIR, os.path.join(workdir, "static"))
+    secret = secrets.token_hex(16)
+    processes = []
+    for i in range(args.nodes):
+        port = args.base_port + i
+        env = dict(os.environ,
+                   PYTHONPATH=BACKEND_DIR,
+                   ROOM_DIRECTORY=f"sqlite:///{os.path.join(workdir, 'rooms.db')}",
+                   CLUSTER_SECRET=secret,
+                   NODE_ID=f"node{i}",
+                   NODE_URL=f"ws://127.0.0.1:{port}",
+                   WS_ALLOW_GUESTS="1")
+        log = open(os.path.join(workdir, f"node{i}.log"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT))
+        if i == 0:
+            # Let the first node create the database tables before the rest start
+            wait_for_port(port)
+    return processes
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError(f"Nothing listening on port {port}")
+            time.sleep(0.2)
+
+class CheckClient:
+    def __init__(self, url: str, client_id: str, room_id: str, binary: bool):
+        self.url = url
+        self.client_id = client_id
+        self.room_id = room_id
+        self.binary = binary
+        self.decoder = BinaryDecoder()
+        self.player_id: Optional[str] = None
+        self.seen: Set[str] = set()
+        self.direction = "RIGHT"
+        self.turned_at: Optional[float] = None
+        self.turns_seen = 0
+        self.error: Optional[str] = None
+    
+    def decode(self, raw):
+        return self.decoder.decode(raw) if isinstance(raw, bytes) else json.loads(raw)
+    
+    async def send(self, websocket, message: dict):
+        await websocket.send(encode_input(message) if self.binary else json.dumps(message))
+    
+    async def run(self, duration: float):
+        try:
+            subprotocols = [BINARY_PROTOCOL] if self.binary else None
+            async with websockets.connect(f"{self.url}/ws/{self.client_id}", max_size=None,
+                                          subprotocols=subprotocols) as websocket:
+                await self.send(websocket, {"action": "join_room", "room_id": self.room_id, "color": "#00FF00"})
+                reader = asyncio.create_task(self.read_frames(websocket))
+                stop_at = time.time() + duration
+                while time.time() < stop_at:
+                    await asyncio.sleep(0.5)
+                    self.direction = {"RIGHT": "DOWN", "DOWN": "LEFT", "LEFT": "UP", "UP": "RIGHT"}[self.direction]
+                    self.turned_at = time.time()
+                    await self.send(websocket, {"action": "move", "direction": self.direction})
+                reader.cancel()
+        except Exception as e:
+            self.error = repr(e)
+    
+    async def read_frames(self, websocket):
+        async for raw in websocket:
+            message = self.decode(raw)
+            kind = message.get("type")
+            if kind == "connected":
+                self.player_id = message["player_id"]
+            elif kind == "game_state":
+                self.on_players(message["state"]["players"])
+            elif kind == "game_delta":
+                self.on_players(message.get("added", {}))
+                self.on_players(message.get("players", {}))
+    
+    def on_players(self, players: Dict):
+        self.seen.update(players)
+        player = players.get(self.player_id)
+        if self.turned_at is not None and player is not None and player.get("direction") == self.direction:
+            self.turns_seen += 1
+            self.turned_at = None
+
+async def run_checks(args) -> Dict:
+    rng = random.Random(args.seed)
+    clients = []
+    rooms: Dict[str, List[CheckClient]] = {}
+    for room in range(args.rooms):
+        room_id = "global" if room == 0 else f"CLUSTER{room:03d}"
+        for j in range(args.players):
+            # Spread each room's players over the nodes, starting at a different one per room
+            node = (room + j) % args.nodes
+            client = CheckClient(f"ws://127.0.0.1:{args.base_port + node}", f"c{room}_{j}",
+                                 room_id, binary=rng.random() < 0.5)
+            clients.append(client)
+            rooms.setdefault(room_id, []).append(client)
+    await asyncio.gather(*(client.run(args.duration) for client in clients))
+    
+    failures = []
+    for room_id, members in rooms.items():
+        expected = {client.player_id for client in members}
+        for client in members:
+            if client.error:
+                failures.append(f"{client.client_id}: {client.error}")
+            elif not expected <= client.seen:
+                failures.append(f"{client.client_id} in {room_id} never saw {sorted(expected - client.seen)}")
+            elif not client.turns_seen:
+                failures.append(f"{client.client_id} in {room_id} never saw its own turns")
+    return {"rooms": {room_id: len(members) for room_id, members in rooms.items()}, "failures": failures}
+
+def room_owners(workdir: str) -> Dict[str, str]:
+    db = sqlite3.connect(os.path.join(workdir, "rooms.db"))
+    try:
+        return dict(db.execute("SELECT room_id, node_id FROM rooms").fetchall())
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local multi-node cluster check")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=8800)
+    parser.add_argument("--rooms", type=int, default=4, help="rooms to check, the first one is global")
+    parser.add_argument("--players", type=int, default=2, help="players per room, spread over the nodes")
+    parser.add_argument("--duration", type=float, default=5, help="seconds each check client plays")
+    parser.add_argument("--serve", action="store_true", help="keep the nodes running after the check")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="snake-cluster-")
+    processes = []
+    result = None
+    try:
+        processes = start_nodes(args, workdir)
+        for i in range(args.nodes):
+            wait_for_port(args.base_port + i)
+        result = asyncio.run(run_checks(args))
+        result["owners"] = room_owners(workdir)
+        result["workdir"] = workdir
+        print(json.dumps(result, indent=2), flush=True)
+        if args.serve:
+            print(f"Nodes on ports {args.base_port}-{args.base_port + args.nodes - 1}, Ctrl-C to stop")
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+    if result is None or result["failures"]:
+        sys.exit(1)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
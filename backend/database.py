@@ -1,53 +1,89 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import os
-from datetime import datetime
-
-# Gunakan PostgreSQL di Render, SQLite untuk lokal
-if os.environ.get("RENDER"):
-    DATABASE_URL = os.environ.get("DATABASE_URL")
-    if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-else:
-    DATABASE_URL = "sqlite:///./snake.db"
-
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    password_hash = Column(String)
-    created_at = Column(String, default=datetime.utcnow().isoformat())
-    total_score = Column(Integer, default=0)
-    total_coins = Column(Integer, default=0)
-    owned_skins = Column(JSON, default=["default", "green", "blue"])
-    current_skin = Column(String, default="default")
-    games_played = Column(Integer, default=0)
-    kills = Column(Integer, default=0)
-    deaths = Column(Integer, default=0)
-
-class GameSession(Base):
-    __tablename__ = "game_sessions"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, unique=True)
-    players = Column(JSON, default=[])
-    start_time = Column(String)
-    end_time = Column(String)
-    winner = Column(String, nullable=True)
-    room_type = Column(String)  # "private" or "global"
-
-# Buat tabel
-Base.metadata.create_all(bind=engine)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, JSON
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Gunakan PostgreSQL di Render, SQLite untuk lokal
+if os.environ.get("RENDER"):
+    DATABASE_URL = os.environ.get("DATABASE_URL")
+    if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
+        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+else:
+    DATABASE_URL = "sqlite:///./snake.db"
+
+# Connection pool for Postgres; tune per instance with the DB_POOL_* variables
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a connection
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))  # drop connections older than this
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Blocking database work runs on these threads, never on the event loop that
+# also runs the game tick. One thread per pooled connection, so threads don't
+# sit waiting for a checkout.
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE + DB_MAX_OVERFLOW, thread_name_prefix="db")
+Base = declarative_base()
+
+class User(Base):
+    __tablename__ = "users"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    password_hash = Column(String)
+    created_at = Column(String, default=datetime.utcnow().isoformat())
+    total_score = Column(Integer, default=0, index=True)
+    total_coins = Column(Integer, default=0)
+    owned_skins = Column(JSON, default=["default", "green", "blue"])
+    current_skin = Column(String, default="default")
+    games_played = Column(Integer, default=0)
+    kills = Column(Integer, default=0)
+    deaths = Column(Integer, default=0)
+
+class GameSession(Base):
+    __tablename__ = "game_sessions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, unique=True)
+    players = Column(JSON, default=[])
+    start_time = Column(String)
+    end_time = Column(String)
+    winner = Column(String, nullable=True)
+    room_type = Column(String)  # "private" or "global"
+
+# Buat tabel
+Base.metadata.create_all(bind=engine)
+# create_all skips tables that already exist; add indexes introduced since
+for index in User.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def run_db(fn, *args):
+    # Call fn(db, *args) with its own session on the database threads
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
\ No newline at end of file
@@ -0,0 +1,59 @@
+import json
+import os
+from typing import Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+Frame = Union[str, bytes]
+# One message encoded for each wire protocol that needs it, see protocol.py
+Frames = Dict[str, Frame]
+
+# Encoders turn a message dict into a ready-to-send WebSocket frame once, so
+# a room's tick payload is serialized once no matter how many players get it.
+
+class JsonEncoder:
+    name = "json"
+    binary = False
+    
+    def encode(self, message: dict) -> str:
+        return json.dumps(message, separators=(",", ":"))
+
+class OrjsonEncoder:
+    name = "orjson"
+    binary = False
+    
+    def encode(self, message: dict) -> str:
+        return orjson.dumps(message).decode("utf-8")
+
+class MsgpackEncoder:
+    # Binary frames: only for clients that decode msgpack (the browser client expects JSON)
+    name = "msgpack"
+    binary = True
+    
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+def get_encoder(name: str = None):
+    name = (name or os.environ.get("WS_ENCODER", "auto")).lower()
+    
+    if name == "auto":
+        return OrjsonEncoder() if orjson is not None else JsonEncoder()
+    if name == "json":
+        return JsonEncoder()
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("WS_ENCODER=orjson but orjson is not installed")
+        return OrjsonEncoder()
+    if name == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("WS_ENCODER=msgpack but msgpack is not installed")
+        return MsgpackEncoder()
+    raise ValueError(f"Unknown WS_ENCODER: {name}")
\ No newline at end of file
@@ -1,250 +1,827 @@
-import asyncio
-import random
-import time
-from typing import Dict, List, Tuple, Set
-import json
-from dataclasses import dataclass
-from enum import Enum
-
-class Direction(Enum):
-    UP = (0, -1)
-    DOWN = (0, 1)
-    LEFT = (-1, 0)
-    RIGHT = (1, 0)
-
-@dataclass
-class Position:
-    x: int
-    y: int
-
-class Snake:
-    def __init__(self, player_id: str, username: str, skin: str = "default", color: str = "#00FF00"):
-        self.player_id = player_id
-        self.username = username
-        self.skin = skin
-        self.color = color
-        self.reset()
-    
-    def reset(self):
-        self.direction = Direction.RIGHT
-        self.next_direction = Direction.RIGHT
-        self.body = [Position(10, 10), Position(9, 10), Position(8, 10)]
-        self.grow_pending = 0
-        self.score = 0
-        self.coins = 0
-        self.alive = True
-        self.speed = 10  # grid per second
-        self.last_move_time = time.time()
-    
-    def update_direction(self, new_direction: Direction):
-        # Prevent 180-degree turns
-        opposite_map = {
-            Direction.UP: Direction.DOWN,
-            Direction.DOWN: Direction.UP,
-            Direction.LEFT: Direction.RIGHT,
-            Direction.RIGHT: Direction.LEFT
-        }
-        if new_direction != opposite_map.get(self.direction):
-            self.next_direction = new_direction
-    
-    def move(self):
-        if not self.alive:
-            return
-        
-        current_time = time.time()
-        if current_time - self.last_move_time < 1.0 / self.speed:
-            return False
-        
-        self.direction = self.next_direction
-        dx, dy = self.direction.value
-        
-        head = self.body[0]
-        new_head = Position(
-            (head.x + dx) % GRID_WIDTH,
-            (head.y + dy) % GRID_HEIGHT
-        )
-        
-        self.body.insert(0, new_head)
-        
-        if self.grow_pending > 0:
-            self.grow_pending -= 1
-        else:
-            self.body.pop()
-        
-        self.last_move_time = current_time
-        return True
-    
-    def grow(self, amount: int = 1):
-        self.grow_pending += amount
-        self.score += 10
-    
-    def add_coins(self, amount: int):
-        self.coins += amount
-    
-    def kill(self):
-        self.alive = False
-    
-    def respawn(self):
-        self.reset()
-        self.body = [
-            Position(random.randint(5, GRID_WIDTH - 5), 
-                    random.randint(5, GRID_HEIGHT - 5))
-        ]
-    
-    def to_dict(self):
-        return {
-            "player_id": self.player_id,
-            "username": self.username,
-            "skin": self.skin,
-            "color": self.color,
-            "body": [(pos.x, pos.y) for pos in self.body],
-            "alive": self.alive,
-            "score": self.score,
-            "coins": self.coins,
-            "direction": self.direction.name
-        }
-
-class Food:
-    def __init__(self):
-        self.position = Position(random.randint(0, GRID_WIDTH - 1), 
-                                random.randint(0, GRID_HEIGHT - 1))
-        self.type = "normal"  # normal, golden, powerup
-        self.value = random.choice([10, 20, 30])
-    
-    def respawn(self):
-        self.position = Position(random.randint(0, GRID_WIDTH - 1), 
-                                random.randint(0, GRID_HEIGHT - 1))
-    
-    def to_dict(self):
-        return {
-            "position": (self.position.x, self.position.y),
-            "type": self.type,
-            "value": self.value
-        }
-
-# Game Constants
-GRID_SIZE = 20
-GRID_WIDTH = 40
-GRID_HEIGHT = 30
-TICK_RATE = 60  # Hz
-
-class GameRoom:
-    def __init__(self, room_id: str, max_players: int = 10, is_private: bool = False):
-        self.room_id = room_id
-        self.max_players = max_players
-        self.is_private = is_private
-        self.players: Dict[str, Snake] = {}
-        self.foods: List[Food] = []
-        self.last_tick = time.time()
-        self.running = True
-        self.generate_food(20)
-    
-    def generate_food(self, count: int):
-        for _ in range(count):
-            self.foods.append(Food())
-    
-    def add_player(self, player_id: str, username: str, skin: str, color: str):
-        if player_id in self.players:
-            return True
-        
-        if len(self.players) >= self.max_players:
-            return False
-        
-        snake = Snake(player_id, username, skin, color)
-        # Set random starting position
-        snake.body = [
-            Position(random.randint(5, GRID_WIDTH - 5), 
-                    random.randint(5, GRID_HEIGHT - 5))
-        ]
-        self.players[player_id] = snake
-        return True
-    
-    def remove_player(self, player_id: str):
-        if player_id in self.players:
-            del self.players[player_id]
-    
-    def update(self):
-        current_time = time.time()
-        delta_time = current_time - self.last_tick
-        
-        # Move all snakes
-        for snake in self.players.values():
-            snake.move()
-        
-        # Check collisions with food
-        food_to_remove = []
-        for food_idx, food in enumerate(self.foods):
-            for snake in self.players.values():
-                if not snake.alive:
-                    continue
-                
-                head = snake.body[0]
-                if head.x == food.position.x and head.y == food.position.y:
-                    snake.grow(food.value // 10)
-                    snake.add_coins(food.value // 5)
-                    food_to_remove.append(food_idx)
-                    # Play sound effect
-                    break
-        
-        # Remove eaten food and spawn new ones
-        for idx in sorted(food_to_remove, reverse=True):
-            self.foods.pop(idx)
-            self.foods.append(Food())
-        
-        # Check collisions with self and others
-        for player_id, snake in self.players.items():
-            if not snake.alive:
-                continue
-            
-            head = snake.body[0]
-            
-            # Check collision with self
-            for i, segment in enumerate(snake.body[1:], 1):
-                if head.x == segment.x and head.y == segment.y:
-                    snake.kill()
-                    # Give coins to other players if any
-                    for other_id, other_snake in self.players.items():
-                        if other_id != player_id and other_snake.alive:
-                            other_snake.add_coins(10)
-                    break
-            
-            # Check collision with other snakes
-            if snake.alive:
-                for other_id, other_snake in self.players.items():
-                    if other_id == player_id:
-                        continue
-                    
-                    for segment in other_snake.body:
-                        if head.x == segment.x and head.y == segment.y:
-                            snake.kill()
-                            other_snake.score += 50
-                            other_snake.add_coins(20)
-                            break
-        
-        # Auto-respawn dead snakes after 3 seconds
-        for snake in self.players.values():
-            if not snake.alive and current_time - snake.last_move_time > 3:
-                snake.respawn()
-        
-        self.last_tick = current_time
-    
-    def get_state(self):
-        return {
-            "room_id": self.room_id,
-            "players": {pid: snake.to_dict() for pid, snake in self.players.items()},
-            "foods": [food.to_dict() for food in self.foods],
-            "timestamp": time.time()
-        }
-    
-    def get_leaderboard(self):
-        players = list(self.players.values())
-        players.sort(key=lambda x: x.score, reverse=True)
-        return [
-            {
-                "username": snake.username,
-                "score": snake.score,
-                "coins": snake.coins,
-                "alive": snake.alive
-            }
-            for snake in players
-        ]
\ No newline at end of file
+import asyncio
+import bisect
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Set
+import json
+from dataclasses import dataclass
+from enum import Enum
+
+class Direction(Enum):
+    UP = (0, -1)
+    DOWN = (0, 1)
+    LEFT = (-1, 0)
+    RIGHT = (1, 0)
+
+OPPOSITE = {
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+    Direction.LEFT: Direction.RIGHT,
+    Direction.RIGHT: Direction.LEFT
+}
+
+@dataclass
+class Position:
+    x: int
+    y: int
+
+# Snake bodies and the occupancy grid address cells by packed index y * width + x
+
+class FreeCells:
+    # Cells holding neither a snake segment nor a food, for placing food and
+    # spawns without retrying. The free cells sit unordered in an array with
+    # each cell's slot in it alongside; a cell is taken by moving the last
+    # free cell into its slot, so taking, freeing and sampling are all O(1).
+    def __init__(self, size: int):
+        self.cells = list(range(size))
+        self.slots = list(range(size))  # cell -> index in cells, -1 when taken
+        self.uses = [0] * size  # segments and foods in each cell
+    
+    def __len__(self) -> int:
+        return len(self.cells)
+    
+    def take(self, cell: int):
+        self.uses[cell] += 1
+        if self.uses[cell] == 1:
+            slot = self.slots[cell]
+            last = self.cells.pop()
+            if last != cell:
+                self.cells[slot] = last
+                self.slots[last] = slot
+            self.slots[cell] = -1
+    
+    def release(self, cell: int):
+        self.uses[cell] -= 1
+        if self.uses[cell] == 0:
+            self.slots[cell] = len(self.cells)
+            self.cells.append(cell)
+    
+    def is_free(self, cell: int) -> bool:
+        return self.slots[cell] >= 0
+    
+    def sample(self, rng: random.Random) -> Optional[int]:
+        # A uniformly random free cell, None when the board is full
+        if not self.cells:
+            return None
+        return self.cells[rng.randrange(len(self.cells))]
+
+class OccupancyGrid:
+    def __init__(self, width: int, height: int, free: FreeCells):
+        self.width = width
+        self.height = height
+        self.free = free
+        # cell index -> {player_id: number of that snake's segments in the cell}
+        self.cells: List[Optional[Dict[str, int]]] = [None] * (width * height)
+    
+    def index(self, pos: Position) -> int:
+        return pos.y * self.width + pos.x
+    
+    def add(self, cell: int, owner: str):
+        self.free.take(cell)
+        owners = self.cells[cell]
+        if owners is None:
+            self.cells[cell] = {owner: 1}
+        else:
+            owners[owner] = owners.get(owner, 0) + 1
+    
+    def remove(self, cell: int, owner: str):
+        owners = self.cells[cell]
+        if owners is None or owner not in owners:
+            return
+        self.free.release(cell)
+        if owners[owner] > 1:
+            owners[owner] -= 1
+        elif len(owners) > 1:
+            del owners[owner]
+        else:
+            self.cells[cell] = None
+    
+    def owners(self, cell: int) -> Dict[str, int]:
+        return self.cells[cell] or {}
+    
+    def occupied(self, cell: int) -> bool:
+        return self.cells[cell] is not None
+
+class RoomLeaderboard:
+    # Players in rank order (score high to low, then join order). A snake is
+    # moved only when its score changes; the entry list is rebuilt only when
+    # something shown on it changed since it was last read.
+    def __init__(self):
+        self.order: List[Tuple[int, int]] = []  # (-score, join number), ascending
+        self.snakes: Dict[int, "Snake"] = {}  # join number -> snake
+        self.version = 0
+        self.entries: Optional[List[dict]] = None
+    
+    def add(self, snake: "Snake"):
+        self.snakes[snake.join_number] = snake
+        bisect.insort(self.order, (-snake.score, snake.join_number))
+        self.changed()
+    
+    def remove(self, snake: "Snake"):
+        self.discard(-snake.score, snake.join_number)
+        del self.snakes[snake.join_number]
+        self.changed()
+    
+    def rescore(self, snake: "Snake", old_score: int):
+        self.discard(-old_score, snake.join_number)
+        bisect.insort(self.order, (-snake.score, snake.join_number))
+        self.changed()
+    
+    def discard(self, key: int, join_number: int):
+        index = bisect.bisect_left(self.order, (key, join_number))
+        del self.order[index]
+    
+    def changed(self):
+        self.version += 1
+        self.entries = None
+    
+    def get(self) -> List[dict]:
+        if self.entries is None:
+            self.entries = [
+                {
+                    "username": snake.username,
+                    "score": snake.score,
+                    "coins": snake.coins,
+                    "alive": snake.alive
+                }
+                for snake in (self.snakes[join_number] for _, join_number in self.order)
+            ]
+        return self.entries
+
+class Snake:
+    def __init__(self, player_id: str, username: str, skin: str = "default", color: str = "#00FF00",
+                 width: int = None, height: int = None):
+        self.player_id = player_id
+        self.username = username
+        self.skin = skin
+        self.color = color
+        self.grid: Optional[OccupancyGrid] = None
+        self.ranking: Optional[RoomLeaderboard] = None
+        self.join_number = 0  # order of joining the room, breaks score ties
+        self.bot = False  # played by the server; its results are not recorded
+        self.width = width or GRID_WIDTH
+        self.height = height or GRID_HEIGHT
+        self.body: Deque[int] = deque()  # packed cell indices, head first
+        # Changes since the last delta was taken, see GameRoom.get_delta
+        self.pushed: List[int] = []
+        self.popped = 0
+        self.body_replaced = False
+        self.sent_stats: Optional[Tuple] = None
+        self.reset()
+        self.set_body([self.cell(10, 10), self.cell(9, 10), self.cell(8, 10)])
+    
+    def attach_grid(self, grid: Optional[OccupancyGrid]):
+        if self.grid is not None:
+            for segment in self.body:
+                self.grid.remove(segment, self.player_id)
+        self.grid = grid
+        if grid is not None:
+            for segment in self.body:
+                grid.add(segment, self.player_id)
+    
+    def attach_ranking(self, ranking: Optional[RoomLeaderboard]):
+        if self.ranking is not None:
+            self.ranking.remove(self)
+        self.ranking = ranking
+        if ranking is not None:
+            ranking.add(self)
+    
+    def cell(self, x: int, y: int) -> int:
+        return y * self.width + x
+    
+    def head_position(self) -> Position:
+        y, x = divmod(self.body[0], self.width)
+        return Position(x, y)
+    
+    def set_body(self, body: Iterable[int]):
+        body = deque(body)
+        if self.grid is not None:
+            for segment in self.body:
+                self.grid.remove(segment, self.player_id)
+            for segment in body:
+                self.grid.add(segment, self.player_id)
+        self.body = body
+        self.pushed = []
+        self.popped = 0
+        self.body_replaced = True
+    
+    def clear_changes(self):
+        self.pushed = []
+        self.popped = 0
+        self.body_replaced = False
+        self.sent_stats = self.stats()
+    
+    def stats(self) -> Tuple:
+        return (self.score, self.coins, self.alive, self.direction.name)
+    
+    def reset(self):
+        self.direction = Direction.RIGHT
+        self.turns: Deque[Direction] = deque()  # taken one per step, oldest first
+        self.grow_pending = 0
+        self.score = 0
+        self.coins = 0
+        self.alive = True
+        self.speed = 10  # grid per second
+        self.move_ticks = 0  # simulation ticks since the last step
+        self.dead_ticks = 0  # simulation ticks spent dead
+    
+    @property
+    def next_direction(self) -> Direction:
+        return self.turns[0] if self.turns else self.direction
+    
+    def update_direction(self, new_direction: Direction):
+        # Queued behind the turns not yet taken, so two quick turns make two
+        # steps. Prevent 180-degree turns, against the last queued direction.
+        last = self.turns[-1] if self.turns else self.direction
+        if new_direction is not last and new_direction is not OPPOSITE[last] and len(self.turns) < TURN_QUEUE:
+            self.turns.append(new_direction)
+    
+    def ticks_per_move(self) -> int:
+        return max(1, round(TICK_RATE / self.speed))
+    
+    def move(self):
+        if not self.alive:
+            return False
+        
+        self.move_ticks += 1
+        if self.move_ticks < self.ticks_per_move():
+            return False
+        self.move_ticks = 0
+        
+        if self.turns:
+            self.direction = self.turns.popleft()
+        dx, dy = self.direction.value
+        
+        y, x = divmod(self.body[0], self.width)
+        new_head = ((y + dy) % self.height) * self.width + (x + dx) % self.width
+        
+        self.body.appendleft(new_head)
+        self.pushed.append(new_head)
+        if self.grid is not None:
+            self.grid.add(new_head, self.player_id)
+        
+        if self.grow_pending > 0:
+            self.grow_pending -= 1
+        else:
+            tail = self.body.pop()
+            self.popped += 1
+            if self.grid is not None:
+                self.grid.remove(tail, self.player_id)
+        
+        return True
+    
+    def grow(self, amount: int = 1):
+        self.grow_pending += amount
+        self.add_score(10)
+    
+    def add_score(self, amount: int):
+        old_score = self.score
+        self.score += amount
+        if self.ranking is not None:
+            self.ranking.rescore(self, old_score)
+    
+    def add_coins(self, amount: int):
+        self.coins += amount
+        if self.ranking is not None:
+            self.ranking.changed()
+    
+    def kill(self):
+        self.alive = False
+        if self.ranking is not None:
+            self.ranking.changed()
+    
+    def place(self, cell: int, direction: Direction):
+        # A one-segment body at a spawn point, see GameRoom.spawn_point
+        self.set_body([cell])
+        self.direction = direction
+        self.turns.clear()
+    
+    def respawn(self, cell: int, direction: Direction):
+        old_score = self.score
+        self.reset()
+        if self.ranking is not None:
+            self.ranking.rescore(self, old_score)
+        self.place(cell, direction)
+    
+    def to_dict(self):
+        return {
+            "player_id": self.player_id,
+            "username": self.username,
+            "skin": self.skin,
+            "color": self.color,
+            "body": list(self.body),
+            "alive": self.alive,
+            "score": self.score,
+            "coins": self.coins,
+            "direction": self.direction.name
+        }
+
+class Food:
+    # Placed by the room, on a free cell
+    def __init__(self, food_id: int, position: Position, value: int):
+        self.reset(food_id, position, value)
+    
+    def reset(self, food_id: int, position: Position, value: int):
+        # Rooms hand eaten foods out again as new ones
+        self.id = food_id
+        self.position = position
+        self.type = "normal"  # normal, golden, powerup
+        self.value = value
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "position": (self.position.x, self.position.y),
+            "type": self.type,
+            "value": self.value
+        }
+
+# Game Constants
+GRID_SIZE = 20
+GRID_WIDTH = 40
+GRID_HEIGHT = 30
+TICK_RATE = 20  # simulation steps per second
+RESPAWN_TICKS = 3 * TICK_RATE
+# Turns a snake holds on to between steps; more are ignored until it moves
+TURN_QUEUE = 3
+# Area of interest: in arenas bigger than the client's screen each player only
+# receives what is around their own head. Cells are grouped into square
+# buckets, and a view is the block of buckets around the head's bucket.
+VIEW_WIDTH = GRID_WIDTH  # cells a client shows, centred on its head
+VIEW_HEIGHT = GRID_HEIGHT
+VIEW_BUCKET_SIZE = 10
+# Foods kept on the board per cell, so bigger arenas get proportionally more
+FOOD_DENSITY = 20 / (GRID_WIDTH * GRID_HEIGHT)
+# A spawn point needs this many snake-free cells ahead of it, in the
+# direction the new snake starts moving; rooms try SPAWN_ATTEMPTS random
+# free cells for one before settling for any free cell
+SPAWN_CLEARANCE = 8
+SPAWN_ATTEMPTS = 16
+
+def food_target(width: int, height: int) -> int:
+    return max(1, round(FOOD_DENSITY * width * height))
+
+class BucketIndex:
+    # Which players and foods touch each bucket, rebuilt once per send
+    def __init__(self, width: int, height: int, bucket_size: int = VIEW_BUCKET_SIZE):
+        self.width = width
+        self.bucket_size = bucket_size
+        self.columns = -(-width // bucket_size)
+        self.rows = -(-height // bucket_size)
+        self.players: Dict[int, Set[str]] = {}
+        self.foods: Dict[int, List[Food]] = {}
+    
+    def bucket(self, cell: int) -> int:
+        y, x = divmod(cell, self.width)
+        return (y // self.bucket_size) * self.columns + x // self.bucket_size
+    
+    def add_snake(self, snake: Snake):
+        for bucket in {self.bucket(segment) for segment in snake.body}:
+            self.players.setdefault(bucket, set()).add(snake.player_id)
+    
+    def add_food(self, cell: int, food: Food):
+        self.foods.setdefault(self.bucket(cell), []).append(food)
+
+class GameRoom:
+    engine = "python"
+    
+    def __init__(self, room_id: str, max_players: int = 10, is_private: bool = False,
+                 width: int = GRID_WIDTH, height: int = GRID_HEIGHT, food_count: int = 20,
+                 seed: Optional[int] = None):
+        self.width = width
+        self.height = height
+        self.aoi = width > VIEW_WIDTH or height > VIEW_HEIGHT
+        self.free_cells = FreeCells(width * height)
+        self.grid = self.make_grid()
+        self.foods: List[Food] = []
+        # Eaten foods wait in eaten_foods until the frame listing them is
+        # built, then go to food_pool for generate_food to reuse
+        self.eaten_foods: List[Food] = []
+        self.food_pool: List[Food] = []
+        # Every random choice the game makes comes from the room's own
+        # generator, so a room replays exactly from its seed and inputs
+        self.rng = random.Random()
+        self.reset(room_id, max_players, is_private, food_count, seed)
+    
+    def reset(self, room_id: str, max_players: int, is_private: bool, food_count: int,
+              seed: Optional[int] = None):
+        # Fresh game on the same arena; also how the simulation reuses an
+        # emptied room for a new room id. The grid is empty once every
+        # player has left.
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng.seed(self.seed)
+        self.room_id = room_id
+        self.max_players = max_players
+        self.is_private = is_private
+        self.players: Dict[str, Snake] = {}
+        for food in self.foods:
+            self.free_cells.release(self.grid.index(food.position))
+        self.food_pool.extend(self.foods)
+        self.food_pool.extend(self.eaten_foods)
+        self.foods = []
+        self.eaten_foods = []
+        self.food_cells: Dict[int, List[Food]] = {}  # cell index -> foods in that cell
+        self.running = True
+        # Tick sequence number and the change log for delta broadcasts
+        self.seq = 0
+        self.delta_base = 0
+        self.keyframe_seq = 0
+        self.next_food_id = 0
+        self.added_players: List[str] = []
+        self.removed_players: List[str] = []
+        self.eaten_food_ids: List[int] = []
+        self.spawned_foods: List[Food] = []
+        self.ranking = RoomLeaderboard()
+        self.next_join_number = 0
+        # Ranking version and seq when the leaderboard last went out to the room
+        self.leaderboard_version = -1
+        self.leaderboard_seq = 0
+        # Area-of-interest bookkeeping: what each view (keyed by the bucket
+        # of the heads in it) showed at the last send, and each player's view
+        self.views: Dict[int, Tuple[Set[str], Set[int]]] = {}
+        self.player_views: Dict[str, int] = {}
+        # Results for the stats writer, drained by the simulation every tick:
+        # ("joined", username), ("kill", username), ("death", username),
+        # ("life", username, score, coins) when a life is banked on respawn or
+        # leave, and ("match", session) when the room empties. Bots have none.
+        self.events: List[tuple] = []
+        self.match_started_at: Optional[str] = None
+        self.match_scores: Dict[str, int] = {}  # username -> best life score this match
+        self.food_count = food_count  # foods kept on the board
+        self.generate_food(food_count)
+    
+    def make_grid(self):
+        return OccupancyGrid(self.width, self.height, self.free_cells)
+    
+    def generate_food(self, count: int):
+        # Up to count foods on free cells; a full board gets topped up later
+        for _ in range(count):
+            cell = self.free_cells.sample(self.rng)
+            if cell is None:
+                return
+            self.free_cells.take(cell)
+            y, x = divmod(cell, self.width)
+            value = self.rng.choice([10, 20, 30])
+            self.next_food_id += 1
+            if self.food_pool:
+                food = self.food_pool.pop()
+                food.reset(self.next_food_id, Position(x, y), value)
+            else:
+                food = Food(self.next_food_id, Position(x, y), value)
+            self.foods.append(food)
+            self.spawned_foods.append(food)
+            self.food_cells.setdefault(cell, []).append(food)
+    
+    def top_up_food(self):
+        if len(self.foods) < self.food_count:
+            self.generate_food(self.food_count - len(self.foods))
+    
+    def clear_ahead(self, cell: int, direction: Direction, distance: int) -> bool:
+        # No snake in the next `distance` cells from cell, wrapping like a move
+        dx, dy = direction.value
+        y, x = divmod(cell, self.width)
+        for _ in range(distance):
+            x = (x + dx) % self.width
+            y = (y + dy) % self.height
+            if self.grid.occupied(y * self.width + x):
+                return False
+        return True
+    
+    def spawn_point(self) -> Tuple[int, Direction]:
+        # A free cell with SPAWN_CLEARANCE clear cells ahead and the direction
+        # to start in. Falls back to any free cell, and to any cell at all
+        # when the board is full.
+        directions = list(Direction)
+        for _ in range(SPAWN_ATTEMPTS):
+            cell = self.free_cells.sample(self.rng)
+            if cell is None:
+                return self.rng.randrange(self.width * self.height), Direction.RIGHT
+            turn = self.rng.randrange(4)
+            for i in range(4):
+                direction = directions[(turn + i) % 4]
+                if self.clear_ahead(cell, direction, SPAWN_CLEARANCE):
+                    return cell, direction
+        return self.free_cells.sample(self.rng), Direction.RIGHT
+    
+    def add_player(self, player_id: str, username: str, skin: str, color: str, bot: bool = False):
+        if player_id in self.players:
+            return True
+        
+        if len(self.players) >= self.max_players:
+            return False
+        
+        snake = Snake(player_id, username, skin, color, self.width, self.height)
+        snake.bot = bot
+        snake.place(*self.spawn_point())
+        snake.attach_grid(self.grid)
+        self.next_join_number += 1
+        snake.join_number = self.next_join_number
+        snake.attach_ranking(self.ranking)
+        self.players[player_id] = snake
+        self.added_players.append(player_id)
+        
+        if self.match_started_at is None:
+            self.match_started_at = datetime.utcnow().isoformat()
+        if not bot:
+            self.match_scores.setdefault(username, 0)
+            self.events.append(("joined", username))
+        return True
+    
+    def remove_player(self, player_id: str):
+        if player_id in self.players:
+            snake = self.players[player_id]
+            self.settle(snake)
+            snake.attach_grid(None)
+            snake.attach_ranking(None)
+            del self.players[player_id]
+            self.player_views.pop(player_id, None)
+            self.removed_players.append(player_id)
+            if not self.players:
+                self.end_match()
+    
+    def settle(self, snake: Snake):
+        if snake.bot:
+            return
+        self.events.append(("life", snake.username, snake.score, snake.coins))
+        self.match_scores[snake.username] = max(self.match_scores.get(snake.username, 0), snake.score)
+    
+    def report(self, snake: Snake, kind: str):
+        if not snake.bot:
+            self.events.append((kind, snake.username))
+    
+    def end_match(self):
+        if self.match_started_at is None:
+            return
+        winner = max(self.match_scores, key=self.match_scores.get) if self.match_scores else None
+        self.events.append(("match", {
+            "room_type": "private" if self.is_private else "global",
+            "players": list(self.match_scores),
+            "start_time": self.match_started_at,
+            "end_time": datetime.utcnow().isoformat(),
+            "winner": winner
+        }))
+        self.match_started_at = None
+        self.match_scores = {}
+    
+    def remove_foods(self, eaten: List[Food]):
+        eaten_ids = {id(food) for food in eaten}
+        self.foods = [food for food in self.foods if id(food) not in eaten_ids]
+        for food in eaten:
+            self.free_cells.release(self.grid.index(food.position))
+        self.eaten_food_ids.extend(food.id for food in eaten)
+        self.eaten_foods.extend(eaten)
+    
+    def take_events(self) -> List[tuple]:
+        events, self.events = self.events, []
+        return events
+    
+    def update(self):
+        # One fixed simulation step; wall-clock pacing lives in the game loop
+        
+        # Move all snakes
+        for snake in self.players.values():
+            snake.move()
+        
+        # Check collisions with food: one lookup per head
+        eaten: List[Food] = []
+        for snake in self.players.values():
+            if not snake.alive:
+                continue
+            
+            foods_here = self.food_cells.pop(snake.body[0], None)
+            if not foods_here:
+                continue
+            for food in foods_here:
+                snake.grow(food.value // 10)
+                snake.add_coins(food.value // 5)
+                eaten.append(food)
+                # Play sound effect
+        
+        # Remove eaten food and spawn new ones
+        if eaten:
+            self.remove_foods(eaten)
+        self.top_up_food()
+        
+        # Check collisions with self and others via the occupancy grid
+        for player_id, snake in self.players.items():
+            if not snake.alive:
+                continue
+            
+            occupants = self.grid.owners(snake.body[0])
+            
+            # Check collision with self: the head cell holds another of our own segments
+            if occupants.get(player_id, 0) > 1:
+                snake.kill()
+                self.report(snake, "death")
+                # Give coins to other players if any
+                for other_id, other_snake in self.players.items():
+                    if other_id != player_id and other_snake.alive:
+                        other_snake.add_coins(10)
+            
+            # Check collision with other snakes
+            if snake.alive:
+                for other_id in occupants:
+                    if other_id == player_id:
+                        continue
+                    
+                    other_snake = self.players[other_id]
+                    if snake.alive:
+                        self.report(snake, "death")
+                    snake.kill()
+                    other_snake.add_score(50)
+                    other_snake.add_coins(20)
+                    self.report(other_snake, "kill")
+        
+        # Auto-respawn dead snakes after 3 seconds
+        for snake in self.players.values():
+            if not snake.alive:
+                snake.dead_ticks += 1
+                if snake.dead_ticks > RESPAWN_TICKS:
+                    self.settle(snake)
+                    snake.respawn(*self.spawn_point())
+        
+        self.seq += 1
+    
+    def get_state(self):
+        return {
+            "room_id": self.room_id,
+            "seq": self.seq,
+            "players": {pid: snake.to_dict() for pid, snake in self.players.items()},
+            "foods": [food.to_dict() for food in self.foods],
+            "timestamp": time.time()
+        }
+    
+    def _clear_changes(self):
+        for snake in self.players.values():
+            snake.clear_changes()
+        self.added_players = []
+        self.removed_players = []
+        self.eaten_food_ids = []
+        self.spawned_foods = []
+        self.delta_base = self.seq
+        if self.eaten_foods:
+            self.food_pool.extend(self.eaten_foods)
+            self.eaten_foods = []
+    
+    def get_keyframe(self):
+        # Full state that also becomes the base for the following deltas
+        state = self.get_state()
+        self._clear_changes()
+        self.keyframe_seq = self.seq
+        return state
+    
+    def _player_changes(self) -> Dict[str, dict]:
+        # Per-snake changes since the last send, shared by every frame built from them
+        changes = {}
+        for pid, snake in self.players.items():
+            change = {}
+            if snake.body_replaced:
+                change["body"] = list(snake.body)
+            else:
+                if snake.pushed:
+                    change["push"] = snake.pushed
+                if snake.popped:
+                    change["pop"] = snake.popped
+            stats = snake.stats()
+            if stats != snake.sent_stats:
+                change["score"], change["coins"], change["alive"], change["direction"] = stats
+            if change:
+                changes[pid] = change
+        return changes
+    
+    def get_delta(self):
+        # Changes since the last keyframe or delta: heads pushed and tails
+        # popped per snake, stat changes, joins/leaves and food eaten/spawned.
+        changes = self._player_changes()
+        added = {}
+        for pid in self.added_players:
+            if pid in self.players:
+                added[pid] = self.players[pid].to_dict()
+        players = {pid: change for pid, change in changes.items() if pid not in added}
+        
+        delta = {
+            "seq": self.seq,
+            "base": self.delta_base,
+            "players": players,
+            "added": added,
+            "removed": self.removed_players,
+            "foods_eaten": self.eaten_food_ids,
+            "foods_spawned": [food.to_dict() for food in self.spawned_foods]
+        }
+        self._clear_changes()
+        return delta
+    
+    def view_buckets(self, index: BucketIndex, bucket: int) -> List[int]:
+        # Buckets a player whose head is in `bucket` can see, wrapping at the edges
+        row, column = divmod(bucket, index.columns)
+        size = index.bucket_size
+        # A partial bucket at the edge shortens the reach across the wrap
+        reach_x = -(-(VIEW_WIDTH // 2) // size) + (1 if self.width % size else 0)
+        reach_y = -(-(VIEW_HEIGHT // 2) // size) + (1 if self.height % size else 0)
+        if 2 * reach_x + 1 >= index.columns:
+            columns = range(index.columns)
+        else:
+            columns = [(column + dx) % index.columns for dx in range(-reach_x, reach_x + 1)]
+        if 2 * reach_y + 1 >= index.rows:
+            rows = range(index.rows)
+        else:
+            rows = [(row + dy) % index.rows for dy in range(-reach_y, reach_y + 1)]
+        return [r * index.columns + c for r in rows for c in columns]
+    
+    def get_view_frames(self, keyframe: bool, keyframe_users: Set[str]) -> List[Tuple[str, dict, List[str]]]:
+        # Area-of-interest version of get_keyframe/get_delta. Players whose
+        # heads share a bucket see the same entities, so frames are built per
+        # view rather than per player. Returns [(kind, body, user_ids)].
+        # A player gets a keyframe of their view when asked for, when the
+        # periodic keyframe is due, or when their head moved to another view.
+        changes = self._player_changes()
+        
+        index = BucketIndex(self.width, self.height)
+        for snake in self.players.values():
+            index.add_snake(snake)
+        for cell, foods in self.food_cells.items():
+            for food in foods:
+                index.add_food(cell, food)
+        
+        members: Dict[int, List[str]] = {}
+        for pid, snake in self.players.items():
+            if snake.bot:
+                continue
+            members.setdefault(index.bucket(snake.body[0]), []).append(pid)
+        
+        frames = []
+        views = {}
+        timestamp = time.time()
+        for key, user_ids in members.items():
+            visible_players: Set[str] = set()
+            visible_foods: Dict[int, Food] = {}
+            for bucket in self.view_buckets(index, key):
+                visible_players.update(index.players.get(bucket, ()))
+                for food in index.foods.get(bucket, ()):
+                    visible_foods[food.id] = food
+            views[key] = (visible_players, set(visible_foods))
+            
+            previous = self.views.get(key)
+            fresh = []
+            stay = []
+            for pid in user_ids:
+                if keyframe or pid in keyframe_users or self.player_views.get(pid) != key:
+                    fresh.append(pid)
+                else:
+                    stay.append(pid)
+            
+            if fresh:
+                frames.append(("keyframe", {
+                    "room_id": self.room_id,
+                    "seq": self.seq,
+                    "players": {pid: self.players[pid].to_dict() for pid in visible_players},
+                    "foods": [food.to_dict() for food in visible_foods.values()],
+                    "timestamp": timestamp
+                }, fresh))
+            
+            if stay:
+                seen_players, seen_foods = previous
+                frames.append(("delta", {
+                    "seq": self.seq,
+                    "base": self.delta_base,
+                    "players": {pid: changes[pid] for pid in visible_players & seen_players if pid in changes},
+                    "added": {pid: self.players[pid].to_dict() for pid in visible_players - seen_players},
+                    "removed": list(seen_players - visible_players),
+                    "foods_eaten": list(seen_foods - visible_foods.keys()),
+                    "foods_spawned": [visible_foods[food_id].to_dict() for food_id in visible_foods.keys() - seen_foods],
+                    "timestamp": timestamp
+                }, stay))
+        
+        self.views = views
+        self.player_views = {pid: key for key, user_ids in members.items() for pid in user_ids}
+        self._clear_changes()
+        if keyframe:
+            self.keyframe_seq = self.seq
+        return frames
+    
+    def get_leaderboard(self) -> List[dict]:
+        # Shared list, rebuilt only after a change; don't modify it
+        return self.ranking.get()
+    
+    def leaderboard_due(self, min_ticks: int) -> bool:
+        # Changed since it last went out, and not sent in the last min_ticks
+        return self.ranking.version != self.leaderboard_version and self.seq - self.leaderboard_seq >= min_ticks
+    
+    def mark_leaderboard_sent(self):
+        self.leaderboard_version = self.ranking.version
+        self.leaderboard_seq = self.seq
+
+def create_room(room_id: str, max_players: int = 10, is_private: bool = False, engine: str = "python",
+                width: int = GRID_WIDTH, height: int = GRID_HEIGHT, food_count: int = None,
+                seed: Optional[int] = None) -> GameRoom:
+    if food_count is None:
+        food_count = food_target(width, height)
+    room_class = GameRoom
+    if engine == "numpy":
+        # Optional dependency, only needed for rooms that ask for it
+        from numpy_engine import NumpyGameRoom
+        room_class = NumpyGameRoom
+    return room_class(room_id, max_players=max_players, is_private=is_private,
+                      width=width, height=height, food_count=food_count, seed=seed)
\ No newline at end of file
@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from game_logic import TICK_RATE
+from protocol import BINARY_PROTOCOL, BinaryDecoder, encode_input
+from simulation import SEND_RATE
+
+# Load generator: opens many /ws/{client_id} connections against a running
+# server, joins global and private rooms with the normal join_room / move /
+# leave_room actions, and turns at human-like random intervals. The clients
+# connect without a token, so the server has to let guests in:
+#
+#   WS_ALLOW_GUESTS=1 uvicorn main:app --port 8000            (from backend/)
+#   python loadgen.py --clients 500 --duration 60 --server-pid $(pgrep -f uvicorn)
+#
+# --protocol binary speaks the binary wire protocol instead of JSON.
+# --spectators adds clients that watch the global room without playing.
+#
+# Reports frame latency (server timestamp to receipt, so run it on the same
+# host), input latency (move sent to direction seen in a frame), the server
+# tick rate seen through seq numbers, late frames, dropped frames detected
+# through delta base mismatches, and server RSS growth when --server-pid is
+# given.
+
+TURNS = {
+    "UP": ["LEFT", "RIGHT"],
+    "DOWN": ["LEFT", "RIGHT"],
+    "LEFT": ["UP", "DOWN"],
+    "RIGHT": ["UP", "DOWN"],
+}
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.disconnected = 0
+        self.frames = 0
+        self.bytes = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.dropped = 0  # deltas whose base did not match the last seq we saw
+        self.late_frames = 0  # arrived more than 1.5 send intervals after the previous one
+        self.frame_intervals = 0
+        self.moves_sent = 0
+        self.frame_latency: List[float] = []
+        self.input_latency: List[float] = []
+        self.tick_rates: List[float] = []
+
+class SimulatedClient:
+    def __init__(self, url: str, client_id: str, room_id: str, args, stats: Stats, rng: random.Random,
+                 spectator: bool = False):
+        self.url = url
+        self.spectator = spectator
+        self.client_id = client_id
+        self.room_id = room_id
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.direction = "RIGHT"
+        self.last_seq: Optional[int] = None
+        self.last_frame_at: Optional[float] = None
+        self.first_seq: Optional[tuple] = None
+        self.pending_move: Optional[tuple] = None  # (direction, sent_at)
+        self.player_id: Optional[str] = None  # assigned by the server on connect
+        self.binary = args.protocol == "binary"
+        self.decoder = BinaryDecoder()
+    
+    def decode(self, raw):
+        if isinstance(raw, bytes):
+            if self.binary:
+                return self.decoder.decode(raw)
+            return msgpack.unpackb(raw, raw=False)
+        return json.loads(raw)
+    
+    async def send(self, websocket, message: dict):
+        await websocket.send(encode_input(message) if self.binary else json.dumps(message))
+    
+    async def join(self, websocket):
+        self.last_seq = None
+        if self.spectator:
+            await self.send(websocket, {"action": "spectate", "room_id": self.room_id})
+            return
+        await self.send(websocket, {
+            "action": "join_room",
+            "room_id": self.room_id,
+            "color": "#00FF00",
+        })
+    
+    async def run(self, stop_at: float):
+        try:
+            subprotocols = [BINARY_PROTOCOL] if self.binary else None
+            async with websockets.connect(f"{self.url}/ws/{self.client_id}", max_size=None,
+                                          subprotocols=subprotocols) as websocket:
+                self.stats.connected += 1
+                await self.join(websocket)
+                await asyncio.gather(self.read_frames(websocket, stop_at), self.play(websocket, stop_at))
+        except (OSError, websockets.InvalidHandshake):
+            self.stats.failed += 1
+        except websockets.ConnectionClosed:
+            self.stats.disconnected += 1
+        self.record_tick_rate()
+    
+    async def play(self, websocket, stop_at: float):
+        if self.spectator:
+            await asyncio.sleep(max(0, stop_at - time.time()))
+        while time.time() < stop_at:
+            await asyncio.sleep(min(self.rng.expovariate(self.args.move_rate), max(0, stop_at - time.time())))
+            if time.time() >= stop_at:
+                break
+            
+            if self.args.rejoin_rate and self.rng.random() < self.args.rejoin_rate / self.args.move_rate:
+                await self.send(websocket, {"action": "leave_room"})
+                await self.join(websocket)
+                continue
+            
+            self.direction = self.rng.choice(TURNS[self.direction])
+            self.pending_move = (self.direction, time.time())
+            self.stats.moves_sent += 1
+            await self.send(websocket, {"action": "move", "direction": self.direction})
+        await websocket.close()
+    
+    async def read_frames(self, websocket, stop_at: float):
+        async for raw in websocket:
+            received_at = time.time()
+            self.stats.frames += 1
+            self.stats.bytes += len(raw)
+            message = self.decode(raw)
+            kind = message.get("type")
+            
+            if kind == "connected":
+                self.player_id = message["player_id"]
+            elif kind == "room_joined":
+                # Frames from the previous room may have arrived after join()
+                self.last_seq = None
+            elif kind == "game_state":
+                self.stats.keyframes += 1
+                self.on_state_frame(message["state"]["seq"], message["state"].get("timestamp"), received_at)
+                self.check_direction(message["state"]["players"].get(self.player_id), received_at)
+            elif kind == "game_delta":
+                self.stats.deltas += 1
+                if self.last_seq is not None and message["base"] != self.last_seq:
+                    self.stats.dropped += 1
+                    self.last_seq = None
+                    await self.send(websocket, {"action": "resync"})
+                    continue
+                if self.last_seq is None:
+                    continue
+                self.on_state_frame(message["seq"], message.get("timestamp"), received_at)
+                self.check_direction(message["players"].get(self.player_id), received_at)
+            
+            if received_at >= stop_at:
+                break
+    
+    def on_state_frame(self, seq: int, timestamp: Optional[float], received_at: float):
+        if timestamp is not None:
+            self.stats.frame_latency.append(received_at - timestamp)
+        if self.last_frame_at is not None:
+            self.stats.frame_intervals += 1
+            if received_at - self.last_frame_at > 1.5 / SEND_RATE:
+                self.stats.late_frames += 1
+        if self.first_seq is None:
+            self.first_seq = (seq, received_at)
+        self.last_seq = seq
+        self.last_frame_at = received_at
+    
+    def check_direction(self, player: Optional[Dict], received_at: float):
+        if player and self.pending_move and player.get("direction") == self.pending_move[0]:
+            self.stats.input_latency.append(received_at - self.pending_move[1])
+            self.pending_move = None
+    
+    def record_tick_rate(self):
+        if self.first_seq is not None and self.last_seq is not None and self.last_frame_at > self.first_seq[1]:
+            self.stats.tick_rates.append((self.last_seq - self.first_seq[0]) / (self.last_frame_at - self.first_seq[1]))
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+async def sample_rss(pid: int, samples: List[int], stop_at: float):
+    while time.time() < stop_at:
+        rss = read_rss_kb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(1)
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def main_async(args) -> Dict:
+    rng = random.Random(args.seed)
+    stats = Stats()
+    stop_at = time.time() + args.ramp + args.duration
+    
+    clients = []
+    private_clients = int(args.clients * args.private_fraction)
+    for i in range(args.clients):
+        client_id = f"load_{args.seed}_{i}"
+        # Private rooms hold two players, so pair clients up
+        room_id = f"LOAD{i // 2:05d}" if i < private_clients else "global"
+        clients.append(SimulatedClient(args.url, client_id, room_id, args, stats, random.Random(rng.random())))
+    for i in range(args.spectators):
+        clients.append(SimulatedClient(args.url, f"watch_{args.seed}_{i}", "global", args, stats,
+                                       random.Random(rng.random()), spectator=True))
+    
+    rss_samples: List[int] = []
+    tasks = []
+    if args.server_pid:
+        tasks.append(asyncio.create_task(sample_rss(args.server_pid, rss_samples, stop_at)))
+    for i, client in enumerate(clients):
+        tasks.append(asyncio.create_task(client.run(stop_at)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / len(clients))
+    await asyncio.gather(*tasks)
+    
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else value * 1000
+    
+    return {
+        "config": vars(args),
+        "clients": {"connected": stats.connected, "failed": stats.failed, "disconnected": stats.disconnected},
+        "frames": stats.frames,
+        "keyframes": stats.keyframes,
+        "deltas": stats.deltas,
+        "bytes_received": stats.bytes,
+        "dropped_frames": stats.dropped,
+        "late_frame_rate": stats.late_frames / stats.frame_intervals if stats.frame_intervals else None,
+        "server_tick_rate": {
+            "expected": TICK_RATE,
+            "p50": percentile(stats.tick_rates, 50),
+            "min": min(stats.tick_rates) if stats.tick_rates else None,
+        },
+        "frame_latency_ms": {"p50": ms(percentile(stats.frame_latency, 50)), "p99": ms(percentile(stats.frame_latency, 99))},
+        "input_latency_ms": {"p50": ms(percentile(stats.input_latency, 50)), "p99": ms(percentile(stats.input_latency, 99))},
+        "moves_sent": stats.moves_sent,
+        "server_rss_kb": {
+            "start": rss_samples[0] if rss_samples else None,
+            "end": rss_samples[-1] if rss_samples else None,
+            "peak": max(rss_samples) if rss_samples else None,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated WebSocket clients for load testing")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--spectators", type=int, default=0, help="extra clients that only watch the global room")
+    parser.add_argument("--private-fraction", type=float, default=0.5, help="share of clients paired into private rooms")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run after the ramp-up")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which clients connect")
+    parser.add_argument("--move-rate", type=float, default=3, help="mean turns per second per client")
+    parser.add_argument("--rejoin-rate", type=float, default=0.01, help="leave/rejoins per second per client")
+    parser.add_argument("--server-pid", type=int, help="sample this process's RSS (Linux only)")
+    parser.add_argument("--protocol", default="json", choices=["json", "binary"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the result JSON here")
+    args = parser.parse_args()
+    
+    result = asyncio.run(main_async(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,141 +1,295 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, status
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-import json
-import uuid
-import asyncio
-from typing import List
-
-from database import get_db, User, GameSession
-from auth import authenticate_user, create_access_token, get_password_hash, get_current_user
-from websocket_manager import manager
-import models
-
-app = FastAPI(title="Snake Multiplayer API")
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Serve static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# API Routes
-@app.post("/register")
-async def register(username: str, password: str, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.username == username).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Username already exists")
-    
-    hashed_password = get_password_hash(password)
-    user = User(
-        username=username,
-        password_hash=hashed_password,
-        owned_skins=["default", "green", "blue", "red"]
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    
-    return {"message": "User created successfully", "user_id": user.id}
-
-@app.post("/login")
-async def login(username: str, password: str, db: Session = Depends(get_db)):
-    user = authenticate_user(db, username, password)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-        )
-    
-    access_token = create_access_token(data={"sub": username})
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": {
-            "id": user.id,
-            "username": user.username,
-            "total_score": user.total_score,
-            "total_coins": user.total_coins,
-            "owned_skins": user.owned_skins,
-            "current_skin": user.current_skin
-        }
-    }
-
-@app.get("/users/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
-    return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "total_score": current_user.total_score,
-        "total_coins": current_user.total_coins,
-        "owned_skins": current_user.owned_skins,
-        "current_skin": current_user.current_skin,
-        "games_played": current_user.games_played,
-        "kills": current_user.kills,
-        "deaths": current_user.deaths
-    }
-
-@app.get("/leaderboard")
-async def get_global_leaderboard(db: Session = Depends(get_db), limit: int = 10):
-    users = db.query(User).order_by(User.total_score.desc()).limit(limit).all()
-    return [
-        {
-            "username": user.username,
-            "total_score": user.total_score,
-            "total_coins": user.total_coins,
-            "games_played": user.games_played
-        }
-        for user in users
-    ]
-
-@app.post("/buy_skin")
-async def buy_skin(skin_id: str, price: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if current_user.total_coins < price:
-        raise HTTPException(status_code=400, detail="Not enough coins")
-    
-    if skin_id in current_user.owned_skins:
-        raise HTTPException(status_code=400, detail="Skin already owned")
-    
-    current_user.total_coins -= price
-    current_user.owned_skins.append(skin_id)
-    db.commit()
-    
-    return {"message": "Skin purchased successfully"}
-
-@app.post("/select_skin")
-async def select_skin(skin_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if skin_id not in current_user.owned_skins:
-        raise HTTPException(status_code=400, detail="Skin not owned")
-    
-    current_user.current_skin = skin_id
-    db.commit()
-    
-    return {"message": "Skin selected successfully"}
-
-# WebSocket endpoint
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
-    try:
-        while True:
-            data = await websocket.receive_json()
-            await manager.handle_message(client_id, data)
-    except WebSocketDisconnect:
-        manager.disconnect(client_id)
-
-@app.on_event("startup")
-async def startup_event():
-    # Start game loop in background
-    asyncio.create_task(manager.game_loop())
-
-if __name__ == "__main__":
-    import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Response, status
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import hmac
+import json
+import logging
+import os
+import uuid
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from database import User, GameSession, run_db, db_executor
+from auth import authenticate_user, create_access_token, get_password_hash_async, get_current_user, user_for_token, invalidate_user
+from passwords import shutdown_password_pool
+from rankings import leaderboard
+from websocket_manager import manager
+from protocol import decode_input
+from metrics import TickProfiler
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Snake Multiplayer API")
+
+# CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Serve static files
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# API Routes
+# Database work happens in the sync helpers, which run_db calls on the
+# database threads; the endpoints themselves never block the event loop.
+
+def create_user(db: Session, username: str, password_hash: str):
+    existing_user = db.query(User).filter(User.username == username).first()
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    
+    user = User(
+        username=username,
+        password_hash=password_hash,
+        owned_skins=["default", "green", "blue", "red"]
+    )
+    db.add(user)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Lost a race with another sign-up for the same name
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Username already exists")
+    db.refresh(user)
+    return user.id
+
+@app.post("/register")
+async def register(username: str, password: str):
+    hashed_password = await get_password_hash_async(password)
+    user_id = await run_db(create_user, username, hashed_password)
+    leaderboard.set(username, 0, 0, 0)
+    
+    return {"message": "User created successfully", "user_id": user_id}
+
+@app.post("/login")
+async def login(username: str, password: str):
+    user = await authenticate_user(username, password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+        )
+    
+    access_token = create_access_token(data={"sub": username})
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "total_score": user.total_score,
+            "total_coins": user.total_coins,
+            "owned_skins": user.owned_skins,
+            "current_skin": user.current_skin
+        }
+    }
+
+@app.get("/users/me")
+async def read_users_me(current_user: User = Depends(get_current_user)):
+    return {
+        "id": current_user.id,
+        "username": current_user.username,
+        "total_score": current_user.total_score,
+        "total_coins": current_user.total_coins,
+        "owned_skins": current_user.owned_skins,
+        "current_skin": current_user.current_skin,
+        "games_played": current_user.games_played,
+        "kills": current_user.kills,
+        "deaths": current_user.deaths
+    }
+
+def top_users(db: Session, limit: int):
+    users = db.query(User).order_by(User.total_score.desc()).limit(limit).all()
+    return [
+        {
+            "username": user.username,
+            "total_score": user.total_score,
+            "total_coins": user.total_coins,
+            "games_played": user.games_played
+        }
+        for user in users
+    ]
+
+def rank_of(db: Session, username: str, total_score: int):
+    return db.query(User).filter(
+        (User.total_score > total_score) | ((User.total_score == total_score) & (User.username < username))
+    ).count() + 1
+
+# Global leaderboard responses come from the in-process ranking, rendered once
+# per limit until it changes. Clients may reuse them for LEADERBOARD_TTL
+# seconds and revalidate with If-None-Match after that.
+LEADERBOARD_TTL = 5
+LEADERBOARD_MAX_LIMIT = 100
+LEADERBOARD_EPOCH = uuid.uuid4().hex[:8]  # keeps ETags from matching across restarts
+leaderboard_responses: Dict[int, Tuple[int, str]] = {}  # limit -> (version, body)
+
+@app.get("/leaderboard")
+async def get_global_leaderboard(request: Request, limit: int = 10):
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    if not leaderboard.loaded:
+        # Falls back to the total_score index
+        return await run_db(top_users, limit)
+    
+    etag = f'"{LEADERBOARD_EPOCH}-{leaderboard.version}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={LEADERBOARD_TTL}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    cached = leaderboard_responses.get(limit)
+    if cached is None or cached[0] != leaderboard.version:
+        cached = (leaderboard.version, json.dumps(leaderboard.top(limit)))
+        leaderboard_responses[limit] = cached
+    return Response(cached[1], media_type="application/json", headers=headers)
+
+@app.get("/leaderboard/me")
+async def get_my_rank(current_user: User = Depends(get_current_user)):
+    total_score = current_user.total_score
+    if leaderboard.loaded and current_user.username in leaderboard.entries:
+        total_score = leaderboard.entries[current_user.username]["total_score"]
+        rank = leaderboard.rank(current_user.username)
+    else:
+        rank = await run_db(rank_of, current_user.username, total_score)
+    return {
+        "username": current_user.username,
+        "rank": rank,
+        "total_score": total_score
+    }
+
+def purchase_skin(db: Session, user_id: int, skin_id: str, price: int):
+    user = db.get(User, user_id)
+    if user.total_coins < price:
+        raise HTTPException(status_code=400, detail="Not enough coins")
+    
+    if skin_id in user.owned_skins:
+        raise HTTPException(status_code=400, detail="Skin already owned")
+    
+    # Spend coins in SQL so stats flushes adding coins meanwhile aren't lost.
+    # owned_skins is replaced rather than appended to; in-place JSON changes
+    # are not tracked.
+    result = db.execute(
+        update(User)
+        .where(User.id == user_id, User.total_coins >= price)
+        .values(total_coins=User.total_coins - price, owned_skins=user.owned_skins + [skin_id])
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=400, detail="Not enough coins")
+    db.commit()
+
+@app.post("/buy_skin")
+async def buy_skin(skin_id: str, price: int, current_user: User = Depends(get_current_user)):
+    await run_db(purchase_skin, current_user.id, skin_id, price)
+    invalidate_user(current_user.username)
+    leaderboard.add(current_user.username, {"total_coins": -price})
+    
+    return {"message": "Skin purchased successfully"}
+
+def choose_skin(db: Session, user_id: int, skin_id: str):
+    user = db.get(User, user_id)
+    if skin_id not in user.owned_skins:
+        raise HTTPException(status_code=400, detail="Skin not owned")
+    
+    user.current_skin = skin_id
+    db.commit()
+
+@app.post("/select_skin")
+async def select_skin(skin_id: str, current_user: User = Depends(get_current_user)):
+    await run_db(choose_skin, current_user.id, skin_id)
+    invalidate_user(current_user.username)
+    
+    return {"message": "Skin selected successfully"}
+
+@app.get("/rooms/stats")
+async def get_room_stats():
+    # Rooms simulated by this process (this node, with a room directory)
+    return manager.simulation.room_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(manager.render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Captures cProfile or tracemalloc data over the next ticks into PROFILE_DIR,
+# see metrics.TickProfiler. Off unless PROFILE_TOKEN is set.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_MAX_TICKS = 10000
+
+@app.post("/debug/profile")
+async def start_profile(token: str, mode: str = "cprofile", ticks: int = 200):
+    if not PROFILE_TOKEN or not hmac.compare_digest(token, PROFILE_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if mode not in TickProfiler.modes:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(TickProfiler.modes)}")
+    ticks = max(1, min(ticks, PROFILE_MAX_TICKS))
+    paths = manager.simulation.start_profile(mode, ticks)
+    if not paths:
+        raise HTTPException(status_code=409, detail="A capture is already running")
+    return {"mode": mode, "ticks": ticks, "paths": paths}
+
+# WebSocket endpoint
+# Players are identified by the token they connect with (?token=...), not by
+# client_id. WS_ALLOW_GUESTS=1 lets connections without a token in as
+# guest-<client_id>, for local load tests.
+WS_ALLOW_GUESTS = os.environ.get("WS_ALLOW_GUESTS") == "1"
+
+@app.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str, token: Optional[str] = None):
+    user = await user_for_token(token) if token else None
+    if user is not None:
+        player_id, username, skin = f"user-{user.id}", user.username, user.current_skin
+    elif WS_ALLOW_GUESTS:
+        player_id = username = f"guest-{client_id}"
+        skin = "default"
+    else:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    connection = await manager.connect(websocket, player_id, username, skin)
+    try:
+        while True:
+            # Text (JSON) or binary protocol input, see protocol.py; over the
+            # connection's rate limit it isn't even decoded
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if connection.allow_input():
+                manager.handle_message(player_id, decode_input(message))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        logger.exception("Closing connection of %s after a bad message", player_id)
+        await manager.close_socket(websocket, status.WS_1011_INTERNAL_ERROR)
+    finally:
+        manager.disconnect(player_id, connection)
+
+# Links between the nodes of a cluster, see cluster.py
+@app.websocket("/internal/link/{node_id}")
+async def cluster_link(websocket: WebSocket, node_id: str):
+    if manager.cluster is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await manager.cluster.serve_link(websocket, node_id)
+
+@app.on_event("startup")
+async def startup_event():
+    if leaderboard.enabled:
+        # Load the global leaderboard before games start reporting scores
+        leaderboard.load(await run_db(leaderboard.fetch_rows))
+    # Start game loop in background
+    asyncio.create_task(manager.game_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    manager.shutdown()
+    shutdown_password_pool()
+    db_executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
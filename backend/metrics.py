@@ -0,0 +1,174 @@
+import bisect
+import cProfile
+import os
+import time
+import tracemalloc
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Instrumentation behind /metrics, in the Prometheus text format. Counters
+# are always on; phase timings are sampled, one tick (or fan-out call) in
+# METRICS_SAMPLE_EVERY, so the hot path mostly pays for a modulo.
+METRICS_SAMPLE_EVERY = int(os.environ.get("METRICS_SAMPLE_EVERY", "10"))
+# Histogram bucket upper bounds, in seconds
+PHASE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+# Phases timed by the simulation: a whole advance(), GameRoom.update, a
+# room's send (building its state or delta, encoding, handing it to the
+# sink), the encoding alone and steering a room's bots
+SIMULATION_PHASES = ("tick", "update", "broadcast", "serialize", "bots")
+# Where /debug/profile captures go
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = PHASE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+    
+    def snapshot(self) -> list:
+        return [list(self.counts), self.sum]
+    
+    def merge(self, snapshot: list):
+        counts, total = snapshot
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+
+class SimulationMetrics:
+    # Kept by whichever process runs the rooms; shard workers send snapshots
+    # of theirs to the main process, which adds them up
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in SIMULATION_PHASES}
+        self.ticks = 0
+        self.overruns = 0  # advance() calls that took longer than a tick
+        self.skipped_ticks = 0
+        # Bot decisions made with a distance field, and on reflexes alone
+        # once the tick's bot budget was spent
+        self.bot_steps = {"field": 0, "reflex": 0}
+        # Moves buffered for the next tick, and moves over a player's
+        # per-tick limit
+        self.inputs = {"accepted": 0, "queue_full": 0}
+    
+    def snapshot(self) -> dict:
+        return {
+            "phases": {phase: histogram.snapshot() for phase, histogram in self.phases.items()},
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped_ticks,
+            "bot_steps": dict(self.bot_steps),
+            "inputs": dict(self.inputs),
+        }
+    
+    def merge(self, snapshot: dict):
+        for phase, histogram in snapshot["phases"].items():
+            self.phases[phase].merge(histogram)
+        self.ticks += snapshot["ticks"]
+        self.overruns += snapshot["overruns"]
+        self.skipped_ticks += snapshot["skipped_ticks"]
+        for mode, steps in snapshot["bot_steps"].items():
+            self.bot_steps[mode] += steps
+        for result, count in snapshot["inputs"].items():
+            self.inputs[result] += count
+
+class ServerMetrics:
+    # The socket-owning process: what actually went out to clients
+    def __init__(self):
+        self.frames_sent: Dict[str, int] = {}  # protocol -> frames
+        self.bytes_sent: Dict[str, int] = {}
+        self.frames_dropped = 0
+        self.lag_disconnects = 0
+        self.inputs_limited = 0  # client messages dropped by the rate limit
+        self.fanout = Histogram()
+        self.fanout_calls = 0
+    
+    def sent(self, protocol: str, size: int):
+        self.frames_sent[protocol] = self.frames_sent.get(protocol, 0) + 1
+        self.bytes_sent[protocol] = self.bytes_sent.get(protocol, 0) + size
+    
+    def sample_fanout(self) -> bool:
+        self.fanout_calls += 1
+        return self.fanout_calls % METRICS_SAMPLE_EVERY == 0
+
+server_metrics = ServerMetrics()
+
+def label_text(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+class Exposition:
+    # Builds the text of one /metrics response
+    def __init__(self):
+        self.lines: List[str] = []
+    
+    def metric(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{label_text(labels)} {value}")
+    
+    def counter(self, name: str, help_text: str, value: float, labels: Dict[str, str] = None):
+        self.metric(name, "counter", help_text, [(labels or {}, value)])
+    
+    def gauge(self, name: str, help_text: str, value: float, labels: Dict[str, str] = None):
+        self.metric(name, "gauge", help_text, [(labels or {}, value)])
+    
+    def histograms(self, name: str, help_text: str, histograms: Iterable[Tuple[Dict[str, str], Histogram]]):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                self.lines.append(f"{name}_bucket{label_text(dict(labels, le=le))} {cumulative}")
+            self.lines.append(f"{name}_sum{label_text(labels)} {histogram.sum}")
+            self.lines.append(f"{name}_count{label_text(labels)} {cumulative}")
+    
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+class TickProfiler:
+    # One on-demand capture over the next N simulation ticks, written to a
+    # file: cProfile stats (load with pstats) or a tracemalloc snapshot
+    # (tracemalloc.Snapshot.load). cProfile sees everything the thread runs
+    # meanwhile, so in-process that includes fan-out and socket writes.
+    modes = ("cprofile", "tracemalloc")
+    
+    def __init__(self, mode: str, ticks: int, path: str):
+        self.mode = mode
+        self.ticks_left = ticks
+        self.path = path
+        self.profile: Optional[cProfile.Profile] = None
+    
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            tracemalloc.start(25)
+    
+    def tick(self, steps: int) -> bool:
+        # True once the capture is written
+        self.ticks_left -= steps
+        if self.ticks_left > 0:
+            return False
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+        else:
+            tracemalloc.take_snapshot().dump(self.path)
+            tracemalloc.stop()
+        return True
+
+def profile_path(mode: str, suffix: str = "") -> str:
+    extension = "prof" if mode == "cprofile" else "tracemalloc"
+    return os.path.join(PROFILE_DIR, f"{mode}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.{extension}")
\ No newline at end of file
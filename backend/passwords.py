@@ -0,0 +1,44 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# bcrypt is slow on purpose, so hashing and verifying run in a small pool of
+# worker processes instead of on the event loop. This module stays free of
+# app imports because every worker imports it.
+
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", min(4, os.cpu_count() or 1)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+password_pool: Optional[ProcessPoolExecutor] = None
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def get_password_pool() -> ProcessPoolExecutor:
+    global password_pool
+    if password_pool is None:
+        # spawn rather than fork: the server process already runs threads
+        password_pool = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return password_pool
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_password_pool(), verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_password_pool(), get_password_hash, password)
+
+def shutdown_password_pool():
+    global password_pool
+    if password_pool is not None:
+        password_pool.shutdown(wait=False, cancel_futures=True)
+        password_pool = None
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, insert, update
+
+from database import engine, db_executor, User, GameSession
+from rankings import leaderboard
+from auth import invalidate_user
+
+# Write-behind persistence of game results. Rooms report events (see
+# GameRoom.events), which are coalesced per user in memory and written in
+# bulk on the database threads: one executemany UPDATE for every user touched
+# since the last flush and one INSERT for finished matches, however many
+# kills happened in between. Nothing here blocks the event loop.
+
+# Flush at least this often, or as soon as this many users/matches are pending
+FLUSH_INTERVAL = 2.0
+FLUSH_SIZE = 500
+
+USER_STATS = ("total_score", "total_coins", "kills", "deaths", "games_played")
+
+logger = logging.getLogger(__name__)
+
+users = User.__table__
+update_user_stats = (
+    update(users)
+    .where(users.c.username == bindparam("b_username"))
+    .values({column: users.c[column] + bindparam(f"b_{column}") for column in USER_STATS})
+)
+
+class StatsWriter:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, flush_size: int = FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending: Dict[str, Dict[str, int]] = {}  # username -> increments per column
+        self.matches: List[dict] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.flushes = 0
+        self.failed_flushes = 0
+    
+    def record(self, events: Iterable[tuple]):
+        for event in events:
+            kind = event[0]
+            if kind == "match":
+                self.matches.append(event[1])
+                continue
+            
+            stats = self.pending.get(event[1])
+            if stats is None:
+                stats = self.pending[event[1]] = dict.fromkeys(USER_STATS, 0)
+            if kind == "life":
+                stats["total_score"] += event[2]
+                stats["total_coins"] += event[3]
+            elif kind == "kill":
+                stats["kills"] += 1
+            elif kind == "death":
+                stats["deaths"] += 1
+            elif kind == "joined":
+                stats["games_played"] += 1
+        
+        if self.wakeup is not None and len(self.pending) + len(self.matches) >= self.flush_size:
+            self.wakeup.set()
+    
+    def take(self):
+        pending, matches = self.pending, self.matches
+        self.pending, self.matches = {}, []
+        return pending, matches
+    
+    def requeue(self, pending: Dict[str, Dict[str, int]], matches: List[dict]):
+        # Merge a failed batch back in front of anything recorded since
+        for username, stats in pending.items():
+            current = self.pending.setdefault(username, dict.fromkeys(USER_STATS, 0))
+            for column, value in stats.items():
+                current[column] += value
+        self.matches = matches + self.matches
+    
+    def write(self, pending: Dict[str, Dict[str, int]], matches: List[dict]):
+        # Blocking; runs in a worker thread, or inline for the final flush
+        with engine.begin() as conn:
+            if pending:
+                conn.execute(update_user_stats, [
+                    {"b_username": username, **{f"b_{column}": value for column, value in stats.items()}}
+                    for username, stats in pending.items()
+                ])
+            if matches:
+                conn.execute(insert(GameSession.__table__), [
+                    dict(match, session_id=uuid.uuid4().hex) for match in matches
+                ])
+    
+    def publish(self, pending: Dict[str, Dict[str, int]]):
+        # Written increments go to the cached global leaderboard as well, and
+        # cached profiles of these users are now stale
+        for username, stats in pending.items():
+            leaderboard.add(username, stats)
+            invalidate_user(username)
+    
+    async def flush(self):
+        pending, matches = self.take()
+        if not pending and not matches:
+            return
+        
+        try:
+            await asyncio.get_running_loop().run_in_executor(db_executor, self.write, pending, matches)
+            self.flushes += 1
+            self.publish(pending)
+        except Exception:
+            self.failed_flushes += 1
+            logger.exception("Stats flush failed; retrying on the next one")
+            self.requeue(pending, matches)
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+    
+    def close(self):
+        # Final flush on shutdown, after the rooms have banked their players
+        pending, matches = self.take()
+        if pending or matches:
+            self.write(pending, matches)
+            self.publish(pending)
\ No newline at end of file
@@ -0,0 +1,486 @@
+import json
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# Binary wire protocol, negotiated per connection through the WebSocket
+# subprotocol: clients offering BINARY_PROTOCOL get it, everyone else JSON.
+# Game states and deltas, nearly all of the traffic, have compact layouts;
+# other messages go as JSON behind a one-byte opcode.
+#
+# Integers are LEB128 varints and strings a varint length plus UTF-8. Cells
+# are packed grid indices (y * width + x), 16-bit little-endian, or 32-bit in
+# grids of more than 65536 cells. Player ids are interned to small numbers per
+# room; a number is always introduced together with the full player.
+#
+# Server -> client, after the opcode byte:
+#   STATE  seq, timestamp ms, width, height, room_id, n players, n foods, leaderboard
+#   DELTA  seq, base, timestamp ms, n changes, n removed numbers, n added players,
+#          n eaten food ids, n spawned foods, leaderboard
+#   JSON   the message as UTF-8 JSON
+#   player:      number, id, username, skin, color, status, score, coins, n cells
+#   change:      number, flags, then per flag: n cells (BODY), n cells (PUSH),
+#                count (POP), status, score, coins (STATS)
+#   food:        id, cell, type, value
+#   status:      direction | alive << 2
+#   leaderboard: 0 when absent, else 1 and n entries of username, score, coins, alive
+#
+# Client -> server: JOIN room_id, color | MOVE direction | RESYNC | LEAVE | JSON
+
+PROTOCOL_VERSION = 1
+BINARY_PROTOCOL = f"snake.bin.{PROTOCOL_VERSION}"
+JSON_PROTOCOL = "json"
+# Subprotocols a client may offer, in the order the server prefers them
+SUBPROTOCOLS = {BINARY_PROTOCOL: BINARY_PROTOCOL, "snake.json": JSON_PROTOCOL}
+
+OP_STATE = 0x01
+OP_DELTA = 0x02
+OP_JSON = 0x7F
+
+OP_JOIN = 0x01
+OP_MOVE = 0x02
+OP_RESYNC = 0x03
+OP_LEAVE = 0x04
+
+CHANGE_BODY = 1
+CHANGE_PUSH = 2
+CHANGE_POP = 4
+CHANGE_STATS = 8
+
+DIRECTION_NAMES = ("UP", "DOWN", "LEFT", "RIGHT")
+DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTION_NAMES)}
+FOOD_TYPES = ("normal", "golden", "powerup")
+FOOD_TYPE_CODES = {name: code for code, name in enumerate(FOOD_TYPES)}
+BIG_ENDIAN = sys.byteorder == "big"
+
+# Decoded inputs are shared, handle_message only reads them
+MOVE_INPUTS = [{"action": "move", "direction": name} for name in DIRECTION_NAMES]
+RESYNC_INPUT = {"action": "resync"}
+LEAVE_INPUT = {"action": "leave_room"}
+
+def negotiate(offered: List[str]) -> Tuple[str, Optional[str]]:
+    # (protocol, subprotocol to accept with)
+    for subprotocol, protocol in SUBPROTOCOLS.items():
+        if subprotocol in offered:
+            return protocol, subprotocol
+    return JSON_PROTOCOL, None
+
+def write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def write_string(out: bytearray, value: str):
+    data = value.encode("utf-8")
+    write_varint(out, len(data))
+    out += data
+
+def encode_json(opcode: int, message: dict) -> bytes:
+    return bytes((opcode,)) + json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+class BinaryEncoder:
+    # Messages without a compact layout; RoomCodec adds the game state ones
+    name = BINARY_PROTOCOL
+    binary = True
+    
+    def encode(self, message: dict) -> bytes:
+        return encode_json(OP_JSON, message)
+
+class RoomCodec(BinaryEncoder):
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.cell_type = "H" if width * height <= 0x10000 else "I"
+        self.cell_size = 2 if self.cell_type == "H" else 4
+        self.numbers: Dict[str, int] = {}  # player id -> number
+        # Numbers of players who left, kept until the frames telling clients
+        # so have been encoded (see recycle), then reused
+        self.released: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.next_number = 0
+        # Encoded number, id, username, skin and color, fixed while in the room
+        self.headers: Dict[str, bytes] = {}
+        # Rooms hand out the same leaderboard list until it changes
+        self.leaderboard: Optional[List[dict]] = None
+        self.leaderboard_bytes = b""
+    
+    def number(self, player_id: str) -> int:
+        number = self.numbers.get(player_id)
+        if number is None:
+            # Leaving and rejoining within one send keeps the number
+            number = self.released.pop(player_id, None)
+            if number is None:
+                if self.free:
+                    number = self.free.pop()
+                else:
+                    number = self.next_number
+                    self.next_number += 1
+            self.numbers[player_id] = number
+        return number
+    
+    def removed_number(self, player_id: str) -> int:
+        number = self.released.get(player_id)
+        return self.number(player_id) if number is None else number
+    
+    def release(self, player_id: str):
+        number = self.numbers.pop(player_id, None)
+        if number is not None:
+            self.released[player_id] = number
+        self.headers.pop(player_id, None)
+    
+    def recycle(self):
+        # Called once a room's frames for this send are encoded
+        if self.released:
+            self.free.extend(self.released.values())
+            self.released.clear()
+    
+    def encode(self, message: dict) -> bytes:
+        kind = message.get("type")
+        if kind == "game_state":
+            return self.encode_state(message)
+        if kind == "game_delta":
+            return self.encode_delta(message)
+        return encode_json(OP_JSON, message)
+    
+    def encode_state(self, message: dict) -> bytes:
+        state = message["state"]
+        out = bytearray((OP_STATE,))
+        write_varint(out, state["seq"])
+        write_varint(out, int(state["timestamp"] * 1000))
+        write_varint(out, self.width)
+        write_varint(out, self.height)
+        write_string(out, state["room_id"])
+        self.write_players(out, state["players"])
+        self.write_foods(out, state["foods"])
+        self.write_leaderboard(out, message.get("leaderboard"))
+        return bytes(out)
+    
+    def encode_delta(self, message: dict) -> bytes:
+        out = bytearray((OP_DELTA,))
+        write_varint(out, message["seq"])
+        write_varint(out, message["base"])
+        write_varint(out, int(message["timestamp"] * 1000))
+        
+        changes = message["players"]
+        write_varint(out, len(changes))
+        numbers = self.numbers
+        for pid, change in changes.items():
+            number = numbers.get(pid)
+            if number is None:
+                number = self.number(pid)
+            if number < 0x80:
+                out.append(number)
+            else:
+                write_varint(out, number)
+            flags = 0
+            if "body" in change:
+                flags |= CHANGE_BODY
+            if "push" in change:
+                flags |= CHANGE_PUSH
+            if "pop" in change:
+                flags |= CHANGE_POP
+            if "score" in change:
+                flags |= CHANGE_STATS
+            out.append(flags)
+            if flags & CHANGE_BODY:
+                self.write_cells(out, change["body"])
+            if flags & CHANGE_PUSH:
+                self.write_cells(out, change["push"])
+            if flags & CHANGE_POP:
+                write_varint(out, change["pop"])
+            if flags & CHANGE_STATS:
+                out.append(DIRECTION_CODES[change["direction"]] | change["alive"] << 2)
+                score, coins = change["score"], change["coins"]
+                if score < 0x80:
+                    out.append(score)
+                else:
+                    write_varint(out, score)
+                if coins < 0x80:
+                    out.append(coins)
+                else:
+                    write_varint(out, coins)
+        
+        # Removals first: a player who left and rejoined keeps the number
+        removed = message["removed"]
+        write_varint(out, len(removed))
+        for pid in removed:
+            write_varint(out, self.removed_number(pid))
+        self.write_players(out, message["added"])
+        eaten = message["foods_eaten"]
+        write_varint(out, len(eaten))
+        for food_id in eaten:
+            write_varint(out, food_id)
+        self.write_foods(out, message["foods_spawned"])
+        self.write_leaderboard(out, message.get("leaderboard"))
+        return bytes(out)
+    
+    def write_cells(self, out: bytearray, cells):
+        count = len(cells)
+        if count < 4:
+            # Usually the one or two heads pushed since the last send
+            out.append(count)
+            for cell in cells:
+                out += cell.to_bytes(self.cell_size, "little")
+            return
+        write_varint(out, count)
+        packed = array(self.cell_type, cells)
+        if BIG_ENDIAN:
+            packed.byteswap()
+        out += packed.tobytes()
+    
+    def write_players(self, out: bytearray, players: Dict[str, dict]):
+        write_varint(out, len(players))
+        headers = self.headers
+        for pid, player in players.items():
+            header = headers.get(pid)
+            if header is None:
+                header = bytearray()
+                write_varint(header, self.number(pid))
+                write_string(header, pid)
+                write_string(header, player["username"])
+                write_string(header, player["skin"])
+                write_string(header, player["color"])
+                header = headers[pid] = bytes(header)
+            out += header
+            out.append(DIRECTION_CODES[player["direction"]] | player["alive"] << 2)
+            # Inlined one-byte case of write_varint, the common one
+            score, coins = player["score"], player["coins"]
+            if score < 0x80:
+                out.append(score)
+            else:
+                write_varint(out, score)
+            if coins < 0x80:
+                out.append(coins)
+            else:
+                write_varint(out, coins)
+            self.write_cells(out, player["body"])
+    
+    def write_foods(self, out: bytearray, foods: List[dict]):
+        write_varint(out, len(foods))
+        width = self.width
+        for food in foods:
+            x, y = food["position"]
+            write_varint(out, food["id"])
+            write_varint(out, y * width + x)
+            out.append(FOOD_TYPE_CODES[food["type"]])
+            write_varint(out, food["value"])
+    
+    def write_leaderboard(self, out: bytearray, leaderboard: Optional[List[dict]]):
+        if leaderboard is None:
+            out.append(0)
+            return
+        if leaderboard is not self.leaderboard:
+            encoded = bytearray((1,))
+            write_varint(encoded, len(leaderboard))
+            for entry in leaderboard:
+                write_string(encoded, entry["username"])
+                write_varint(encoded, entry["score"])
+                write_varint(encoded, entry["coins"])
+                encoded.append(1 if entry["alive"] else 0)
+            self.leaderboard = leaderboard
+            self.leaderboard_bytes = bytes(encoded)
+        out += self.leaderboard_bytes
+
+def decode_input(message: dict) -> dict:
+    # A received WebSocket message (text or bytes) -> handle_message's dict;
+    # anything malformed becomes {} and is ignored
+    data = message.get("bytes")
+    if data is None:
+        try:
+            decoded = json.loads(message.get("text") or "")
+        except ValueError:
+            return {}
+        return decoded if isinstance(decoded, dict) else {}
+    
+    if not data:
+        return {}
+    opcode = data[0]
+    try:
+        if opcode == OP_MOVE:
+            return MOVE_INPUTS[data[1]]
+        if opcode == OP_RESYNC:
+            return RESYNC_INPUT
+        if opcode == OP_LEAVE:
+            return LEAVE_INPUT
+        if opcode == OP_JOIN:
+            reader = Reader(data, 1)
+            return {"action": "join_room", "room_id": reader.string(), "color": reader.string()}
+        if opcode == OP_JSON:
+            decoded = json.loads(data[1:])
+            return decoded if isinstance(decoded, dict) else {}
+    except (IndexError, ValueError):
+        pass
+    return {}
+
+def encode_input(message: dict) -> bytes:
+    # Client side of decode_input, for tools such as loadgen
+    action = message.get("action")
+    if action == "move" and message.get("direction") in DIRECTION_CODES:
+        return bytes((OP_MOVE, DIRECTION_CODES[message["direction"]]))
+    if action == "resync":
+        return bytes((OP_RESYNC,))
+    if action == "leave_room":
+        return bytes((OP_LEAVE,))
+    if action == "join_room":
+        out = bytearray((OP_JOIN,))
+        write_string(out, message.get("room_id", "global"))
+        write_string(out, message.get("color", "#00FF00"))
+        return bytes(out)
+    return encode_json(OP_JSON, message)
+
+class Reader:
+    def __init__(self, data: bytes, position: int = 0):
+        self.data = data
+        self.position = position
+    
+    def byte(self) -> int:
+        value = self.data[self.position]
+        self.position += 1
+        return value
+    
+    def varint(self) -> int:
+        value = 0
+        shift = 0
+        while True:
+            byte = self.data[self.position]
+            self.position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+    
+    def string(self) -> str:
+        length = self.varint()
+        end = self.position + length
+        if end > len(self.data):
+            raise ValueError("truncated string")
+        value = self.data[self.position:end].decode("utf-8")
+        self.position = end
+        return value
+    
+    def cells(self, cell_type: str) -> List[int]:
+        count = self.varint()
+        packed = array(cell_type)
+        end = self.position + count * packed.itemsize
+        packed.frombytes(self.data[self.position:end])
+        if BIG_ENDIAN:
+            packed.byteswap()
+        self.position = end
+        return packed.tolist()
+
+class BinaryDecoder:
+    # Turns server frames back into the JSON protocol's messages. Keeps the
+    # player numbers and grid size of the room, so one decoder per connection.
+    def __init__(self):
+        self.players: Dict[int, str] = {}  # number -> player id
+        self.width = 0  # unknown until the room's first keyframe
+        self.cell_type = "H"
+    
+    def decode(self, data: bytes) -> dict:
+        opcode = data[0]
+        if opcode == OP_JSON:
+            message = json.loads(data[1:])
+            if message.get("type") == "room_joined":
+                self.players = {}
+                self.width = 0
+            return message
+        reader = Reader(data, 1)
+        if opcode == OP_STATE:
+            return self.decode_state(reader)
+        if opcode == OP_DELTA:
+            return self.decode_delta(reader)
+        raise ValueError(f"Unknown opcode {opcode}")
+    
+    def decode_state(self, reader: Reader) -> dict:
+        seq = reader.varint()
+        timestamp = reader.varint() / 1000
+        self.width = reader.varint()
+        height = reader.varint()
+        self.cell_type = "H" if self.width * height <= 0x10000 else "I"
+        room_id = reader.string()
+        self.players = {}
+        players = self.read_players(reader)
+        foods = self.read_foods(reader)
+        message = {
+            "type": "game_state",
+            "state": {"room_id": room_id, "seq": seq, "players": players, "foods": foods, "timestamp": timestamp}
+        }
+        self.read_leaderboard(reader, message)
+        return message
+    
+    def decode_delta(self, reader: Reader) -> dict:
+        message = {"type": "game_delta", "seq": reader.varint(), "base": reader.varint()}
+        message["timestamp"] = reader.varint() / 1000
+        if not self.width:
+            # Before the keyframe cells can't be read; clients drop these anyway
+            return message
+        
+        # Numbers this decoder hasn't seen (frames that arrive before the first
+        # keyframe) are read and dropped, as the JSON client ignores their ids
+        changes = {}
+        for _ in range(reader.varint()):
+            pid = self.players.get(reader.varint())
+            flags = reader.byte()
+            change = {}
+            if flags & CHANGE_BODY:
+                change["body"] = reader.cells(self.cell_type)
+            if flags & CHANGE_PUSH:
+                change["push"] = reader.cells(self.cell_type)
+            if flags & CHANGE_POP:
+                change["pop"] = reader.varint()
+            if flags & CHANGE_STATS:
+                status = reader.byte()
+                change["direction"] = DIRECTION_NAMES[status & 3]
+                change["alive"] = bool(status & 4)
+                change["score"] = reader.varint()
+                change["coins"] = reader.varint()
+            if pid is not None:
+                changes[pid] = change
+        message["players"] = changes
+        
+        removed = (self.players.pop(reader.varint(), None) for _ in range(reader.varint()))
+        message["removed"] = [pid for pid in removed if pid is not None]
+        message["added"] = self.read_players(reader)
+        
+        message["foods_eaten"] = [reader.varint() for _ in range(reader.varint())]
+        message["foods_spawned"] = self.read_foods(reader)
+        self.read_leaderboard(reader, message)
+        return message
+    
+    def read_players(self, reader: Reader) -> Dict[str, dict]:
+        players = {}
+        for _ in range(reader.varint()):
+            number = reader.varint()
+            pid = reader.string()
+            self.players[number] = pid
+            username, skin, color = reader.string(), reader.string(), reader.string()
+            status = reader.byte()
+            players[pid] = {
+                "player_id": pid,
+                "username": username,
+                "skin": skin,
+                "color": color,
+                "alive": bool(status & 4),
+                "score": reader.varint(),
+                "coins": reader.varint(),
+                "direction": DIRECTION_NAMES[status & 3],
+            }
+            players[pid]["body"] = reader.cells(self.cell_type)
+        return players
+    
+    def read_foods(self, reader: Reader) -> List[dict]:
+        foods = []
+        for _ in range(reader.varint()):
+            food_id = reader.varint()
+            y, x = divmod(reader.varint(), self.width)
+            foods.append({"id": food_id, "position": [x, y], "type": FOOD_TYPES[reader.byte()], "value": reader.varint()})
+        return foods
+    
+    def read_leaderboard(self, reader: Reader, message: dict):
+        if not reader.byte():
+            return
+        message["leaderboard"] = [
+            {"username": reader.string(), "score": reader.varint(), "coins": reader.varint(), "alive": bool(reader.byte())}
+            for _ in range(reader.varint())
+        ]
\ No newline at end of file
@@ -0,0 +1,162 @@
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import User
+from room_directory import CLUSTERED
+
+# In-process global leaderboard. Every user is kept in an indexable skip list
+# ordered by (-total_score, username), so top-N and "my rank" queries are
+# O(log n) and never touch the database. It is loaded once at startup and
+# kept current by the stats writer after each flush, and by registration and
+# skin purchases.
+#
+# In a cluster other nodes flush stats this one never sees, so the ranking is
+# disabled there and the leaderboard endpoints query the database instead.
+
+LEADERBOARD_FIELDS = ("total_score", "total_coins", "games_played")
+
+class SkipNode:
+    __slots__ = ("key", "next", "width")
+    
+    def __init__(self, key, height: int):
+        self.key = key
+        self.next: List[Optional["SkipNode"]] = [None] * height
+        # width[level]: how many positions next[level] is ahead of this node.
+        # A link to the end counts as pointing at position len + 1.
+        self.width = [1] * height
+
+class IndexableSkipList:
+    def __init__(self, max_height: int = 24):
+        self.max_height = max_height
+        self.head = SkipNode(None, max_height)
+        self.size = 0
+        self.rng = random.Random()
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def find(self, key) -> Tuple[List[SkipNode], List[int]]:
+        # Last node before key on every level, and its position (head is 0)
+        chain = [self.head] * self.max_height
+        positions = [0] * self.max_height
+        node, position = self.head, 0
+        for level in reversed(range(self.max_height)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+    
+    def insert(self, key):
+        chain, positions = self.find(key)
+        height = 1
+        while height < self.max_height and self.rng.random() < 0.5:
+            height += 1
+        
+        new = SkipNode(key, height)
+        position = positions[0] + 1
+        for level in range(self.max_height):
+            prev = chain[level]
+            if level < height:
+                distance = position - positions[level]
+                new.next[level] = prev.next[level]
+                new.width[level] = prev.width[level] - distance + 1
+                prev.next[level] = new
+                prev.width[level] = distance
+            else:
+                prev.width[level] += 1
+        self.size += 1
+    
+    def remove(self, key) -> bool:
+        chain, _ = self.find(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            return False
+        
+        for level in range(self.max_height):
+            prev = chain[level]
+            if prev.next[level] is target:
+                prev.width[level] += target.width[level] - 1
+                prev.next[level] = target.next[level]
+            else:
+                prev.width[level] -= 1
+        self.size -= 1
+        return True
+    
+    def rank(self, key) -> int:
+        # Number of keys before key (its 0-based index when present)
+        _, positions = self.find(key)
+        return positions[0]
+    
+    def slice(self, start: int, count: int) -> List:
+        # Keys at positions start .. start + count - 1 (0-based)
+        node, position = self.head, 0
+        target = start + 1
+        for level in reversed(range(self.max_height)):
+            while node.next[level] is not None and position + node.width[level] <= target:
+                position += node.width[level]
+                node = node.next[level]
+        
+        keys = []
+        if position != target:
+            return keys
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class GlobalLeaderboard:
+    def __init__(self, enabled: bool = True):
+        self.ranks = IndexableSkipList()
+        self.entries: Dict[str, Dict[str, int]] = {}  # username -> LEADERBOARD_FIELDS
+        self.enabled = enabled  # when off, it never loads and ignores updates
+        self.loaded = False
+        # Bumped on every change; HTTP responses use it as their ETag
+        self.version = 0
+    
+    def fetch_rows(self, db: Session) -> List[tuple]:
+        # Runs on the database threads; the total_score index serves the ordering
+        return db.query(User.username, User.total_score, User.total_coins, User.games_played) \
+            .order_by(User.total_score.desc(), User.username).all()
+    
+    def load(self, rows: Iterable[tuple]):
+        self.ranks = IndexableSkipList()
+        self.entries = {}
+        for username, total_score, total_coins, games_played in rows:
+            self.set(username, total_score or 0, total_coins or 0, games_played or 0)
+        self.loaded = True
+    
+    def set(self, username: str, total_score: int, total_coins: int, games_played: int):
+        if not self.enabled:
+            return
+        entry = self.entries.get(username)
+        if entry is None or entry["total_score"] != total_score:
+            if entry is not None:
+                self.ranks.remove((-entry["total_score"], username))
+            self.ranks.insert((-total_score, username))
+        self.entries[username] = {"total_score": total_score, "total_coins": total_coins, "games_played": games_played}
+        self.version += 1
+    
+    def add(self, username: str, increments: Dict[str, int]):
+        # Users the database doesn't know (guests) are not ranked
+        entry = self.entries.get(username)
+        if entry is None:
+            return
+        self.set(username, *(entry[field] + increments.get(field, 0) for field in LEADERBOARD_FIELDS))
+    
+    def top(self, limit: int) -> List[dict]:
+        return [
+            {"username": username, **self.entries[username]}
+            for _, username in self.ranks.slice(0, limit)
+        ]
+    
+    def rank(self, username: str) -> Optional[int]:
+        entry = self.entries.get(username)
+        if entry is None:
+            return None
+        return self.ranks.rank((-entry["total_score"], username)) + 1
+
+leaderboard = GlobalLeaderboard(enabled=not CLUSTERED)
\ No newline at end of file
@@ -0,0 +1,288 @@
+import argparse
+import bisect
+import json
+import logging
+import os
+import pickle
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from game_logic import GameRoom, Direction, TICK_RATE
+from protocol import DIRECTION_CODES, DIRECTION_NAMES, Reader, write_string, write_varint
+
+logger = logging.getLogger(__name__)
+
+# Room replays: an append-only log of what went into a room, enough to
+# rebuild the game at any tick. A room's simulation is deterministic given
+# its state and its inputs (its random choices come from the room's own
+# seeded generator), so the log holds the starting state, every join, leave
+# and move with the tick it arrived before, and a snapshot of the whole room
+# every REPLAY_SNAPSHOT_TICKS so playback never has to start far back.
+#
+# File: MAGIC, then records of a kind byte, a seq and a payload length (big
+# endian, RECORD), followed by the zlib-compressed payload:
+#   H  header, JSON: room, arena, engine, seed, start time
+#   S  snapshot of the room at seq, pickled
+#   I  inputs up to seq: the seq the chunk starts at, then events of a seq
+#      delta, a kind and the player's number in this log:
+#        JOIN number, user id, username, skin, color
+#        LEAVE number
+#        MOVE number, direction
+# Varints and strings as in protocol.py. A record cut short by a crash is
+# ignored, so a log stays readable up to its last complete record.
+#
+# Snapshots are pickles: only play back logs this server wrote.
+#
+#   python replay.py replays/global-...snkr              what the log covers
+#   python replay.py replays/global-...snkr --tick 1200  the game state at a tick
+#   python replay.py replays/global-...snkr --verify     replay the whole log and
+#                                                        check it against its snapshots
+
+# Directory to record every room to; unset, nothing is recorded
+REPLAY_DIR = os.environ.get("REPLAY_DIR", "")
+REPLAY_CHUNK_TICKS = 5 * TICK_RATE  # inputs are written out this often
+REPLAY_SNAPSHOT_TICKS = 60 * TICK_RATE
+
+MAGIC = b"SNKR\x01"
+RECORD = struct.Struct(">cII")
+HEADER = b"H"
+SNAPSHOT = b"S"
+INPUTS = b"I"
+
+EVENT_JOIN = 1
+EVENT_LEAVE = 2
+EVENT_MOVE = 3
+
+def replay_path(label: str, seed: int) -> str:
+    return os.path.join(REPLAY_DIR, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{seed:016x}.snkr")
+
+class ReplayRecorder:
+    # Written from the simulation as it runs; seq is always the room's seq
+    # when the input was applied, i.e. before its next update
+    def __init__(self, path: str, room: GameRoom, label: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.numbers: Dict[str, int] = {}  # user_id -> number in this log
+        self.events = bytearray()
+        self.chunk_seq = room.seq
+        self.event_seq = room.seq
+        self.snapshot_seq = room.seq
+        self.write(HEADER, room.seq, json.dumps({
+            "room_id": label,
+            "private": room.is_private,
+            "engine": room.engine,
+            "width": room.width,
+            "height": room.height,
+            "max_players": room.max_players,
+            "food_count": room.food_count,
+            "seed": room.seed,
+            "tick_rate": TICK_RATE,
+            "started_at": datetime.utcnow().isoformat(),
+        }).encode("utf-8"))
+        self.snapshot(room)
+    
+    def write(self, kind: bytes, seq: int, payload: bytes):
+        if self.file is None:
+            return
+        try:
+            data = zlib.compress(payload)
+            self.file.write(RECORD.pack(kind, seq, len(data)))
+            self.file.write(data)
+            self.file.flush()
+        except OSError:
+            logger.exception("Replay recording to %s failed; stopped", self.path)
+            self.file = None
+    
+    def event(self, seq: int, kind: int, number: int):
+        write_varint(self.events, seq - self.event_seq)
+        self.event_seq = seq
+        self.events.append(kind)
+        write_varint(self.events, number)
+    
+    def join(self, seq: int, user_id: str, username: str, skin: str, color: str):
+        number = self.numbers.setdefault(user_id, len(self.numbers))
+        self.event(seq, EVENT_JOIN, number)
+        for value in (user_id, username, skin, color):
+            write_string(self.events, value)
+    
+    def leave(self, seq: int, user_id: str):
+        self.event(seq, EVENT_LEAVE, self.numbers[user_id])
+    
+    def move(self, seq: int, user_id: str, direction: str):
+        self.event(seq, EVENT_MOVE, self.numbers[user_id])
+        self.events.append(DIRECTION_CODES[direction])
+    
+    def flush(self, seq: int):
+        chunk = bytearray()
+        write_varint(chunk, self.chunk_seq)
+        chunk += self.events
+        self.write(INPUTS, seq, bytes(chunk))
+        self.events = bytearray()
+        self.chunk_seq = seq
+        self.event_seq = seq
+    
+    def snapshot(self, room: GameRoom):
+        self.write(SNAPSHOT, room.seq, pickle.dumps(room, pickle.HIGHEST_PROTOCOL))
+        self.snapshot_seq = room.seq
+    
+    def tick(self, room: GameRoom):
+        # After the room's updates for this simulation step
+        if room.seq - self.chunk_seq >= REPLAY_CHUNK_TICKS:
+            self.flush(room.seq)
+        if room.seq - self.snapshot_seq >= REPLAY_SNAPSHOT_TICKS:
+            self.snapshot(room)
+    
+    def close(self, room: GameRoom):
+        self.flush(room.seq)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class ReplayLog:
+    # A recorded log, read whole; rooms are rebuilt from it on demand
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{path} is not a replay log")
+        self.header: dict = {}
+        self.snapshots: List[Tuple[int, bytes]] = []  # (seq, compressed pickle)
+        self.events: List[Tuple[int, int, tuple]] = []  # (seq, kind, args), in order
+        self.end_seq = 0
+        user_ids: Dict[int, str] = {}
+        position = len(MAGIC)
+        while position + RECORD.size <= len(data):
+            kind, seq, length = RECORD.unpack_from(data, position)
+            position += RECORD.size
+            if position + length > len(data):
+                break
+            payload = data[position:position + length]
+            position += length
+            self.end_seq = max(self.end_seq, seq)
+            if kind == HEADER:
+                self.header = json.loads(zlib.decompress(payload))
+            elif kind == SNAPSHOT:
+                self.snapshots.append((seq, payload))
+            elif kind == INPUTS:
+                self.read_events(zlib.decompress(payload), user_ids)
+        if not self.snapshots:
+            raise ValueError(f"{path} has no snapshot to start from")
+        self.event_seqs = [seq for seq, _, _ in self.events]
+    
+    def read_events(self, chunk: bytes, user_ids: Dict[int, str]):
+        reader = Reader(chunk)
+        seq = reader.varint()
+        while reader.position < len(chunk):
+            seq += reader.varint()
+            kind = reader.byte()
+            number = reader.varint()
+            if kind == EVENT_JOIN:
+                user_ids[number] = reader.string()
+                self.events.append((seq, kind, (user_ids[number], reader.string(), reader.string(), reader.string())))
+            elif kind == EVENT_LEAVE:
+                self.events.append((seq, kind, (user_ids[number],)))
+            elif kind == EVENT_MOVE:
+                self.events.append((seq, kind, (user_ids[number], Direction[DIRECTION_NAMES[reader.byte()]])))
+            else:
+                raise ValueError(f"Unknown replay event {kind}")
+    
+    def first_seq(self) -> int:
+        return self.snapshots[0][0]
+    
+    def snapshot_room(self, index: int) -> GameRoom:
+        return pickle.loads(zlib.decompress(self.snapshots[index][1]))
+    
+    def room_at(self, seq: int) -> GameRoom:
+        # The room as it was after update `seq`, before that tick's inputs:
+        # the nearest snapshot at or before it, fast-forwarded
+        if not self.first_seq() <= seq <= self.end_seq:
+            raise ValueError(f"Tick {seq} is outside the log ({self.first_seq()}-{self.end_seq})")
+        index = bisect.bisect_right([snapshot_seq for snapshot_seq, _ in self.snapshots], seq) - 1
+        room = self.snapshot_room(index)
+        self.play(room, seq)
+        return room
+    
+    def play(self, room: GameRoom, seq: int):
+        i = bisect.bisect_left(self.event_seqs, room.seq)
+        events = self.events
+        while room.seq < seq:
+            while i < len(events) and events[i][0] == room.seq:
+                apply_event(room, events[i][1], events[i][2])
+                i += 1
+            room.update()
+            # Nobody reads the change logs or results here; keep them short
+            if room.seq % TICK_RATE == 0:
+                room.get_delta()
+                room.take_events()
+
+def apply_event(room: GameRoom, kind: int, args: tuple):
+    # As RoomSimulation.join_room, leave_room and set_direction apply them
+    if kind == EVENT_JOIN:
+        room.add_player(args[0], args[1], args[2], args[3])
+    elif kind == EVENT_LEAVE:
+        room.remove_player(args[0])
+    else:
+        snake = room.players.get(args[0])
+        if snake is not None:
+            snake.update_direction(args[1])
+
+def room_fingerprint(room: GameRoom) -> dict:
+    # What a replayed room has to agree on with the recorded one
+    state = room.get_state()
+    del state["timestamp"]
+    state["snakes"] = {
+        pid: (snake.grow_pending, snake.dead_ticks, [turn.name for turn in snake.turns])
+        for pid, snake in room.players.items()
+    }
+    state["rng"] = room.rng.getstate()
+    return state
+
+def verify(log: ReplayLog) -> List[int]:
+    # Plays the log from its first snapshot; returns the seqs of the later
+    # snapshots the replayed room disagrees with
+    room = log.snapshot_room(0)
+    mismatches = []
+    for index in range(1, len(log.snapshots)):
+        log.play(room, log.snapshots[index][0])
+        if room_fingerprint(room) != room_fingerprint(log.snapshot_room(index)):
+            mismatches.append(room.seq)
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and play back room replay logs")
+    parser.add_argument("path")
+    parser.add_argument("--tick", type=int, help="print the game state at this tick as JSON")
+    parser.add_argument("--verify", action="store_true", help="replay the log and check it against its snapshots")
+    args = parser.parse_args()
+    
+    log = ReplayLog(args.path)
+    if args.tick is not None:
+        started = time.perf_counter()
+        room = log.room_at(args.tick)
+        print(f"Tick {args.tick} in {time.perf_counter() - started:.3f}s", file=sys.stderr)
+        state = room.get_state()
+        del state["timestamp"]
+        print(json.dumps({"state": state, "leaderboard": room.get_leaderboard()}))
+    elif args.verify:
+        started = time.perf_counter()
+        mismatches = verify(log)
+        ticks = log.snapshots[-1][0] - log.first_seq()
+        elapsed = time.perf_counter() - started
+        print(f"Replayed {ticks} ticks in {elapsed:.3f}s ({ticks / max(elapsed, 1e-9):.0f} ticks/s), "
+              f"{len(log.snapshots)} snapshots")
+        if mismatches:
+            print(f"Diverged from the recording at snapshots {mismatches}")
+            sys.exit(1)
+    else:
+        print(json.dumps(dict(log.header, first_seq=log.first_seq(), end_seq=log.end_seq,
+                              snapshots=len(log.snapshots), events=len(log.events),
+                              bytes=os.path.getsize(args.path)), indent=2))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
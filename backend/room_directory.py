@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Which node owns which room, for running several server processes (nodes).
+# A node claims a room when the first player asks for it and then holds a
+# lease on it, renewed by its heartbeat together with its own registration
+# (node id -> the ws:// URL peers reach it on). When a node stops renewing,
+# its rooms can be claimed again by whoever asks next.
+#
+# ROOM_DIRECTORY picks the backend:
+#   memory                   one process only, for tests
+#   sqlite:///path/rooms.db  nodes on one machine, for local testing
+#   redis://host:6379/0      any Redis-compatible server, for production
+# Left unset, the server runs as a single node without a directory.
+#
+# Every method blocks; callers run them off the event loop.
+
+ROOM_DIRECTORY = os.environ.get("ROOM_DIRECTORY", "")
+# Per-process state that other nodes would make stale is switched off with it
+CLUSTERED = bool(ROOM_DIRECTORY)
+
+class MemoryDirectory:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms: Dict[str, Tuple[str, float]] = {}  # room_id -> (node_id, expires_at)
+        self.nodes: Dict[str, Tuple[str, float]] = {}  # node_id -> (url, expires_at)
+    
+    def register_node(self, node_id: str, url: str, ttl: float):
+        with self.lock:
+            self.nodes[node_id] = (url, time.time() + ttl)
+    
+    def unregister_node(self, node_id: str):
+        with self.lock:
+            self.nodes.pop(node_id, None)
+    
+    def node_url(self, node_id: str) -> Optional[str]:
+        with self.lock:
+            node = self.nodes.get(node_id)
+            return node[0] if node is not None and node[1] > time.time() else None
+    
+    def claim(self, room_id: str, node_id: str, ttl: float) -> str:
+        # Owner of the room afterwards: node_id, unless a live node holds it
+        now = time.time()
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is not None and room[0] != node_id and room[1] > now:
+                owner = self.nodes.get(room[0])
+                if owner is not None and owner[1] > now:
+                    return room[0]
+            self.rooms[room_id] = (node_id, now + ttl)
+            return node_id
+    
+    def renew(self, node_id: str, room_ids: Iterable[str], ttl: float) -> List[str]:
+        # Extends the leases; returns the rooms that belong to someone else now
+        now = time.time()
+        lost = []
+        with self.lock:
+            for room_id in room_ids:
+                room = self.rooms.get(room_id)
+                if room is not None and room[0] != node_id:
+                    lost.append(room_id)
+                else:
+                    self.rooms[room_id] = (node_id, now + ttl)
+        return lost
+    
+    def release(self, room_id: str, node_id: str):
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is not None and room[0] == node_id:
+                del self.rooms[room_id]
+
+class SqliteDirectory:
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        # Autocommit mode; claims open their own IMMEDIATE transaction
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rooms (room_id TEXT PRIMARY KEY, node_id TEXT, expires_at REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, url TEXT, expires_at REAL)")
+    
+    def register_node(self, node_id: str, url: str, ttl: float):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)", (node_id, url, time.time() + ttl))
+    
+    def unregister_node(self, node_id: str):
+        with self.lock:
+            self.db.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+    
+    def node_url(self, node_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute("SELECT url FROM nodes WHERE node_id = ? AND expires_at > ?",
+                                  (node_id, time.time())).fetchone()
+        return row[0] if row else None
+    
+    def claim(self, room_id: str, node_id: str, ttl: float) -> str:
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT rooms.node_id FROM rooms JOIN nodes ON nodes.node_id = rooms.node_id "
+                    "WHERE room_id = ? AND rooms.expires_at > ? AND nodes.expires_at > ?",
+                    (room_id, now, now)).fetchone()
+                if row is not None and row[0] != node_id:
+                    return row[0]
+                self.db.execute("INSERT OR REPLACE INTO rooms VALUES (?, ?, ?)", (room_id, node_id, now + ttl))
+                return node_id
+            finally:
+                self.db.execute("COMMIT")
+    
+    def renew(self, node_id: str, room_ids: Iterable[str], ttl: float) -> List[str]:
+        now = time.time()
+        lost = []
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for room_id in room_ids:
+                    row = self.db.execute("SELECT node_id FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+                    if row is not None and row[0] != node_id:
+                        lost.append(room_id)
+                    else:
+                        self.db.execute("INSERT OR REPLACE INTO rooms VALUES (?, ?, ?)", (room_id, node_id, now + ttl))
+            finally:
+                self.db.execute("COMMIT")
+        return lost
+    
+    def release(self, room_id: str, node_id: str):
+        with self.lock:
+            self.db.execute("DELETE FROM rooms WHERE room_id = ? AND node_id = ?", (room_id, node_id))
+
+# Compare-and-set steps, so every change is one round trip and atomic
+REDIS_CLAIM = """
+local owner = redis.call('get', KEYS[1])
+if owner and owner ~= ARGV[1] and redis.call('exists', ARGV[3] .. owner) == 1 then
+    return owner
+end
+redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+return ARGV[1]
+"""
+REDIS_RENEW = """
+local owner = redis.call('get', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+return 1
+"""
+REDIS_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class RedisDirectory:
+    room_prefix = "snake:room:"
+    node_prefix = "snake:node:"
+    
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("ROOM_DIRECTORY is a Redis URL but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.claim_script = self.client.register_script(REDIS_CLAIM)
+        self.renew_script = self.client.register_script(REDIS_RENEW)
+        self.release_script = self.client.register_script(REDIS_RELEASE)
+    
+    def register_node(self, node_id: str, url: str, ttl: float):
+        self.client.set(self.node_prefix + node_id, url, px=int(ttl * 1000))
+    
+    def unregister_node(self, node_id: str):
+        self.client.delete(self.node_prefix + node_id)
+    
+    def node_url(self, node_id: str) -> Optional[str]:
+        return self.client.get(self.node_prefix + node_id)
+    
+    def claim(self, room_id: str, node_id: str, ttl: float) -> str:
+        return self.claim_script(keys=[self.room_prefix + room_id],
+                                 args=[node_id, int(ttl * 1000), self.node_prefix])
+    
+    def renew(self, node_id: str, room_ids: Iterable[str], ttl: float) -> List[str]:
+        room_ids = list(room_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for room_id in room_ids:
+            self.renew_script(keys=[self.room_prefix + room_id], args=[node_id, int(ttl * 1000)], client=pipe)
+        return [room_id for room_id, renewed in zip(room_ids, pipe.execute()) if not renewed]
+    
+    def release(self, room_id: str, node_id: str):
+        self.release_script(keys=[self.room_prefix + room_id], args=[node_id])
+
+def get_directory(spec: str = None):
+    spec = spec if spec is not None else ROOM_DIRECTORY
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryDirectory()
+    if spec.startswith("sqlite:///"):
+        return SqliteDirectory(spec[len("sqlite:///"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisDirectory(spec)
+    raise ValueError(f"Unknown ROOM_DIRECTORY: {spec}")
\ No newline at end of file
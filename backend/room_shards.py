@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Callable, Set
+
+from encoders import get_encoder
+from protocol import JSON_PROTOCOL
+from metrics import SimulationMetrics, profile_path
+from simulation import MAX_ROOMS, RoomSimulation, SEND_RATE
+
+logger = logging.getLogger(__name__)
+
+# Rooms are spread over worker processes by a stable hash of the room id.
+# Each worker runs its own RoomSimulation tick loop and sends the encoded
+# frames back over a pipe; the socket-owning process only fans them out.
+#
+# Main -> worker commands: ("join", room_id, user_id, username, skin, color, protocol),
+# ("spectate", room_id, user_id, protocol, follow), ("leave", room_id, user_id),
+# ("move", room_id, user_id, direction), ("keyframe", room_id, user_id),
+# ("drop", room_id), ("profile", mode, ticks, path), ("stop",).
+# Worker -> main: one list per loop iteration of ("room", room_id, frames,
+# kind, exclude_user), ("user", user_id, frames, kind), ("users", room_id,
+# user_ids, frames, kind), ("joined", room_id, user_id), ("events", room_id,
+# events) and ("closed", room_id) tuples, plus ("stats", room_stats,
+# metrics_snapshot) every STATS_INTERVAL seconds. On "stop" the worker banks its players and sends a
+# last batch. MAX_ROOMS is split evenly over the workers.
+#
+# Commands go out through one writer thread per worker, so a worker that is
+# slow to read (or busy writing its own batch) never blocks the event loop,
+# which has to keep reading the worker's frames for either side to make
+# progress. A worker that dies is restarted; its rooms are lost and their
+# players are told so through the sink's room_lost, like rooms on a lost
+# cluster node.
+
+STATS_INTERVAL = 1.0
+
+def shard_for(room_id: str, shard_count: int) -> int:
+    return zlib.crc32(room_id.encode("utf-8")) % shard_count
+
+class PipeSink:
+    def __init__(self):
+        self.outbox = []
+    
+    def room_frame(self, room_id, frames, kind, exclude_user):
+        self.outbox.append(("room", room_id, frames, kind, exclude_user))
+    
+    def user_frame(self, user_id, frames, kind):
+        self.outbox.append(("user", user_id, frames, kind))
+    
+    def users_frame(self, room_id, user_ids, frames, kind):
+        self.outbox.append(("users", room_id, user_ids, frames, kind))
+    
+    def joined(self, room_id, user_id):
+        self.outbox.append(("joined", room_id, user_id))
+    
+    def room_events(self, room_id, events):
+        self.outbox.append(("events", room_id, events))
+    
+    def room_closed(self, room_id):
+        self.outbox.append(("closed", room_id))
+
+def shard_main(conn, max_rooms: int):
+    # Ctrl-C reaches the whole process group; the main process stops the
+    # workers itself, after they've banked their players
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sink = PipeSink()
+    simulation = RoomSimulation(get_encoder(), sink, max_rooms)
+    next_stats = 0.0
+    handlers = {
+        "join": simulation.join_room,
+        "spectate": simulation.spectate,
+        "leave": simulation.leave_room,
+        "move": simulation.set_direction,
+        "keyframe": simulation.request_keyframe,
+        "drop": simulation.drop_room,
+        "profile": simulation.start_profile,
+    }
+    
+    while True:
+        # Wait for commands, but never past the next simulation step
+        if conn.poll(simulation.time_to_next_step()):
+            while conn.poll():
+                command = conn.recv()
+                if command[0] == "stop":
+                    simulation.close()
+                    conn.send(sink.outbox)
+                    return
+                try:
+                    handlers[command[0]](*command[1:])
+                except Exception:
+                    # One bad command mustn't take every room on this worker down
+                    logger.exception("Shard command %r failed", command[0])
+        
+        steps = simulation.due_steps()
+        if steps:
+            simulation.advance(steps)
+        
+        if time.monotonic() >= next_stats:
+            next_stats = time.monotonic() + STATS_INTERVAL
+            sink.outbox.append(("stats", simulation.room_stats(), simulation.metrics_snapshot()))
+        
+        if sink.outbox:
+            conn.send(sink.outbox)
+            sink.outbox = []
+
+class ShardedSimulation:
+    # Same interface as RoomSimulation, backed by worker processes
+    def __init__(self, shard_count: int, sink):
+        self.shard_count = shard_count
+        self.sink = sink
+        self.connections: List = []
+        self.processes: List[multiprocessing.Process] = []
+        self.outboxes: List[queue.SimpleQueue] = []  # commands for each worker's writer thread
+        self.writers: List[threading.Thread] = []
+        self.shard_rooms: List[Set[str]] = []  # room_ids each worker has confirmed joins to
+        self.closing = False
+        self.shard_stats: Dict[int, dict] = {}  # shard -> its latest room_stats()
+        self.shard_metrics: Dict[int, dict] = {}  # shard -> its latest metrics snapshot
+    
+    def start(self):
+        for shard in range(self.shard_count):
+            self.connections.append(None)
+            self.processes.append(None)
+            self.outboxes.append(None)
+            self.writers.append(None)
+            self.shard_rooms.append(set())
+            self.start_shard(shard)
+    
+    def start_shard(self, shard: int):
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=shard_main, args=(child_conn, max(1, MAX_ROOMS // self.shard_count)),
+                                  daemon=True)
+        process.start()
+        child_conn.close()
+        outbox = queue.SimpleQueue()
+        writer = threading.Thread(target=self.run_writer, args=(parent_conn, outbox),
+                                  name=f"shard-{shard}-writer", daemon=True)
+        writer.start()
+        asyncio.get_running_loop().add_reader(parent_conn.fileno(), self.on_readable, parent_conn, shard)
+        self.connections[shard] = parent_conn
+        self.processes[shard] = process
+        self.outboxes[shard] = outbox
+        self.writers[shard] = writer
+    
+    def run_writer(self, conn, outbox: queue.SimpleQueue):
+        # Until None is queued or the worker is gone; the reader notices that
+        while True:
+            command = outbox.get()
+            if command is None:
+                return
+            try:
+                conn.send(command)
+            except (BrokenPipeError, OSError):
+                return
+    
+    def on_readable(self, conn, shard: int):
+        while conn.poll():
+            try:
+                batch = conn.recv()
+            except (EOFError, OSError):
+                asyncio.get_running_loop().remove_reader(conn.fileno())
+                if not self.closing:
+                    self.worker_lost(shard)
+                return
+            self.dispatch(batch, shard)
+    
+    def worker_lost(self, shard: int):
+        process = self.processes[shard]
+        process.join(timeout=1)
+        rooms = self.shard_rooms[shard]
+        logger.error("Shard %d worker exited with code %s; restarting it, %d rooms lost",
+                     shard, process.exitcode, len(rooms))
+        self.outboxes[shard].put(None)
+        self.connections[shard].close()
+        self.shard_rooms[shard] = set()
+        self.shard_stats.pop(shard, None)
+        self.shard_metrics.pop(shard, None)
+        self.start_shard(shard)
+        for room_id in rooms:
+            self.sink.room_lost(room_id)
+    
+    def dispatch(self, batch, shard: int):
+        for item in batch:
+            if item[0] == "room":
+                self.sink.room_frame(*item[1:])
+            elif item[0] == "user":
+                self.sink.user_frame(*item[1:])
+            elif item[0] == "users":
+                self.sink.users_frame(*item[1:])
+            elif item[0] == "joined":
+                self.shard_rooms[shard].add(item[1])
+                self.sink.joined(*item[1:])
+            elif item[0] == "events":
+                self.sink.room_events(*item[1:])
+            elif item[0] == "closed":
+                self.shard_rooms[shard].discard(item[1])
+                self.sink.room_closed(*item[1:])
+            elif item[0] == "stats":
+                self.shard_stats[shard] = item[1]
+                self.shard_metrics[shard] = item[2]
+    
+    def send(self, room_id: str, command: tuple):
+        if not self.processes:
+            self.start()
+        self.outboxes[shard_for(room_id, self.shard_count)].put(command)
+    
+    def join_room(self, room_id: str, user_id: str, username: str, skin: str, color: str,
+                  protocol: str = JSON_PROTOCOL):
+        self.send(room_id, ("join", room_id, user_id, username, skin, color, protocol))
+    
+    def spectate(self, room_id: str, user_id: str, protocol: str = JSON_PROTOCOL, follow: Optional[str] = None):
+        self.send(room_id, ("spectate", room_id, user_id, protocol, follow))
+    
+    def leave_room(self, room_id: str, user_id: str):
+        self.send(room_id, ("leave", room_id, user_id))
+    
+    def set_direction(self, room_id: str, user_id: str, direction: str):
+        self.send(room_id, ("move", room_id, user_id, direction))
+    
+    def request_keyframe(self, room_id: str, user_id: str):
+        self.send(room_id, ("keyframe", room_id, user_id))
+    
+    def drop_room(self, room_id: str):
+        self.shard_rooms[shard_for(room_id, self.shard_count)].discard(room_id)
+        self.send(room_id, ("drop", room_id))
+    
+    def room_stats(self) -> dict:
+        # As of each worker's last report
+        rooms = []
+        for stats in self.shard_stats.values():
+            rooms.extend(stats["rooms"])
+        return {
+            "rooms": rooms,
+            "max_rooms": max(1, MAX_ROOMS // self.shard_count) * self.shard_count,
+            "pooled_rooms": sum(stats["pooled_rooms"] for stats in self.shard_stats.values()),
+            "reaped_rooms": sum(stats["reaped_rooms"] for stats in self.shard_stats.values()),
+        }
+    
+    def metrics_snapshot(self) -> dict:
+        metrics = SimulationMetrics()
+        for snapshot in self.shard_metrics.values():
+            metrics.merge(snapshot)
+        return metrics.snapshot()
+    
+    def start_profile(self, mode: str, ticks: int) -> List[str]:
+        # Every worker captures its own file
+        if not self.processes:
+            self.start()
+        paths = []
+        for shard, outbox in enumerate(self.outboxes):
+            path = profile_path(mode, f"-shard{shard}")
+            outbox.put(("profile", mode, ticks, path))
+            paths.append(path)
+        return paths
+    
+    async def run(self, on_tick: Optional[Callable[[], None]] = None):
+        # Workers tick the rooms; this process only does connection upkeep
+        if not self.processes:
+            self.start()
+        while True:
+            await asyncio.sleep(1.0 / SEND_RATE)
+            if on_tick is not None:
+                on_tick()
+    
+    def close(self):
+        # Stop after whatever is still queued, then let the writers finish
+        self.closing = True
+        for outbox in self.outboxes:
+            outbox.put(("stop",))
+            outbox.put(None)
+        for writer in self.writers:
+            writer.join(timeout=1)
+        # Collect the workers' last batches, which carry their final results
+        for shard, conn in enumerate(self.connections):
+            try:
+                while conn.poll(1):
+                    self.dispatch(conn.recv(), shard)
+            except (EOFError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
\ No newline at end of file
@@ -0,0 +1,625 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from bots import ROOM_BOTS, BotController
+from encoders import Frames
+from metrics import METRICS_SAMPLE_EVERY, SimulationMetrics, TickProfiler, profile_path
+from game_logic import (GameRoom, Direction, TICK_RATE, TURN_QUEUE, GRID_WIDTH, GRID_HEIGHT, VIEW_WIDTH, VIEW_HEIGHT,
+                        create_room, food_target)
+from protocol import BINARY_PROTOCOL, JSON_PROTOCOL, BinaryEncoder, RoomCodec
+from replay import REPLAY_DIR, ReplayRecorder, replay_path
+
+logger = logging.getLogger(__name__)
+
+# Frames per second sent to clients, independent of the simulation TICK_RATE;
+# it has to divide TICK_RATE so frames go out on whole ticks
+SEND_RATE = int(os.environ.get("SEND_RATE", "10"))
+if SEND_RATE <= 0 or TICK_RATE % SEND_RATE:
+    raise ValueError(f"SEND_RATE={SEND_RATE} does not divide TICK_RATE={TICK_RATE}")
+SEND_EVERY_TICKS = TICK_RATE // SEND_RATE
+# Send a full game_state keyframe every N ticks; game_delta frames in between
+KEYFRAME_INTERVAL = TICK_RATE
+# The room leaderboard goes out with keyframes, and with deltas once it has
+# changed, but at most LEADERBOARD_RATE times a second
+LEADERBOARD_RATE = 2
+LEADERBOARD_EVERY_TICKS = max(1, TICK_RATE // LEADERBOARD_RATE)
+# Most simulation steps run to catch up after a stall; the rest are skipped
+MAX_CATCHUP_TICKS = 5
+
+# Update engine for the global room: "python", or "numpy" for big crowds
+GLOBAL_ROOM_ENGINE = os.environ.get("GLOBAL_ROOM_ENGINE", "python")
+# Arena size of the global room; anything bigger than one screen turns on
+# area-of-interest filtering. Food scales with the area, see FOOD_DENSITY.
+GLOBAL_ROOM_WIDTH = int(os.environ.get("GLOBAL_ROOM_WIDTH", GRID_WIDTH))
+GLOBAL_ROOM_HEIGHT = int(os.environ.get("GLOBAL_ROOM_HEIGHT", GRID_HEIGHT))
+GLOBAL_ROOM_MAX_PLAYERS = int(os.environ.get("GLOBAL_ROOM_MAX_PLAYERS", "50"))
+
+# Room lifecycle: a room ticks while it has players (active), stops ticking
+# when the last one leaves (idle), and is dropped after ROOM_IDLE_TTL idle
+# seconds (reaped). Reaped rooms go back to a pool for the next new room.
+ROOM_IDLE_TTL = float(os.environ.get("ROOM_IDLE_TTL", "60"))
+# Rooms a simulation holds, active or idle. At the cap the longest idle room
+# makes way for a new one; with none idle, joins to new rooms are refused.
+MAX_ROOMS = int(os.environ.get("MAX_ROOMS", "1000"))
+ROOM_POOL_SIZE = 32  # per arena size and engine
+REAP_INTERVAL = 1.0
+
+DIRECTIONS = {direction.name: direction for direction in Direction}
+
+# A RoomSimulation owns a set of rooms and ticks them. Everything it produces
+# goes to a sink with this interface:
+#   room_frame(room_id, frames, kind, exclude_user)  -> every member of the room
+#   user_frame(user_id, frames, kind)                -> a single client
+#   users_frame(room_id, user_ids, frames, kind)     -> some members of the room
+#   joined(room_id, user_id)                         -> membership confirmed
+#                                                       (players and spectators)
+#   room_events(room_id, events)                     -> results to persist, see GameRoom.events
+#   room_closed(room_id)                             -> the room was reaped
+#   room_lost(room_id)                               -> the room's worker died (sharded mode)
+# frames holds the message encoded once for each wire protocol its recipients
+# speak (see protocol.py). kind is "keyframe", "delta" or None, as used by
+# ClientConnection.enqueue.
+#
+# Spectators watch a room without a snake or a player slot. They are members
+# of the room like players, so room_frame frames (state, leaderboard, joins)
+# reach them through the same fan-out; the room only has to encode each frame
+# in their protocols too. In area-of-interest rooms a spectator follows a
+# player and is sent that player's view frames.
+
+class RoomStats:
+    def __init__(self):
+        self.created_at = time.time()
+        self.ticks = 0
+        self.busy_seconds = 0.0  # updating the room and building its frames
+        self.joins = 0
+        self.peak_players = 0
+
+class RoomSimulation:
+    def __init__(self, encoder, sink, max_rooms: int = MAX_ROOMS):
+        self.encoder = encoder
+        self.binary_encoder = BinaryEncoder()
+        self.sink = sink
+        self.max_rooms = max_rooms
+        self.rooms: Dict[str, GameRoom] = {}  # active and idle rooms
+        self.active_rooms: Dict[str, GameRoom] = {}  # the ones that tick
+        self.idle_since: Dict[str, float] = {}  # room_id -> time.monotonic(), longest idle first
+        self.room_stats_by_id: Dict[str, RoomStats] = {}
+        self.pool: Dict[Tuple[str, int, int], List[GameRoom]] = {}  # (engine, width, height) -> rooms
+        self.reaped_rooms = 0
+        self.next_reap = 0.0
+        self.codecs: Dict[str, RoomCodec] = {}  # room_id -> binary protocol state
+        self.protocols: Dict[str, str] = {}  # user_id -> wire protocol, while in a room
+        self.pending_keyframes: Dict[str, Set[str]] = {}  # room_id -> user_ids awaiting a keyframe
+        # Moves wait here for the room's next tick: room_id -> user_id ->
+        # directions, players in the order their first move arrived
+        self.inputs: Dict[str, Dict[str, List[Direction]]] = {}
+        self.spectators: Dict[str, Dict[str, Optional[str]]] = {}  # room_id -> spectator -> player followed
+        self.spectator_protocols: Dict[str, Dict[str, int]] = {}  # room_id -> protocol -> spectators
+        self.recorders: Dict[str, ReplayRecorder] = {}  # room_id -> its replay log, with REPLAY_DIR set
+        self.metrics = SimulationMetrics()
+        self.bots = BotController(self.metrics)
+        # Ticks and room sends are sampled separately; sends only happen
+        # every SEND_EVERY_TICKS, so a tick sample could keep missing them
+        self.advances = 0
+        self.broadcasts = 0
+        self.sampling = False  # time the encoding of this send
+        self.profiler: Optional[TickProfiler] = None
+        self.step = 1.0 / TICK_RATE
+        self.accumulator = 0.0
+        self.previous = time.perf_counter()
+    
+    def get_room(self, room_id: str) -> Optional[GameRoom]:
+        # None when the simulation is at max_rooms with no idle room to reap
+        if room_id not in self.rooms:
+            if len(self.rooms) >= self.max_rooms:
+                if not self.idle_since:
+                    return None
+                self.reap_room(next(iter(self.idle_since)))
+            if room_id == "global":
+                room = self.new_room("global", GLOBAL_ROOM_MAX_PLAYERS, False, GLOBAL_ROOM_ENGINE,
+                                     GLOBAL_ROOM_WIDTH, GLOBAL_ROOM_HEIGHT,
+                                     food_target(GLOBAL_ROOM_WIDTH, GLOBAL_ROOM_HEIGHT))
+            else:
+                # Create private room if it doesn't exist
+                room = self.new_room(room_id, 2, True, "python", GRID_WIDTH, GRID_HEIGHT,
+                                     food_target(GRID_WIDTH, GRID_HEIGHT))
+            self.rooms[room_id] = room
+            self.codecs[room_id] = RoomCodec(room.width, room.height)
+            self.room_stats_by_id[room_id] = RoomStats()
+            if REPLAY_DIR:
+                label = self.room_label(room_id, room)
+                self.recorders[room_id] = ReplayRecorder(replay_path(label, room.seed), room, label)
+            # Idle until its first player is in
+            self.idle_since[room_id] = time.monotonic()
+        return self.rooms[room_id]
+    
+    def new_room(self, room_id: str, max_players: int, is_private: bool, engine: str,
+                 width: int, height: int, food_count: int) -> GameRoom:
+        pooled = self.pool.get((engine, width, height))
+        if pooled:
+            room = pooled.pop()
+            room.reset(room_id, max_players, is_private, food_count)
+            return room
+        return create_room(room_id, max_players=max_players, is_private=is_private, engine=engine,
+                           width=width, height=height, food_count=food_count)
+    
+    def reap_room(self, room_id: str):
+        room = self.forget_room(room_id)
+        pooled = self.pool.setdefault((room.engine, room.width, room.height), [])
+        if len(pooled) < ROOM_POOL_SIZE:
+            pooled.append(room)
+        self.reaped_rooms += 1
+        self.sink.room_closed(room_id)
+    
+    def drop_room(self, room_id: str):
+        # Another node runs this room now (cluster mode): stop ticking it
+        # here without banking its players' lives or telling them anything
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        bots = self.bots.bots(room_id)
+        for player_id in list(room.players):
+            if player_id in bots:
+                self.bots.remove_bot(room_id, player_id)
+            self.protocols.pop(player_id, None)
+        self.forget_room(room_id)
+    
+    def forget_room(self, room_id: str) -> GameRoom:
+        room = self.rooms.pop(room_id)
+        del self.codecs[room_id]
+        del self.room_stats_by_id[room_id]
+        self.idle_since.pop(room_id, None)
+        self.active_rooms.pop(room_id, None)
+        self.pending_keyframes.pop(room_id, None)
+        self.inputs.pop(room_id, None)
+        for user_id in self.spectators.pop(room_id, ()):
+            self.protocols.pop(user_id, None)
+        self.spectator_protocols.pop(room_id, None)
+        recorder = self.recorders.pop(room_id, None)
+        if recorder is not None:
+            recorder.close(room)
+        return room
+    
+    def reap_idle_rooms(self):
+        now = time.monotonic()
+        if now < self.next_reap:
+            return
+        self.next_reap = now + REAP_INTERVAL
+        # Oldest first, so stop at the first one still within its TTL
+        for room_id, since in list(self.idle_since.items()):
+            if now - since < ROOM_IDLE_TTL:
+                break
+            self.reap_room(room_id)
+    
+    def encode(self, room_id: str, message: dict, user_ids: Iterable[str], spectators: bool = False) -> Frames:
+        # Once per protocol in use among the recipients, not once per recipient;
+        # with spectators, also for the room's spectators
+        started = time.perf_counter() if self.sampling else 0.0
+        frames = {}
+        protocols = {self.protocols.get(user_id, JSON_PROTOCOL) for user_id in user_ids}
+        if spectators:
+            protocols.update(self.spectator_protocols.get(room_id, ()))
+        for protocol in protocols:
+            if protocol is None:
+                continue
+            if protocol == BINARY_PROTOCOL:
+                frames[protocol] = self.codecs[room_id].encode(message)
+            else:
+                frames[protocol] = self.encoder.encode(message)
+        if self.sampling:
+            self.metrics.phases["serialize"].observe(time.perf_counter() - started)
+        return frames
+    
+    def join_room(self, room_id: str, user_id: str, username: str, skin: str, color: str,
+                  protocol: str = JSON_PROTOCOL):
+        if user_id in self.spectators.get(room_id, ()):
+            self.unspectate(room_id, user_id)
+        room = self.get_room(room_id)
+        bots = self.bots.bots(room_id)
+        if room is not None and bots and user_id not in room.players and len(room.players) >= room.max_players:
+            # Bots make way for people
+            self.remove_bot(room_id, room, next(iter(bots)))
+        if room is None or not room.add_player(user_id, username, skin, color):
+            self.join_failed(room_id, user_id, protocol, "room_full" if room is not None else "server_full")
+            return
+        recorder = self.recorders.get(room_id)
+        if recorder is not None:
+            recorder.join(room.seq, user_id, username, skin, color)
+        self.protocols[user_id] = protocol
+        if room_id in self.idle_since:
+            del self.idle_since[room_id]
+            self.active_rooms[room_id] = room
+        stats = self.room_stats_by_id[room_id]
+        stats.joins += 1
+        stats.peak_players = max(stats.peak_players, len(room.players))
+        self.fill_bots(room_id, room)
+        
+        self.sink.joined(room_id, user_id)
+        self.send_room_joined(room_id, room, user_id, False)
+        
+        # Broadcast new player to room
+        self.sink.room_frame(room_id, self.encode(room_id, {
+            "type": "player_joined",
+            "player": {
+                "id": user_id,
+                "username": username,
+                "skin": skin,
+                "color": color
+            }
+        }, room.players, True), None, user_id)
+    
+    def join_failed(self, room_id: str, user_id: str, protocol: str, reason: str):
+        message = {"type": "join_failed", "room_id": room_id, "reason": reason}
+        encoder = self.binary_encoder if protocol == BINARY_PROTOCOL else self.encoder
+        self.sink.user_frame(user_id, {protocol: encoder.encode(message)}, None)
+    
+    def send_room_joined(self, room_id: str, room: GameRoom, user_id: str, spectator: bool):
+        self.sink.user_frame(user_id, self.encode(room_id, {
+            "type": "room_joined",
+            "room_id": room_id,
+            "grid_size": {"width": room.width, "height": room.height},
+            "view_size": {"width": VIEW_WIDTH, "height": VIEW_HEIGHT},
+            "spectator": spectator
+        }, (user_id,)), None)
+        self.request_keyframe(room_id, user_id)
+    
+    def spectate(self, room_id: str, user_id: str, protocol: str = JSON_PROTOCOL, follow: Optional[str] = None):
+        # Watch a room without playing in it; an idle room stays idle, and
+        # its spectators see its first frames once someone joins
+        room = self.get_room(room_id)
+        if room is None:
+            self.join_failed(room_id, user_id, protocol, "server_full")
+            return
+        if user_id in room.players:
+            self.leave_room(room_id, user_id)
+        spectators = self.spectators.setdefault(room_id, {})
+        if user_id in spectators:
+            self.unspectate(room_id, user_id)
+        spectators[user_id] = follow
+        self.protocols[user_id] = protocol
+        counts = self.spectator_protocols.setdefault(room_id, {})
+        counts[protocol] = counts.get(protocol, 0) + 1
+        
+        self.sink.joined(room_id, user_id)
+        self.send_room_joined(room_id, room, user_id, True)
+    
+    def unspectate(self, room_id: str, user_id: str):
+        spectators = self.spectators[room_id]
+        del spectators[user_id]
+        if not spectators:
+            del self.spectators[room_id]
+        protocol = self.protocols.pop(user_id, JSON_PROTOCOL)
+        counts = self.spectator_protocols[room_id]
+        counts[protocol] -= 1
+        if not counts[protocol]:
+            del counts[protocol]
+            if not counts:
+                del self.spectator_protocols[room_id]
+        waiting = self.pending_keyframes.get(room_id)
+        if waiting is not None:
+            waiting.discard(user_id)
+    
+    def leave_room(self, room_id: str, user_id: str):
+        # Players and spectators alike
+        if user_id in self.spectators.get(room_id, ()):
+            self.unspectate(room_id, user_id)
+            return
+        room = self.rooms.get(room_id)
+        if room is not None and user_id in room.players:
+            recorder = self.recorders.get(room_id)
+            if recorder is not None:
+                recorder.leave(room.seq, user_id)
+            room.remove_player(user_id)
+            self.codecs[room_id].release(user_id)
+            self.protocols.pop(user_id, None)
+            inputs = self.inputs.get(room_id)
+            if inputs is not None:
+                inputs.pop(user_id, None)
+            self.fill_bots(room_id, room)
+            # Through the sink, so members on other nodes hear about it too
+            self.sink.room_frame(room_id, self.encode(room_id, {
+                "type": "player_left",
+                "player_id": user_id
+            }, room.players, True), None, user_id)
+            if not room.players:
+                # Idle: no more ticks; the match result goes out now
+                del self.active_rooms[room_id]
+                self.idle_since[room_id] = time.monotonic()
+                self.pending_keyframes.pop(room_id, None)
+                self.flush_events(room_id, room)
+                if recorder is not None:
+                    recorder.flush(room.seq)
+    
+    def fill_bots(self, room_id: str, room: GameRoom):
+        # Public rooms get bots up to ROOM_BOTS players, as long as a person
+        # is playing; they all leave with the last one
+        if room.is_private or ROOM_BOTS <= 0:
+            return
+        bots = self.bots.bots(room_id)
+        people = len(room.players) - len(bots)
+        wanted = max(0, min(ROOM_BOTS, room.max_players) - people) if people else 0
+        while len(bots) > wanted:
+            self.remove_bot(room_id, room, next(iter(bots)))
+            bots = self.bots.bots(room_id)
+        while len(bots) < wanted:
+            player_id, username, color = self.bots.new_bot(room_id, room)
+            room.add_player(player_id, username, "default", color, bot=True)
+            self.protocols[player_id] = None  # gets no frames
+            recorder = self.recorders.get(room_id)
+            if recorder is not None:
+                recorder.join(room.seq, player_id, username, "default", color)
+            bots = self.bots.bots(room_id)
+    
+    def remove_bot(self, room_id: str, room: GameRoom, player_id: str):
+        recorder = self.recorders.get(room_id)
+        if recorder is not None:
+            recorder.leave(room.seq, player_id)
+        room.remove_player(player_id)
+        self.codecs[room_id].release(player_id)
+        self.protocols.pop(player_id, None)
+        self.bots.remove_bot(room_id, player_id)
+    
+    def set_direction(self, room_id: str, user_id: str, direction: str):
+        # Buffered until the room's next tick; a player sending more than a
+        # snake can queue between two ticks only loses the extra ones
+        room = self.rooms.get(room_id)
+        if room is not None and user_id in room.players and isinstance(direction, str) and direction in DIRECTIONS:
+            pending = self.inputs.setdefault(room_id, {}).setdefault(user_id, [])
+            if len(pending) < TURN_QUEUE:
+                pending.append(DIRECTIONS[direction])
+                self.metrics.inputs["accepted"] += 1
+            else:
+                self.metrics.inputs["queue_full"] += 1
+    
+    def apply_inputs(self, room_id: str, room: GameRoom, inputs: Iterable[Tuple[str, Direction]]):
+        recorder = self.recorders.get(room_id)
+        for user_id, direction in inputs:
+            if recorder is not None:
+                recorder.move(room.seq, user_id, direction.name)
+            room.players[user_id].update_direction(direction)
+    
+    def request_keyframe(self, room_id: str, user_id: str):
+        # Served on the room's next broadcast so it lines up with the delta seq
+        self.pending_keyframes.setdefault(room_id, set()).add(user_id)
+    
+    def broadcast_room_state(self, room_id: str, room: GameRoom):
+        if room.aoi:
+            self.broadcast_views(room_id, room)
+            return
+        
+        if room.seq - room.keyframe_seq >= KEYFRAME_INTERVAL:
+            room.mark_leaderboard_sent()
+            self.sink.room_frame(room_id, self.encode(room_id, {
+                "type": "game_state",
+                "state": room.get_keyframe(),
+                "leaderboard": room.get_leaderboard()
+            }, room.players, True), "keyframe", None)
+        else:
+            delta = room.get_delta()
+            message = {"type": "game_delta"}
+            message.update(delta)
+            message["timestamp"] = time.time()
+            if room.leaderboard_due(LEADERBOARD_EVERY_TICKS):
+                room.mark_leaderboard_sent()
+                message["leaderboard"] = room.get_leaderboard()
+            self.sink.room_frame(room_id, self.encode(room_id, message, room.players, True), "delta", None)
+        
+        # Joins and resync requests get a keyframe at the same seq
+        waiting = self.pending_keyframes.pop(room_id, None)
+        if waiting:
+            spectators = self.spectators.get(room_id, ())
+            waiting = [user_id for user_id in waiting if user_id in room.players or user_id in spectators]
+            keyframe = self.encode(room_id, {
+                "type": "game_state",
+                "state": room.get_state(),
+                "leaderboard": room.get_leaderboard()
+            }, waiting)
+            for user_id in waiting:
+                self.sink.user_frame(user_id, keyframe, "keyframe")
+    
+    def broadcast_views(self, room_id: str, room: GameRoom):
+        # Each view's frame is encoded once and goes to every player in that view
+        keyframe = room.seq - room.keyframe_seq >= KEYFRAME_INTERVAL
+        waiting = self.pending_keyframes.pop(room_id, set())
+        followers = self.follow_players(room_id, room, waiting) if room_id in self.spectators else None
+        frames = room.get_view_frames(keyframe, waiting)
+        leaderboard = room.get_leaderboard()
+        with_deltas = keyframe or room.leaderboard_due(LEADERBOARD_EVERY_TICKS)
+        if with_deltas:
+            room.mark_leaderboard_sent()
+        for kind, body, user_ids in frames:
+            if kind == "keyframe":
+                message = {"type": "game_state", "state": body, "leaderboard": leaderboard}
+            else:
+                message = {"type": "game_delta"}
+                message.update(body)
+                if with_deltas:
+                    message["leaderboard"] = leaderboard
+            if followers:
+                # Spectators get the frames of the player they follow
+                watching = [spectator for user_id in user_ids for spectator in followers.get(user_id, ())]
+                if watching:
+                    user_ids = list(user_ids) + watching
+            self.sink.users_frame(room_id, user_ids, self.encode(room_id, message, user_ids), kind)
+    
+    def follow_players(self, room_id: str, room: GameRoom, waiting: Set[str]) -> Dict[str, List[str]]:
+        # player_id -> spectators following them. A spectator whose player is
+        # gone follows another (a person, since bots have no view), and the
+        # player's view gets a keyframe whenever one of its spectators needs it.
+        followers: Dict[str, List[str]] = {}
+        spectators = self.spectators[room_id]
+        fallback = None
+        for spectator, player_id in spectators.items():
+            snake = room.players.get(player_id) if player_id is not None else None
+            if snake is None or snake.bot:
+                if fallback is None:
+                    fallback = next((pid for pid, other in room.players.items() if not other.bot), "")
+                if not fallback:
+                    continue
+                player_id = spectators[spectator] = fallback
+                waiting.add(spectator)
+                self.sink.user_frame(spectator, self.encode(room_id, {
+                    "type": "spectating", "room_id": room_id, "player_id": player_id
+                }, (spectator,)), None)
+            if spectator in waiting:
+                waiting.discard(spectator)
+                waiting.add(player_id)
+            followers.setdefault(player_id, []).append(spectator)
+        return followers
+    
+    def advance(self, steps: int):
+        self.advances += 1
+        sample = self.advances % METRICS_SAMPLE_EVERY == 0
+        phases = self.metrics.phases
+        tick_started = time.perf_counter()
+        self.bots.start_tick()
+        for room_id, room in self.active_rooms.items():
+            try:
+                self.advance_room(room_id, room, steps, sample)
+            except Exception:
+                # One broken room mustn't stop the others
+                self.sampling = False
+                logger.exception("Room %s failed to advance", self.room_label(room_id, room))
+        self.reap_idle_rooms()
+        
+        elapsed = time.perf_counter() - tick_started
+        self.metrics.ticks += steps
+        if elapsed > self.step:
+            self.metrics.overruns += 1
+        if sample:
+            phases["tick"].observe(elapsed)
+        if self.profiler is not None and self.profiler.tick(steps):
+            self.profiler = None
+    
+    def advance_room(self, room_id: str, room: GameRoom, steps: int, sample: bool):
+        phases = self.metrics.phases
+        started = time.perf_counter()
+        inputs = self.inputs.pop(room_id, None)
+        if inputs:
+            self.apply_inputs(room_id, room, ((user_id, direction)
+                                              for user_id, directions in inputs.items()
+                                              for direction in directions))
+        if room_id in self.bots.rooms:
+            # Bots steer once per pass, after the players' input
+            self.apply_inputs(room_id, room, self.bots.steer(room, room_id))
+            if sample:
+                phases["bots"].observe(time.perf_counter() - started)
+        for _ in range(steps):
+            room.update()
+        updated = time.perf_counter()
+        self.flush_events(room_id, room)
+        recorder = self.recorders.get(room_id)
+        if recorder is not None:
+            recorder.tick(room)
+        
+        if room.seq - room.delta_base >= SEND_EVERY_TICKS:
+            self.broadcasts += 1
+            self.sampling = self.broadcasts % METRICS_SAMPLE_EVERY == 0
+            self.broadcast_room_state(room_id, room)
+            self.codecs[room_id].recycle()
+            if self.sampling:
+                phases["broadcast"].observe(time.perf_counter() - updated)
+                self.sampling = False
+        if sample:
+            phases["update"].observe((updated - started) / steps)
+        stats = self.room_stats_by_id[room_id]
+        stats.ticks += steps
+        stats.busy_seconds += time.perf_counter() - started
+    
+    def start_profile(self, mode: str, ticks: int, path: Optional[str] = None) -> List[str]:
+        # Captures the next ticks, see TickProfiler; nothing if one is running
+        if self.profiler is not None:
+            return []
+        path = path or profile_path(mode)
+        self.profiler = TickProfiler(mode, ticks, path)
+        self.profiler.start()
+        return [path]
+    
+    def metrics_snapshot(self) -> dict:
+        return self.metrics.snapshot()
+    
+    def flush_events(self, room_id: str, room: GameRoom):
+        events = room.take_events()
+        if events:
+            self.sink.room_events(room_id, events)
+    
+    def due_steps(self) -> int:
+        # Fixed-step clock: accumulate elapsed wall time and hand out whole steps
+        now = time.perf_counter()
+        self.accumulator += now - self.previous
+        self.previous = now
+        
+        steps = int(self.accumulator / self.step)
+        if steps > MAX_CATCHUP_TICKS:
+            # Too far behind: run a bounded catch-up and drop the rest
+            self.metrics.skipped_ticks += steps - MAX_CATCHUP_TICKS
+            steps = MAX_CATCHUP_TICKS
+            self.accumulator = steps * self.step
+        self.accumulator -= steps * self.step
+        return steps
+    
+    def time_to_next_step(self) -> float:
+        return max(0, self.step - self.accumulator)
+    
+    async def run(self, on_tick: Optional[Callable[[], None]] = None):
+        self.previous = time.perf_counter()
+        while True:
+            steps = self.due_steps()
+            if steps:
+                self.advance(steps)
+                if on_tick is not None:
+                    on_tick()
+            
+            # Sleep until the next simulation step is due
+            await asyncio.sleep(self.time_to_next_step())
+    
+    def room_label(self, room_id: str, room: GameRoom) -> str:
+        # Private room ids are what players join with, so only a digest
+        if not room.is_private:
+            return room_id
+        return "private-" + hashlib.sha1(room_id.encode("utf-8")).hexdigest()[:10]
+    
+    def room_stats(self) -> dict:
+        now = time.time()
+        monotonic_now = time.monotonic()
+        rooms = []
+        for room_id, room in self.rooms.items():
+            stats = self.room_stats_by_id[room_id]
+            idle_since = self.idle_since.get(room_id)
+            rooms.append({
+                "room_id": self.room_label(room_id, room),
+                "private": room.is_private,
+                "state": "idle" if idle_since is not None else "active",
+                "engine": room.engine,
+                "players": len(room.players),
+                "bots": len(self.bots.bots(room_id)),
+                "spectators": len(self.spectators.get(room_id, ())),
+                "max_players": room.max_players,
+                "peak_players": stats.peak_players,
+                "joins": stats.joins,
+                "ticks": stats.ticks,
+                "busy_ms_per_tick": stats.busy_seconds * 1000 / stats.ticks if stats.ticks else 0.0,
+                "foods": len(room.foods),
+                "age_seconds": now - stats.created_at,
+                "idle_seconds": monotonic_now - idle_since if idle_since is not None else 0.0,
+            })
+        return {
+            "rooms": rooms,
+            "max_rooms": self.max_rooms,
+            "pooled_rooms": sum(len(pooled) for pooled in self.pool.values()),
+            "reaped_rooms": self.reaped_rooms,
+        }
+    
+    def close(self):
+        # Bank everyone's current life so the final stats flush includes it
+        for room_id, room in self.rooms.items():
+            for player_id in list(room.players):
+                self.leave_room(room_id, player_id)
+            self.flush_events(room_id, room)
+        for room_id, recorder in self.recorders.items():
+            recorder.close(self.rooms[room_id])
+        self.recorders = {}
\ No newline at end of file
@@ -0,0 +1,70 @@
+import random
+from collections import Counter
+
+import pytest
+
+from game_logic import Direction, GameRoom, create_room
+
+# FreeCells has to agree with the board: foods and spawns only ever go to
+# free cells, and every cell's use count follows the segments and foods in it
+
+def expected_uses(room: GameRoom) -> Counter:
+    uses = Counter()
+    for snake in room.players.values():
+        uses.update(snake.body)
+    uses.update(food.position.y * room.width + food.position.x for food in room.foods)
+    return uses
+
+def check_free_cells(room: GameRoom):
+    free = room.free_cells
+    uses = expected_uses(room)
+    assert free.uses == [uses[cell] for cell in range(room.width * room.height)]
+    assert sorted(free.cells) == [cell for cell in range(room.width * room.height) if not uses[cell]]
+    for slot, cell in enumerate(free.cells):
+        assert free.slots[cell] == slot
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_free_cells_follow_the_board(engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    # A small board, so snakes keep colliding, dying and respawning
+    room = create_room("cells", max_players=30, engine=engine, width=30, height=20, seed=21)
+    rng = random.Random(22)
+    users = [f"u{i}" for i in range(25)]
+    directions = list(Direction)
+    deaths = 0
+    for tick in range(600):
+        for user_id in users:
+            roll = rng.random()
+            if roll < 0.01:
+                room.remove_player(user_id)
+            elif roll < 0.03 and user_id not in room.players:
+                room.add_player(user_id, user_id, "default", "#00FF00")
+                # Spawned on a cell nothing else was using
+                assert room.free_cells.uses[room.players[user_id].body[0]] == 1
+            elif roll < 0.3 and user_id in room.players:
+                room.players[user_id].update_direction(directions[rng.randrange(4)])
+        
+        dead = {player_id for player_id, snake in room.players.items() if not snake.alive}
+        food_ids = {food.id for food in room.foods}
+        room.update()
+        deaths += sum(1 for player_id, snake in room.players.items()
+                      if not snake.alive and player_id not in dead)
+        
+        check_free_cells(room)
+        uses = room.free_cells.uses
+        # New food and respawned snakes landed on cells of their own
+        for food in room.foods:
+            if food.id not in food_ids:
+                assert uses[food.position.y * room.width + food.position.x] == 1
+        for player_id in dead:
+            snake = room.players.get(player_id)
+            if snake is not None and snake.alive:
+                assert uses[snake.body[0]] == 1
+    assert deaths > 0
+    
+    # Everyone gone: only the food is left using cells
+    for user_id in users:
+        room.remove_player(user_id)
+    check_free_cells(room)
+    assert sum(room.free_cells.uses) == len(room.foods)
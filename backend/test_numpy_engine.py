@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from game_logic import GameRoom
+from numpy_engine import NumpyGameRoom, play
+
+# The NumPy engine has to stay frame-for-frame identical to GameRoom; see
+# numpy_engine.verify for the long run
+
+@pytest.mark.parametrize("seed", range(4))
+def test_engines_match(seed):
+    assert play(NumpyGameRoom, seed, players=30, ticks=400) == play(GameRoom, seed, players=30, ticks=400)
+
+def test_engines_match_crowded():
+    # Few cells per snake, so collisions and respawns happen all the time
+    assert play(NumpyGameRoom, 7, players=80, ticks=300) == play(GameRoom, 7, players=80, ticks=300)
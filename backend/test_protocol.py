@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+from game_logic import GameRoom, Direction
+from protocol import BinaryDecoder, RoomCodec
+
+# Binary frames have to decode to exactly the JSON protocol's messages
+
+TIMESTAMP = 1700000000.25  # whole milliseconds, which is what the wire carries
+
+def as_json(message: dict) -> dict:
+    return json.loads(json.dumps(message))
+
+def keyframe(room: GameRoom) -> dict:
+    state = room.get_state()
+    state["timestamp"] = TIMESTAMP
+    return {"type": "game_state", "state": state, "leaderboard": room.get_leaderboard()}
+
+def delta(room: GameRoom, leaderboard: bool) -> dict:
+    message = {"type": "game_delta"}
+    message.update(room.get_delta())
+    message["timestamp"] = TIMESTAMP
+    if leaderboard:
+        message["leaderboard"] = room.get_leaderboard()
+    return message
+
+def roundtrip(codec: RoomCodec, decoder: BinaryDecoder, message: dict):
+    assert decoder.decode(codec.encode(message)) == as_json(message)
+
+def leave(room: GameRoom, codec: RoomCodec, player_id: str):
+    # What RoomSimulation.leave_room does
+    room.remove_player(player_id)
+    codec.release(player_id)
+
+@pytest.mark.parametrize("width, height", [(40, 30), (300, 300)])
+def test_room_roundtrip(width, height):
+    # Random turns, leaves and joins, so numbers get released and reused;
+    # 300 x 300 has more than 65536 cells and so 32-bit cell indices
+    room = GameRoom("codec", max_players=20, width=width, height=height, seed=3)
+    codec = RoomCodec(room.width, room.height)
+    decoder = BinaryDecoder()
+    assert codec.cell_type == ("H" if width * height <= 0x10000 else "I")
+    for i in range(12):
+        room.add_player(f"p{i}", f"player{i}", "default", "#00FF00")
+    inputs = random.Random(4)
+    directions = list(Direction)
+    roundtrip(codec, decoder, keyframe(room))
+    room.get_delta()
+    
+    for tick in range(300):
+        for snake in room.players.values():
+            if inputs.random() < 0.3:
+                snake.update_direction(directions[inputs.randrange(4)])
+        if tick % 6 == 0:
+            leave(room, codec, inputs.choice(sorted(room.players)))
+        if tick % 6 == 3:
+            room.add_player(f"new{tick}", f"new{tick}", "default", "#FF0000")
+        room.update()
+        roundtrip(codec, decoder, delta(room, tick % 5 == 0))
+        codec.recycle()
+        if tick % 100 == 99:
+            roundtrip(codec, decoder, keyframe(room))
+    
+    # Never more than 12 players in the room at once
+    assert codec.next_number <= 12
+
+def test_numbers_reused():
+    room = GameRoom("codec", max_players=10, seed=5)
+    codec = RoomCodec(room.width, room.height)
+    decoder = BinaryDecoder()
+    for player_id in ("a", "b"):
+        room.add_player(player_id, player_id, "default", "#00FF00")
+    roundtrip(codec, decoder, keyframe(room))
+    room.get_delta()
+    number = codec.numbers["a"]
+    
+    # Leaving and rejoining before the next send keeps the number
+    leave(room, codec, "a")
+    room.add_player("a", "a again", "default", "#00FF00")
+    room.update()
+    roundtrip(codec, decoder, delta(room, False))
+    codec.recycle()
+    assert codec.numbers["a"] == number
+    
+    # A number freed by a send goes to the next player to join
+    leave(room, codec, "a")
+    room.update()
+    roundtrip(codec, decoder, delta(room, False))
+    codec.recycle()
+    room.add_player("c", "c", "default", "#00FF00")
+    room.update()
+    roundtrip(codec, decoder, delta(room, True))
+    assert codec.numbers["c"] == number
+    for _ in range(20):
+        room.update()
+        roundtrip(codec, decoder, delta(room, False))
+    assert decoder.players[number] == "c"
@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from rankings import GlobalLeaderboard, IndexableSkipList
+
+# rank() and slice() rely on the skip list's width bookkeeping; both are
+# checked against a plain sorted list after every change
+
+@pytest.mark.parametrize("seed", range(3))
+def test_skip_list_matches_sorted_list(seed):
+    rng = random.Random(seed)
+    skip_list = IndexableSkipList(max_height=8)
+    skip_list.rng.seed(seed)
+    expected = []
+    for _ in range(2000):
+        key = (rng.randrange(-50, 1), f"user{rng.randrange(300)}")
+        if key in expected and rng.random() < 0.6:
+            assert skip_list.remove(key)
+            expected.remove(key)
+        elif key not in expected:
+            skip_list.insert(key)
+            expected.append(key)
+            expected.sort()
+        else:
+            assert not skip_list.remove((1, "missing"))
+        assert len(skip_list) == len(expected)
+        probe = rng.choice(expected) if expected else key
+        assert skip_list.rank(probe) == sum(1 for other in expected if other < probe)
+        start = rng.randrange(len(expected) + 2)
+        assert skip_list.slice(start, 5) == expected[start:start + 5]
+
+def test_leaderboard_matches_sorted_scores():
+    rng = random.Random(7)
+    leaderboard = GlobalLeaderboard()
+    leaderboard.load([(f"user{i}", rng.randrange(100), 0, 0) for i in range(200)])
+    for _ in range(1000):
+        username = f"user{rng.randrange(200)}"
+        if rng.random() < 0.5:
+            leaderboard.add(username, {"total_score": rng.randrange(20), "games_played": 1})
+        else:
+            leaderboard.set(username, rng.randrange(500), rng.randrange(50), rng.randrange(10))
+        leaderboard.add("guest", {"total_score": 5})  # unknown users stay unranked
+        
+        ordered = sorted(leaderboard.entries, key=lambda name: (-leaderboard.entries[name]["total_score"], name))
+        assert [entry["username"] for entry in leaderboard.top(10)] == ordered[:10]
+        assert leaderboard.rank(username) == ordered.index(username) + 1
+        assert leaderboard.rank("guest") is None
+    assert len(leaderboard.ranks) == 200
@@ -0,0 +1,49 @@
+import random
+
+import replay
+from game_logic import GameRoom, Direction
+from replay import ReplayLog, ReplayRecorder, room_fingerprint, verify
+
+# A recorded room has to play back to the same state as the live one
+
+def record(path: str, ticks: int) -> dict:
+    # Inputs go to the recorder and then the room, as RoomSimulation does;
+    # returns the live room's fingerprints at a few seqs
+    room = GameRoom("replay", max_players=30, seed=11)
+    recorder = ReplayRecorder(path, room, "replay")
+    rng = random.Random(12)
+    users = [f"u{i}" for i in range(20)]
+    fingerprints = {}
+    for tick in range(ticks):
+        for user_id in users:
+            roll = rng.random()
+            if roll < 0.01 and user_id in room.players:
+                recorder.leave(room.seq, user_id)
+                room.remove_player(user_id)
+            elif roll < 0.03 and user_id not in room.players:
+                recorder.join(room.seq, user_id, f"name-{user_id}", "default", "#00FF00")
+                room.add_player(user_id, f"name-{user_id}", "default", "#00FF00")
+            elif roll < 0.2 and user_id in room.players:
+                direction = rng.choice(list(Direction))
+                recorder.move(room.seq, user_id, direction.name)
+                room.players[user_id].update_direction(direction)
+        room.update()
+        recorder.tick(room)
+        if tick % 50 == 0:
+            room.get_delta()
+            room.take_events()
+        if tick in (150, 420, 777):
+            fingerprints[room.seq] = room_fingerprint(room)
+    recorder.close(room)
+    return fingerprints
+
+def test_replay_verifies(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, "REPLAY_SNAPSHOT_TICKS", 100)
+    path = str(tmp_path / "room.snkr")
+    fingerprints = record(path, 1000)
+    log = ReplayLog(path)
+    assert len(log.snapshots) >= 10
+    assert {kind for _, kind, _ in log.events} == {replay.EVENT_JOIN, replay.EVENT_LEAVE, replay.EVENT_MOVE}
+    assert verify(log) == []
+    for seq, fingerprint in fingerprints.items():
+        assert room_fingerprint(log.room_at(seq)) == fingerprint
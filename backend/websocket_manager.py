@@ -1,129 +1,400 @@
-import asyncio
-import json
-from typing import Dict, Set
-from fastapi import WebSocket
-from game_logic import GameRoom, GRID_WIDTH, GRID_HEIGHT
-import time
-
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_rooms: Dict[str, str] = {}  # user_id -> room_id
-        self.rooms: Dict[str, GameRoom] = {
-            "global": GameRoom("global", max_players=50, is_private=False)
-        }
-        self.game_task = None
-    
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-    
-    def disconnect(self, user_id: str):
-        if user_id in self.user_rooms:
-            room_id = self.user_rooms[user_id]
-            if room_id in self.rooms:
-                self.rooms[room_id].remove_player(user_id)
-            del self.user_rooms[user_id]
-        
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-    
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
-    
-    async def broadcast_to_room(self, message: dict, room_id: str, exclude_user: str = None):
-        if room_id not in self.rooms:
-            return
-        
-        room = self.rooms[room_id]
-        for player_id in room.players:
-            if player_id != exclude_user and player_id in self.active_connections:
-                try:
-                    await self.active_connections[player_id].send_json(message)
-                except:
-                    pass
-    
-    async def handle_message(self, user_id: str, data: dict):
-        if "action" not in data:
-            return
-        
-        action = data["action"]
-        
-        if action == "join_room":
-            room_id = data.get("room_id", "global")
-            username = data.get("username", "Player")
-            skin = data.get("skin", "default")
-            color = data.get("color", "#00FF00")
-            
-            # Create private room if it doesn't exist
-            if room_id not in self.rooms and room_id != "global":
-                self.rooms[room_id] = GameRoom(room_id, max_players=2, is_private=True)
-            
-            if room_id in self.rooms:
-                room = self.rooms[room_id]
-                if room.add_player(user_id, username, skin, color):
-                    self.user_rooms[user_id] = room_id
-                    await self.send_personal_message({
-                        "type": "room_joined",
-                        "room_id": room_id,
-                        "grid_size": {"width": GRID_WIDTH, "height": GRID_HEIGHT}
-                    }, user_id)
-                    
-                    # Broadcast new player to room
-                    await self.broadcast_to_room({
-                        "type": "player_joined",
-                        "player": {
-                            "id": user_id,
-                            "username": username,
-                            "skin": skin,
-                            "color": color
-                        }
-                    }, room_id, exclude_user=user_id)
-        
-        elif action == "move":
-            if user_id in self.user_rooms:
-                room_id = self.user_rooms[user_id]
-                if room_id in self.rooms:
-                    direction = data.get("direction")
-                    if direction in ["UP", "DOWN", "LEFT", "RIGHT"]:
-                        from game_logic import Direction
-                        dir_map = {
-                            "UP": Direction.UP,
-                            "DOWN": Direction.DOWN,
-                            "LEFT": Direction.LEFT,
-                            "RIGHT": Direction.RIGHT
-                        }
-                        self.rooms[room_id].players[user_id].update_direction(dir_map[direction])
-        
-        elif action == "leave_room":
-            if user_id in self.user_rooms:
-                room_id = self.user_rooms[user_id]
-                self.disconnect(user_id)
-                await self.broadcast_to_room({
-                    "type": "player_left",
-                    "player_id": user_id
-                }, room_id)
-    
-    async def game_loop(self):
-        while True:
-            start_time = time.time()
-            
-            # Update all rooms
-            for room_id, room in self.rooms.items():
-                room.update()
-                
-                # Send game state to all players in room
-                state = room.get_state()
-                await self.broadcast_to_room({
-                    "type": "game_state",
-                    "state": state,
-                    "leaderboard": room.get_leaderboard()
-                }, room_id)
-            
-            # Calculate sleep time to maintain tick rate
-            elapsed = time.time() - start_time
-            sleep_time = max(0, 1.0 / 60 - elapsed)
-            await asyncio.sleep(sleep_time)
-
+import asyncio
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket
+from encoders import Frame, Frames, get_encoder
+from protocol import BINARY_PROTOCOL, JSON_PROTOCOL, BinaryEncoder, negotiate
+from simulation import RoomSimulation
+from room_shards import ShardedSimulation
+from room_directory import get_directory
+from cluster import CLUSTER_SECRET, ROOM_LOST_CLOSE_CODE, ClusterSimulation
+from persistence import StatsWriter
+from metrics import Exposition, SimulationMetrics, server_metrics
+import time
+
+# Number of worker processes that simulate rooms; 0 keeps rooms in this process
+SIM_SHARDS = int(os.environ.get("SIM_SHARDS", "0"))
+# Outgoing frames a client may have queued before its state frames get dropped
+SEND_QUEUE_SIZE = 8
+# Clients that keep having frames dropped for longer than this are disconnected
+MAX_LAG_SECONDS = 5.0
+# A lagging client counts as caught up after this long without drops
+LAG_RECOVERY_SECONDS = 3.0
+# Close code sent to a connection that the same player opened again elsewhere
+REPLACED_CLOSE_CODE = 4000
+# Messages a client may send per second, on average, and in one burst; the
+# rest are dropped unread
+INPUT_RATE = float(os.environ.get("INPUT_RATE", "20"))
+INPUT_BURST = float(os.environ.get("INPUT_BURST", "10"))
+# Longest string a client may send for a room id, color or the like
+MAX_FIELD_LENGTH = 64
+
+def text_field(data: dict, key: str, default: Optional[str]) -> Optional[str]:
+    # Client strings end up in frames, room labels and logs; anything that
+    # isn't a short string counts as missing
+    value = data.get(key, default)
+    if isinstance(value, str) and 0 < len(value) <= MAX_FIELD_LENGTH:
+        return value
+    return default
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, protocol: str):
+        self.websocket = websocket
+        self.protocol = protocol
+        # (frame, kind) where kind is "keyframe", "delta" or None for other messages
+        self.queue: Deque[Tuple[Frame, Optional[str]]] = deque()
+        self.wakeup = asyncio.Event()
+        self.needs_keyframe = False
+        self.lagging_since: Optional[float] = None
+        self.last_drop_at = 0.0
+        self.dropped_frames = 0
+        # Token bucket for incoming messages
+        self.input_tokens = INPUT_BURST
+        self.input_refilled_at = time.monotonic()
+        self.dropped_inputs = 0
+        self.closed = False
+        self.writer_task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self.writer_task = asyncio.create_task(self.run_writer())
+    
+    def stop(self):
+        self.closed = True
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+    
+    def enqueue(self, frame: Frame, kind: Optional[str] = None) -> bool:
+        # Returns False when the client fell behind and needs a fresh keyframe
+        if self.closed:
+            return True
+        
+        if kind is not None and len(self.queue) >= SEND_QUEUE_SIZE:
+            # Behind: drop queued state frames, only the newest state matters
+            kept = deque(item for item in self.queue if item[1] is None)
+            self.dropped_frames += len(self.queue) - len(kept)
+            server_metrics.frames_dropped += len(self.queue) - len(kept)
+            self.queue = kept
+            self.last_drop_at = time.time()
+            if self.lagging_since is None:
+                self.lagging_since = self.last_drop_at
+            if kind == "delta":
+                self.dropped_frames += 1
+                server_metrics.frames_dropped += 1
+                self.needs_keyframe = True
+                return False
+        
+        if kind == "delta" and self.needs_keyframe:
+            # Deltas are useless until the client has a keyframe to apply them to
+            self.dropped_frames += 1
+            server_metrics.frames_dropped += 1
+            return False
+        if kind == "keyframe":
+            self.needs_keyframe = False
+        
+        self.queue.append((frame, kind))
+        self.wakeup.set()
+        return True
+    
+    def allow_input(self) -> bool:
+        now = time.monotonic()
+        self.input_tokens = min(INPUT_BURST, self.input_tokens + (now - self.input_refilled_at) * INPUT_RATE)
+        self.input_refilled_at = now
+        if self.input_tokens < 1:
+            self.dropped_inputs += 1
+            server_metrics.inputs_limited += 1
+            return False
+        self.input_tokens -= 1
+        return True
+    
+    def lag_exceeded(self, now: float) -> bool:
+        if self.lagging_since is None:
+            return False
+        if now - self.last_drop_at > LAG_RECOVERY_SECONDS:
+            self.lagging_since = None
+            return False
+        return now - self.lagging_since > MAX_LAG_SECONDS
+    
+    async def run_writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                
+                frame, _ = self.queue.popleft()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                # Characters rather than bytes for text frames, which are ASCII JSON
+                server_metrics.sent(self.protocol, len(frame))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.user_rooms: Dict[str, str] = {}  # user_id -> room_id
+        self.room_members: Dict[str, Set[str]] = {}  # room_id -> user_ids, spectators included
+        self.spectators: Set[str] = set()  # user_ids watching rather than playing
+        self.identities: Dict[str, Tuple[str, str]] = {}  # user_id -> (username, skin)
+        self.game_task = None
+        self.encoder = get_encoder()
+        # Room state frames are encoded by the simulation; these handle the rest
+        self.encoders = {JSON_PROTOCOL: self.encoder, BINARY_PROTOCOL: BinaryEncoder()}
+        # Match results and player stats are written behind, in batches
+        self.stats_writer = StatsWriter()
+        self.stats_task = None
+        # With a room directory configured this process is one node of several
+        directory = get_directory()
+        self.cluster = None
+        if directory is not None:
+            if not CLUSTER_SECRET:
+                raise RuntimeError("ROOM_DIRECTORY is set but CLUSTER_SECRET is not")
+            self.cluster = ClusterSimulation(directory, self)
+        sink = self.cluster if self.cluster is not None else self
+        if SIM_SHARDS > 0:
+            self.simulation = ShardedSimulation(SIM_SHARDS, sink)
+        else:
+            self.simulation = RoomSimulation(self.encoder, sink)
+        if self.cluster is not None:
+            self.cluster.local = self.simulation
+            self.simulation = self.cluster
+    
+    async def connect(self, websocket: WebSocket, user_id: str, username: str, skin: str) -> ClientConnection:
+        # user_id, username and skin come from the authenticated session; the
+        # wire protocol is picked from the subprotocols the client offers
+        protocol, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        if user_id in self.active_connections:
+            # Same player connecting again (another tab): the newest one wins
+            # and joins a room of its own accord
+            self.leave_room(user_id)
+            previous = self.active_connections[user_id]
+            previous.stop()
+            asyncio.create_task(self.close_socket(previous.websocket, REPLACED_CLOSE_CODE))
+        connection = ClientConnection(websocket, protocol)
+        connection.start()
+        self.active_connections[user_id] = connection
+        self.identities[user_id] = (username, skin)
+        self.send_personal_message({
+            "type": "connected",
+            "player_id": user_id,
+            "username": username,
+            "protocol": protocol
+        }, user_id)
+        return connection
+    
+    def leave_room(self, user_id: str):
+        self.spectators.discard(user_id)
+        if user_id in self.user_rooms:
+            room_id = self.user_rooms.pop(user_id)
+            self.simulation.leave_room(room_id, user_id)
+            members = self.room_members.get(room_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self.room_members[room_id]
+    
+    def disconnect(self, user_id: str, connection: Optional[ClientConnection] = None):
+        if connection is not None and self.active_connections.get(user_id) is not connection:
+            # A newer connection took over this player
+            return
+        self.leave_room(user_id)
+        
+        if user_id in self.active_connections:
+            self.active_connections[user_id].stop()
+            del self.active_connections[user_id]
+            self.identities.pop(user_id, None)
+    
+    # Sink interface for the simulation, see simulation.py
+    def joined(self, room_id: str, user_id: str):
+        if user_id not in self.active_connections:
+            # Disconnected while a shard was handling the join
+            self.simulation.leave_room(room_id, user_id)
+            return
+        self.user_rooms[user_id] = room_id
+        self.room_members.setdefault(room_id, set()).add(user_id)
+    
+    def user_frame(self, user_id: str, frames: Frames, kind: Optional[str]):
+        connection = self.active_connections.get(user_id)
+        if connection is not None and connection.protocol in frames:
+            connection.enqueue(frames[connection.protocol], kind)
+    
+    def deliver(self, room_id: str, user_id: str, frames: Frames, kind: Optional[str]):
+        # Only queues frames; each connection's writer task does the network I/O
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return
+        frame = frames.get(connection.protocol)
+        # No frame in this protocol: the client reconnected with another one
+        # since the room encoded it
+        if frame is None or not connection.enqueue(frame, kind):
+            if kind is not None:
+                self.simulation.request_keyframe(room_id, user_id)
+    
+    def room_frame(self, room_id: str, frames: Frames, kind: Optional[str], exclude_user: Optional[str]):
+        started = time.perf_counter() if server_metrics.sample_fanout() else None
+        for user_id in self.room_members.get(room_id, ()):
+            if user_id != exclude_user:
+                self.deliver(room_id, user_id, frames, kind)
+        if started is not None:
+            server_metrics.fanout.observe(time.perf_counter() - started)
+    
+    def users_frame(self, room_id: str, user_ids: List[str], frames: Frames, kind: Optional[str]):
+        started = time.perf_counter() if server_metrics.sample_fanout() else None
+        for user_id in user_ids:
+            self.deliver(room_id, user_id, frames, kind)
+        if started is not None:
+            server_metrics.fanout.observe(time.perf_counter() - started)
+    
+    def room_events(self, room_id: str, events: List[tuple]):
+        self.stats_writer.record(events)
+    
+    def room_closed(self, room_id: str):
+        # Reaped rooms have no players left, only spectators, if anyone
+        for user_id in self.room_members.pop(room_id, ()):
+            if self.user_rooms.get(user_id) == room_id:
+                del self.user_rooms[user_id]
+                self.spectators.discard(user_id)
+                self.send_personal_message({"type": "spectate_ended", "room_id": room_id}, user_id)
+    
+    def room_lost(self, room_id: str):
+        # The node running the room is unreachable; the clients reconnect
+        for user_id in list(self.room_members.get(room_id, ())):
+            connection = self.active_connections.get(user_id)
+            self.disconnect(user_id)
+            if connection is not None:
+                asyncio.create_task(self.close_socket(connection.websocket, ROOM_LOST_CLOSE_CODE))
+    
+    def send_personal_message(self, message: dict, user_id: str):
+        connection = self.active_connections.get(user_id)
+        if connection is not None:
+            connection.enqueue(self.encoders[connection.protocol].encode(message))
+    
+    def drop_lagging_clients(self):
+        now = time.time()
+        for user_id, connection in list(self.active_connections.items()):
+            lagging = not connection.closed and connection.lag_exceeded(now)
+            if connection.closed or lagging:
+                if lagging:
+                    server_metrics.lag_disconnects += 1
+                self.disconnect(user_id)
+                asyncio.create_task(self.close_socket(connection.websocket))
+    
+    async def close_socket(self, websocket: WebSocket, code: int = 1013):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def handle_message(self, user_id: str, data: dict):
+        if "action" not in data:
+            return
+        
+        action = data["action"]
+        
+        if action == "join_room":
+            if user_id not in self.active_connections:
+                return
+            room_id = text_field(data, "room_id", "global")
+            username, skin = self.identities.get(user_id, ("Player", "default"))
+            color = text_field(data, "color", "#00FF00")
+            
+            if self.user_rooms.get(user_id) not in (None, room_id) or user_id in self.spectators:
+                self.leave_room(user_id)
+            self.simulation.join_room(room_id, user_id, username, skin, color,
+                                      self.active_connections[user_id].protocol)
+        
+        elif action == "spectate":
+            # Watch a room without taking a player slot; in large arenas the
+            # view follows the given player, or any if none is given
+            if user_id not in self.active_connections:
+                return
+            room_id = text_field(data, "room_id", "global")
+            self.leave_room(user_id)
+            self.spectators.add(user_id)
+            self.simulation.spectate(room_id, user_id, self.active_connections[user_id].protocol,
+                                     text_field(data, "follow", None))
+        
+        elif action == "move":
+            direction = text_field(data, "direction", None)
+            if user_id in self.user_rooms and direction is not None:
+                self.simulation.set_direction(self.user_rooms[user_id], user_id, direction)
+        
+        elif action == "resync":
+            # Client missed a delta; it gets a keyframe on the next tick
+            if user_id in self.user_rooms:
+                self.simulation.request_keyframe(self.user_rooms[user_id], user_id)
+        
+        elif action == "leave_room":
+            self.leave_room(user_id)
+    
+    def render_metrics(self) -> str:
+        # Prometheus text for /metrics; room figures come from the simulation,
+        # which in sharded mode reports once a second
+        out = Exposition()
+        simulation = SimulationMetrics()
+        simulation.merge(self.simulation.metrics_snapshot())
+        phases = [({"phase": phase}, histogram) for phase, histogram in simulation.phases.items()]
+        phases.append(({"phase": "fanout"}, server_metrics.fanout))
+        out.histograms("snake_phase_seconds", "Time per phase, sampled", phases)
+        out.counter("snake_ticks_total", "Simulation steps run", simulation.ticks)
+        out.counter("snake_tick_overruns_total", "Simulation passes that took longer than one tick", simulation.overruns)
+        out.counter("snake_ticks_skipped_total", "Simulation steps dropped after stalls", simulation.skipped_ticks)
+        out.metric("snake_inputs_total", "counter", "Client messages by what became of them",
+                   [({"result": result}, count) for result, count in simulation.inputs.items()]
+                   + [({"result": "rate_limited"}, server_metrics.inputs_limited)])
+        out.metric("snake_bot_steps_total", "counter", "Bot decisions, by how much thought went into them",
+                   [({"mode": mode}, steps) for mode, steps in simulation.bot_steps.items()])
+        
+        protocols = sorted(server_metrics.frames_sent)
+        out.metric("snake_frames_sent_total", "counter", "Frames written to clients",
+                   [({"protocol": protocol}, server_metrics.frames_sent[protocol]) for protocol in protocols])
+        out.metric("snake_bytes_sent_total", "counter", "Frame payload written to clients",
+                   [({"protocol": protocol}, server_metrics.bytes_sent[protocol]) for protocol in protocols])
+        out.counter("snake_frames_dropped_total", "State frames dropped for clients that fell behind",
+                    server_metrics.frames_dropped)
+        out.counter("snake_lag_disconnects_total", "Clients disconnected for lagging", server_metrics.lag_disconnects)
+        
+        depths = [len(connection.queue) for connection in self.active_connections.values()]
+        out.gauge("snake_connections", "Open client connections", len(depths))
+        out.gauge("snake_send_queue_frames", "Frames queued across all connections", sum(depths))
+        out.gauge("snake_send_queue_depth_max", "Longest send queue", max(depths, default=0))
+        
+        stats = self.simulation.room_stats()
+        rooms = stats["rooms"]
+        out.metric("snake_rooms", "gauge", "Rooms by lifecycle state",
+                   [({"state": state}, sum(1 for room in rooms if room["state"] == state))
+                    for state in ("active", "idle")])
+        out.gauge("snake_rooms_pooled", "Reaped rooms kept for reuse", stats["pooled_rooms"])
+        out.counter("snake_rooms_reaped_total", "Idle rooms reaped", stats["reaped_rooms"])
+        # Public rooms one by one; private ones are many and their ids are secret
+        public = [room for room in rooms if not room["private"]]
+        out.metric("snake_room_players", "gauge", "Players per public room",
+                   [({"room": room["room_id"]}, room["players"]) for room in public])
+        out.metric("snake_room_bots", "gauge", "Bots per public room",
+                   [({"room": room["room_id"]}, room["bots"]) for room in public])
+        out.metric("snake_room_spectators", "gauge", "Spectators per public room",
+                   [({"room": room["room_id"]}, room["spectators"]) for room in public])
+        out.metric("snake_room_busy_seconds_per_tick", "gauge", "Average simulation time per tick per public room",
+                   [({"room": room["room_id"]}, room["busy_ms_per_tick"] / 1000) for room in public])
+        out.gauge("snake_private_room_players", "Players across private rooms",
+                  sum(room["players"] for room in rooms if room["private"]))
+        return out.text()
+    
+    async def game_loop(self):
+        self.stats_task = asyncio.create_task(self.stats_writer.run())
+        await self.simulation.run(self.drop_lagging_clients)
+    
+    def shutdown(self):
+        self.simulation.close()
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+        self.stats_writer.close()
+
 manager = ConnectionManager()
\ No newline at end of file
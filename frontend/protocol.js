@@ -0,0 +1,240 @@
+// Client side of the binary wire protocol (backend/protocol.py). Frames are
+// decoded into the same messages the JSON protocol sends, so the game code
+// doesn't care which one the server picked.
+const BINARY_PROTOCOL = 'snake.bin.1';
+const JSON_SUBPROTOCOL = 'snake.json';
+
+const OP_STATE = 0x01;
+const OP_DELTA = 0x02;
+const OP_JSON = 0x7f;
+
+const OP_JOIN = 0x01;
+const OP_MOVE = 0x02;
+const OP_RESYNC = 0x03;
+const OP_LEAVE = 0x04;
+
+const CHANGE_BODY = 1;
+const CHANGE_PUSH = 2;
+const CHANGE_POP = 4;
+const CHANGE_STATS = 8;
+
+const DIRECTION_NAMES = ['UP', 'DOWN', 'LEFT', 'RIGHT'];
+const FOOD_TYPES = ['normal', 'golden', 'powerup'];
+
+class BinaryProtocol {
+    constructor() {
+        this.textDecoder = new TextDecoder();
+        this.textEncoder = new TextEncoder();
+        // Player numbers and grid size of the current room
+        this.players = new Map();
+        this.width = 0;
+        this.cellSize = 2;
+    }
+    
+    decode(buffer) {
+        this.view = new DataView(buffer);
+        this.bytes = new Uint8Array(buffer);
+        this.position = 1;
+        switch (this.bytes[0]) {
+            case OP_STATE:
+                return this.decodeState();
+            case OP_DELTA:
+                return this.decodeDelta();
+            case OP_JSON: {
+                const message = JSON.parse(this.textDecoder.decode(this.bytes.subarray(1)));
+                if (message.type === 'room_joined') {
+                    this.players = new Map();
+                    this.width = 0;
+                }
+                return message;
+            }
+        }
+        throw new Error(`Unknown opcode ${this.bytes[0]}`);
+    }
+    
+    decodeState() {
+        const seq = this.varint();
+        const timestamp = this.varint() / 1000;
+        this.width = this.varint();
+        const height = this.varint();
+        this.cellSize = this.width * height <= 0x10000 ? 2 : 4;
+        const roomId = this.string();
+        this.players = new Map();
+        const players = this.readPlayers();
+        const foods = this.readFoods();
+        const message = {
+            type: 'game_state',
+            state: { room_id: roomId, seq, players, foods, timestamp }
+        };
+        this.readLeaderboard(message);
+        return message;
+    }
+    
+    decodeDelta() {
+        const message = { type: 'game_delta', seq: this.varint(), base: this.varint() };
+        message.timestamp = this.varint() / 1000;
+        if (!this.width) {
+            // Before the keyframe cells can't be read; the game drops these anyway
+            return message;
+        }
+        
+        const changes = {};
+        const changeCount = this.varint();
+        for (let i = 0; i < changeCount; i++) {
+            const id = this.players.get(this.varint());
+            const flags = this.bytes[this.position++];
+            const change = {};
+            if (flags & CHANGE_BODY) change.body = this.cells();
+            if (flags & CHANGE_PUSH) change.push = this.cells();
+            if (flags & CHANGE_POP) change.pop = this.varint();
+            if (flags & CHANGE_STATS) {
+                const status = this.bytes[this.position++];
+                change.direction = DIRECTION_NAMES[status & 3];
+                change.alive = Boolean(status & 4);
+                change.score = this.varint();
+                change.coins = this.varint();
+            }
+            if (id !== undefined) changes[id] = change;
+        }
+        message.players = changes;
+        
+        message.removed = [];
+        const removedCount = this.varint();
+        for (let i = 0; i < removedCount; i++) {
+            const number = this.varint();
+            if (this.players.has(number)) {
+                message.removed.push(this.players.get(number));
+                this.players.delete(number);
+            }
+        }
+        message.added = this.readPlayers();
+        
+        message.foods_eaten = [];
+        const eatenCount = this.varint();
+        for (let i = 0; i < eatenCount; i++) {
+            message.foods_eaten.push(this.varint());
+        }
+        message.foods_spawned = this.readFoods();
+        this.readLeaderboard(message);
+        return message;
+    }
+    
+    readPlayers() {
+        const players = {};
+        const count = this.varint();
+        for (let i = 0; i < count; i++) {
+            const number = this.varint();
+            const id = this.string();
+            this.players.set(number, id);
+            const username = this.string();
+            const skin = this.string();
+            const color = this.string();
+            const status = this.bytes[this.position++];
+            players[id] = {
+                player_id: id,
+                username,
+                skin,
+                color,
+                alive: Boolean(status & 4),
+                score: this.varint(),
+                coins: this.varint(),
+                direction: DIRECTION_NAMES[status & 3],
+                body: this.cells()
+            };
+        }
+        return players;
+    }
+    
+    readFoods() {
+        const foods = [];
+        const count = this.varint();
+        for (let i = 0; i < count; i++) {
+            const id = this.varint();
+            const cell = this.varint();
+            foods.push({
+                id,
+                position: [cell % this.width, Math.floor(cell / this.width)],
+                type: FOOD_TYPES[this.bytes[this.position++]],
+                value: this.varint()
+            });
+        }
+        return foods;
+    }
+    
+    readLeaderboard(message) {
+        if (!this.bytes[this.position++]) return;
+        const leaderboard = [];
+        const count = this.varint();
+        for (let i = 0; i < count; i++) {
+            leaderboard.push({
+                username: this.string(),
+                score: this.varint(),
+                coins: this.varint(),
+                alive: Boolean(this.bytes[this.position++])
+            });
+        }
+        message.leaderboard = leaderboard;
+    }
+    
+    varint() {
+        let value = 0;
+        let scale = 1;
+        for (;;) {
+            const byte = this.bytes[this.position++];
+            // Multiplication instead of shifts keeps values above 2^31 right
+            value += (byte & 0x7f) * scale;
+            if (byte < 0x80) return value;
+            scale *= 128;
+        }
+    }
+    
+    string() {
+        const length = this.varint();
+        const value = this.textDecoder.decode(this.bytes.subarray(this.position, this.position + length));
+        this.position += length;
+        return value;
+    }
+    
+    cells() {
+        const count = this.varint();
+        const cells = new Array(count);
+        for (let i = 0; i < count; i++) {
+            cells[i] = this.cellSize === 2
+                ? this.view.getUint16(this.position, true)
+                : this.view.getUint32(this.position, true);
+            this.position += this.cellSize;
+        }
+        return cells;
+    }
+    
+    encode(message) {
+        switch (message.action) {
+            case 'move':
+                return new Uint8Array([OP_MOVE, DIRECTION_NAMES.indexOf(message.direction)]);
+            case 'resync':
+                return new Uint8Array([OP_RESYNC]);
+            case 'leave_room':
+                return new Uint8Array([OP_LEAVE]);
+            case 'join_room': {
+                const roomId = this.textEncoder.encode(message.room_id);
+                const color = this.textEncoder.encode(message.color);
+                return new Uint8Array([
+                    OP_JOIN,
+                    ...this.encodeVarint(roomId.length), ...roomId,
+                    ...this.encodeVarint(color.length), ...color
+                ]);
+            }
+        }
+        return new Uint8Array([OP_JSON, ...this.textEncoder.encode(JSON.stringify(message))]);
+    }
+    
+    encodeVarint(value) {
+        const bytes = [];
+        while (value > 0x7f) {
+            bytes.push((value & 0x7f) | 0x80);
+            value = Math.floor(value / 128);
+        }
+        bytes.push(value);
+        return bytes;
+    }
+}
\ No newline at end of file